@@ -0,0 +1,86 @@
+# backend/core/async_database.py — АСИНХРОННЫЙ ФАСАД К database.py
+"""
+Те же функции, что и в backend.core.database, но в виде корутин.
+
+psycopg2 — синхронный драйвер, поэтому каждый вызов уходит в выделенный
+ThreadPoolExecutor (по размеру пула соединений). Цикл событий WebSocket-сервера
+больше не блокируется медленным запросом: пинги и остальные клиенты продолжают
+обслуживаться, пока запрос выполняется в своём потоке.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.core import database as db
+
+# Потоков столько же, сколько соединений в пуле: лишние потоки всё равно ждали бы соединение
+_executor = ThreadPoolExecutor(
+    max_workers=int(db.POOL_CONFIG.get("maxconn", 10)),
+    thread_name_prefix="db",
+)
+
+
+async def run_db(fn, *args, **kwargs):
+    """Выполнить синхронную функцию БД в пуле потоков и дождаться результата."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def _async(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run_db(fn, *args, **kwargs)
+    return wrapper
+
+
+def shutdown_executor(wait: bool = True):
+    _executor.shutdown(wait=wait)
+
+
+# --- Заявки ---
+load_all_requests = _async(db.load_all_requests)
+load_requests_page = _async(db.load_requests_page)
+load_requests_since = _async(db.load_requests_since)
+query_requests = _async(db.query_requests)
+get_requests_revision = _async(db.get_requests_revision)
+prune_request_changelog = _async(db.prune_request_changelog)
+get_request_from_db = _async(db.get_request_from_db)
+save_request_to_db = _async(db.save_request_to_db)
+patch_request = _async(db.patch_request)
+deleteTask = _async(db.deleteTask)
+add_request_comment = _async(db.add_request_comment)
+get_request_comments = _async(db.get_request_comments)
+
+# --- Пользователи (bcrypt тоже уводим с цикла событий — он намеренно медленный) ---
+load_all_users = _async(db.load_all_users)
+add_user = _async(db.add_user)
+get_user = _async(db.get_user)
+check_password = _async(db.check_password)
+
+# --- Настройки ---
+save_setting = _async(db.save_setting)
+load_setting = _async(db.load_setting)
+get_all_settings = _async(db.get_all_settings)
+
+# --- Статусы машин ---
+list_vehicle_statuses = _async(db.list_vehicle_statuses)
+list_vehicle_statuses_snapshot = _async(db.list_vehicle_statuses_snapshot)
+list_vehicle_statuses_since = _async(db.list_vehicle_statuses_since)
+prune_vehicle_status_deletions = _async(db.prune_vehicle_status_deletions)
+upsert_vehicle_status = _async(db.upsert_vehicle_status)
+reconcile_statuses_for_request = _async(db.reconcile_statuses_for_request)
+reconcile_statuses_from_request = _async(db.reconcile_statuses_from_request)
+set_vehicle_status_text = _async(db.set_vehicle_status_text)
+toggle_vehicle_unloaded = _async(db.toggle_vehicle_unloaded)
+all_unloaded_for_request = _async(db.all_unloaded_for_request)
+find_vehicle_conflicts = _async(db.find_vehicle_conflicts)
+vehicle_history = _async(db.vehicle_history)
+set_request_status_closed = _async(db.set_request_status_closed)
+close_request_if_unloaded = _async(db.close_request_if_unloaded)
+close_all_unloaded_requests = _async(db.close_all_unloaded_requests)
+claim_job_run = _async(db.claim_job_run)
+finish_job_run = _async(db.finish_job_run)
+clear_daily_status_texts = _async(db.clear_daily_status_texts)
+reset_daily_status_texts_if_needed = _async(db.reset_daily_status_texts_if_needed)
+cleanup_unloaded_rows_older_than_48h = _async(db.cleanup_unloaded_rows_older_than_48h)
+cleanup_completed_older_than_48h = _async(db.cleanup_completed_older_than_48h)
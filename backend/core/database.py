@@ -3,11 +3,27 @@ import psycopg2.extras
 import logging
 import json
 import os
+import datetime
+import threading
+from contextlib import contextmanager
 import bcrypt
 
+from backend.core.db_pool import ConnectionPool
+from backend.core.request_cache import (
+    RequestCache,
+    CacheInvalidationListener,
+    NOTIFY_CHANNEL,
+    new_process_token,
+)
+
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), "../config/config.json")
 with open(CONFIG_PATH, "r", encoding="utf-8") as f:
-    DB_CONFIG = json.load(f)
+    APP_CONFIG = json.load(f)
+
+# Параметры подключения — только «плоские» ключи; вложенные секции (pool и т.п.) — настройки
+DB_CONFIG = {k: v for k, v in APP_CONFIG.items() if not isinstance(v, dict)}
+POOL_CONFIG = APP_CONFIG.get("pool") or {}
+CACHE_CONFIG = APP_CONFIG.get("request_cache") or {}
 
 # --- Normalization helpers ---
 def normalize_request_status(value: str|None) -> str:
@@ -46,20 +62,395 @@ def normalize_vehicle_number(value: str|None) -> str:
     return s    
 
 
+# Ключи в drivers[], где фронт хранит номер ТС (в порядке приоритета)
+VEHICLE_KEYS = ("stateNumber", "vehicleNumber", "plate", "carNumber", "number", "tsNumber")
+# SQL-аналог normalize_vehicle_number: trim + схлопывание пробелов + UPPER
+_SQL_NORMALIZE_VEHICLE = "upper(regexp_replace(btrim({col}), '\\s+', ' ', 'g'))"
+# SQL-аналог driver_vehicle() для элемента drivers[] под псевдонимом {d}; NULL — номера нет
+_SQL_DRIVER_VEHICLE = "NULLIF(" + _SQL_NORMALIZE_VEHICLE.format(
+    col="COALESCE(" + ", ".join(f"NULLIF({{d}}->>'{k}', '')" for k in VEHICLE_KEYS) + ")") + ", '')"
+
+
+def driver_vehicle(driver) -> str|None:
+    """Нормализованный номер ТС водителя: первый непустой ключ из VEHICLE_KEYS."""
+    if not isinstance(driver, dict):
+        return None
+    for key in VEHICLE_KEYS:
+        vv = driver.get(key)
+        if vv:
+            return normalize_vehicle_number(str(vv)) or None
+    return None
+
+
+def first_loading_date(req: dict) -> str|None:
+    """Первая дата из loading_dates (текст как в заявке, до 10 символов) или None."""
+    for ld in (req.get("loading_dates") or []):
+        if not isinstance(ld, dict):
+            continue
+        d = str(ld.get("date") or ld.get("loading_date") or ld.get("day") or "").strip()
+        if d:
+            return d[:10]
+    return None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Ленивая инициализация общего пула (один на процесс)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    DB_CONFIG,
+                    minconn=POOL_CONFIG.get("minconn", 1),
+                    maxconn=POOL_CONFIG.get("maxconn", 10),
+                    acquire_timeout=POOL_CONFIG.get("acquire_timeout", 10),
+                    max_idle=POOL_CONFIG.get("max_idle", 300),
+                    health_check_after=POOL_CONFIG.get("health_check_after", 30),
+                    max_lifetime=POOL_CONFIG.get("max_lifetime", 3600),
+                )
+    return _pool
+
+
+@contextmanager
 def get_conn():
+    """
+    Соединение из пула: `with get_conn() as conn: ...`
+    На выходе из блока — commit (или rollback при исключении) и возврат в пул.
+    """
+    with get_pool().connection() as conn:
+        yield conn
+
+
+def pool_stats() -> dict:
+    """Метрики пула соединений (для server_status / мониторинга)."""
+    return get_pool().stats() if _pool is not None else {}
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+# --- Кэш заявок (write-through) ---
+PROCESS_TOKEN = new_process_token()
+_request_cache = RequestCache(max_closed=CACHE_CONFIG.get("max_closed", 500)) \
+    if CACHE_CONFIG.get("enabled", True) else None
+_cache_listener = None
+
+
+def _cache_notify_enabled() -> bool:
+    return _request_cache is not None and bool(CACHE_CONFIG.get("notify", False))
+
+
+def start_request_cache_listener(force_notify: bool = False):
+    """
+    Подписаться на инвалидации от других процессов (если включено notify).
+    force_notify — включить notify независимо от конфига (несколько воркеров/хостов).
+    """
+    global _cache_listener
+    if force_notify and _request_cache is not None:
+        CACHE_CONFIG["notify"] = True
+    if not _cache_notify_enabled() or _cache_listener is not None:
+        return
+    _cache_listener = CacheInvalidationListener(_request_cache, DB_CONFIG, PROCESS_TOKEN)
+    _cache_listener.start()
+
+
+def _cache_publish(cur, request_id):
+    """NOTIFY внутри той же транзакции — уйдёт другим процессам только после COMMIT."""
+    if _cache_notify_enabled():
+        cur.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, f"{PROCESS_TOKEN}:{request_id}"))
+
+
+def request_cache_stats() -> dict:
+    return _request_cache.stats() if _request_cache is not None else {}
+
+# --- Индексы для query_requests (фильтры по полям JSONB) ---
+# Функции IMMUTABLE — иначе их нельзя использовать в индексах. Если поменять тело функции,
+# построенные по ней индексы надо перестроить: REINDEX INDEX idx_requests_...
+_REQUEST_QUERY_FUNCTIONS = [
+    # Дата из текста: фронт пишет и 'DD-MM-YYYY', и 'YYYY-MM-DD'; мусор -> NULL (а не ошибка индекса)
+    """
+    CREATE OR REPLACE FUNCTION jm_parse_date(t text) RETURNS date AS $$
+    BEGIN
+        IF t ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}' THEN
+            RETURN make_date(substr(t, 1, 4)::int, substr(t, 6, 2)::int, substr(t, 9, 2)::int);
+        ELSIF t ~ '^[0-9]{2}[-./][0-9]{2}[-./][0-9]{4}' THEN
+            RETURN make_date(substr(t, 7, 4)::int, substr(t, 4, 2)::int, substr(t, 1, 2)::int);
+        END IF;
+        RETURN NULL;
+    EXCEPTION WHEN others THEN
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE
+    """,
+    # Диапазон дат загрузки заявки [min, max]; без дат — NULL
+    """
+    CREATE OR REPLACE FUNCTION jm_loading_span(data jsonb) RETURNS daterange AS $$
+        SELECT CASE WHEN min(d) IS NULL THEN NULL ELSE daterange(min(d), max(d), '[]') END
+          FROM (SELECT jm_parse_date(COALESCE(ld->>'date', ld->>'loading_date', ld->>'day')) AS d
+                  FROM jsonb_array_elements(CASE WHEN jsonb_typeof(data->'loading_dates') = 'array'
+                                                 THEN data->'loading_dates' ELSE '[]'::jsonb END) ld
+                 WHERE jsonb_typeof(ld) = 'object') s
+    $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE
+    """,
+    # Нормализованные номера ТС из drivers[] (как normalize_vehicle_number)
+    """
+    CREATE OR REPLACE FUNCTION jm_request_vehicles(data jsonb) RETURNS text[] AS $$
+        SELECT COALESCE(array_agg(DISTINCT v) FILTER (WHERE v IS NOT NULL), '{{}}')
+          FROM (SELECT {vehicle} AS v
+                  FROM jsonb_array_elements(CASE WHEN jsonb_typeof(data->'drivers') = 'array'
+                                                 THEN data->'drivers' ELSE '[]'::jsonb END) d
+                 WHERE jsonb_typeof(d) = 'object') s
+    $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE
+    """.format(vehicle=_SQL_DRIVER_VEHICLE.format(d="d")),
+]
+
+# Ключ сортировки по дате загрузки; заявки без дат — в конце (при сортировке по возрастанию)
+_LOADING_SORT_EXPR = "COALESCE(lower(jm_loading_span({data})), 'infinity'::date)"
+
+_REQUEST_QUERY_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_requests_status ON requests ((data->>'status'), id)",
+    "CREATE INDEX IF NOT EXISTS idx_requests_last_editor ON requests ((data->>'last_editor'))",
+    "CREATE INDEX IF NOT EXISTS idx_requests_vehicles ON requests USING gin (jm_request_vehicles(data))",
+    "CREATE INDEX IF NOT EXISTS idx_requests_loading_span ON requests USING gist (jm_loading_span(data))",
+    "CREATE INDEX IF NOT EXISTS idx_requests_loading_sort ON requests ((" + _LOADING_SORT_EXPR.format(data="data") + "), id)",
+]
+
+_REQUEST_TRGM_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_requests_from_trgm ON requests USING gin (lower(data->>'from') gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_requests_to_trgm ON requests USING gin (lower(data->>'to') gin_trgm_ops)",
+]
+
+
+# --- Водители и даты загрузки отдельными строками (производные от requests.data) ---
+# Источник правды — JSON заявки; таблицы ведёт триггер в той же транзакции, что и запись
+# заявки (save_request_to_db, patch_request и любые UPDATE data), поэтому они не расходятся.
+_REQUEST_CHILDREN_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS request_drivers (
+        request_id INTEGER NOT NULL REFERENCES requests(id) ON DELETE CASCADE,
+        pos INTEGER NOT NULL,
+        vehicle_number TEXT,            -- нормализованный номер ТС (driver_vehicle), NULL — нет номера
+        driver_date DATE,               -- своя дата водителя (drivers[].date)
+        busy DATERANGE,                 -- занятость ТС: дата водителя, иначе все даты загрузки заявки
+        PRIMARY KEY (request_id, pos)
+    )
+    """,
+    "ALTER TABLE request_drivers ADD COLUMN IF NOT EXISTS busy DATERANGE",
+    "CREATE INDEX IF NOT EXISTS idx_request_drivers_vehicle ON request_drivers(vehicle_number, request_id) "
+    "WHERE vehicle_number IS NOT NULL",
+    """
+    CREATE TABLE IF NOT EXISTS request_loading_dates (
+        request_id INTEGER NOT NULL REFERENCES requests(id) ON DELETE CASCADE,
+        pos INTEGER NOT NULL,
+        load_date DATE,
+        truck_count INTEGER,
+        PRIMARY KEY (request_id, pos)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_request_loading_dates_date ON request_loading_dates(load_date, request_id)",
+    # Строки request_drivers из JSON заявки (и для триггера, и для проверки ещё не сохранённой заявки)
+    """
+    CREATE OR REPLACE FUNCTION jm_request_driver_rows(doc jsonb)
+        RETURNS TABLE (pos integer, vehicle_number text, driver_date date, busy daterange) AS $$
+        SELECT s.pos, s.vehicle_number, s.driver_date,
+               CASE WHEN s.driver_date IS NOT NULL THEN daterange(s.driver_date, s.driver_date, '[]')
+                    ELSE jm_loading_span(doc) END
+          FROM (SELECT (e.pos - 1)::int AS pos, {vehicle} AS vehicle_number,
+                       jm_parse_date(btrim(e.d->>'date')) AS driver_date
+                  FROM jsonb_array_elements(CASE WHEN jsonb_typeof(doc->'drivers') = 'array'
+                                                 THEN doc->'drivers' ELSE '[]'::jsonb END) WITH ORDINALITY AS e(d, pos)
+                 WHERE jsonb_typeof(e.d) = 'object') s
+    $$ LANGUAGE sql IMMUTABLE
+    """.format(vehicle=_SQL_DRIVER_VEHICLE.format(d="e.d")),
+    """
+    CREATE OR REPLACE FUNCTION jm_sync_request_children(rid integer, doc jsonb) RETURNS void AS $$
+    BEGIN
+        DELETE FROM request_drivers WHERE request_id = rid;
+        INSERT INTO request_drivers (request_id, pos, vehicle_number, driver_date, busy)
+        SELECT rid, r.pos, r.vehicle_number, r.driver_date, r.busy FROM jm_request_driver_rows(doc) r;
+
+        DELETE FROM request_loading_dates WHERE request_id = rid;
+        INSERT INTO request_loading_dates (request_id, pos, load_date, truck_count)
+        SELECT rid, e.pos - 1,
+               jm_parse_date(btrim(COALESCE(e.ld->>'date', e.ld->>'loading_date', e.ld->>'day'))),
+               CASE WHEN e.ld->>'truck_count' ~ '^[0-9]{1,6}$' THEN (e.ld->>'truck_count')::int END
+          FROM jsonb_array_elements(CASE WHEN jsonb_typeof(doc->'loading_dates') = 'array'
+                                         THEN doc->'loading_dates' ELSE '[]'::jsonb END) WITH ORDINALITY AS e(ld, pos)
+         WHERE jsonb_typeof(e.ld) = 'object';
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION requests_sync_children() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT'
+           OR OLD.data->'drivers' IS DISTINCT FROM NEW.data->'drivers'
+           OR OLD.data->'loading_dates' IS DISTINCT FROM NEW.data->'loading_dates' THEN
+            PERFORM jm_sync_request_children(NEW.id, NEW.data);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS trg_requests_children ON requests",
+    """
+    CREATE TRIGGER trg_requests_children AFTER INSERT OR UPDATE OF data ON requests
+    FOR EACH ROW EXECUTE FUNCTION requests_sync_children()
+    """,
+]
+
+
+# Поиск пересечений «номер ТС + диапазон дат»: составной GiST, если есть btree_gist,
+# иначе GiST только по диапазону (номер тогда отбирает idx_request_drivers_vehicle)
+_BUSY_INDEX_SQL = ("CREATE INDEX IF NOT EXISTS idx_request_drivers_busy ON request_drivers "
+                   "USING gist (vehicle_number, busy) WHERE vehicle_number IS NOT NULL AND busy IS NOT NULL")
+_BUSY_INDEX_FALLBACK_SQL = ("CREATE INDEX IF NOT EXISTS idx_request_drivers_busy_range ON request_drivers "
+                            "USING gist (busy) WHERE vehicle_number IS NOT NULL AND busy IS NOT NULL")
+
+
+# --- Фоновые задачи (backend/services/scheduler.py) ---
+# Частичные индексы ровно под WHERE фоновых задач: в них только строки, которые задача
+# может тронуть, поэтому проход не зависит от общего числа статусов/заявок.
+_JOB_INDEXES = [
+    # clear_daily_status_texts
+    "CREATE INDEX IF NOT EXISTS idx_vs_status_date_open ON vehicle_statuses(status_date) "
+    "WHERE unloaded = FALSE AND status_date IS NOT NULL",
+    # cleanup_unloaded_rows_older_than_48h
+    "CREATE INDEX IF NOT EXISTS idx_vs_unload_date_done ON vehicle_statuses(unload_date) "
+    "WHERE unloaded = TRUE AND unload_date IS NOT NULL",
+    # close_all_unloaded_requests — только незакрытые заявки
+    "CREATE INDEX IF NOT EXISTS idx_requests_open ON requests(id) "
+    "WHERE COALESCE(data->>'status', '') <> 'closed'",
+    # prune_request_changelog / prune_vehicle_status_deletions
+    "CREATE INDEX IF NOT EXISTS idx_request_changelog_changed_at ON request_changelog(changed_at)",
+    "CREATE INDEX IF NOT EXISTS idx_vsd_deleted_at ON vehicle_status_deletions(deleted_at)",
+    """
+    CREATE TABLE IF NOT EXISTS scheduler_runs (
+        job TEXT PRIMARY KEY,
+        slot TIMESTAMPTZ NOT NULL,      -- плановое время последнего запуска (по расписанию)
+        owner TEXT,                     -- кто запустил: host:pid
+        started_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        finished_at TIMESTAMPTZ,
+        duration_ms INTEGER,
+        runs BIGINT NOT NULL DEFAULT 0,
+        failures BIGINT NOT NULL DEFAULT 0,
+        last_error TEXT
+    )
+    """,
+]
+
+# Класс advisory-lock для задач планировщика (второй ключ — hashtext(имя задачи))
+SCHEDULER_LOCK_CLASS = 7300102
+
+
+def claim_job_run(job: str, slot, owner: str, lease_seconds: int) -> bool:
+    """
+    Захват запуска задачи job за плановое время slot. True — запускаем мы.
+    Под pg_try_advisory_xact_lock: пока один процесс решает, остальные сразу получают False.
+    Слот занимается один раз; новый слот не выдаётся, пока прошлый запуск не закончен
+    (или не истекла аренда lease_seconds — процесс мог упасть посреди задачи).
+    """
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        conn.cursor().execute("SELECT 1")  # Проверка подключения
-        return conn
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_xact_lock(%s, hashtext(%s))", (SCHEDULER_LOCK_CLASS, job))
+                if not cur.fetchone()[0]:
+                    return False
+                cur.execute("""
+                    INSERT INTO scheduler_runs (job, slot, owner, started_at)
+                    VALUES (%(job)s, %(slot)s, %(owner)s, NOW())
+                    ON CONFLICT (job) DO UPDATE
+                        SET slot = EXCLUDED.slot, owner = EXCLUDED.owner,
+                            started_at = NOW(), finished_at = NULL
+                      WHERE scheduler_runs.slot < EXCLUDED.slot
+                        AND (scheduler_runs.finished_at IS NOT NULL
+                             OR scheduler_runs.started_at < NOW() - make_interval(secs => %(lease)s))
+                    RETURNING job
+                """, {"job": job, "slot": slot, "owner": owner, "lease": int(lease_seconds)})
+                return cur.fetchone() is not None
+    except Exception as e:
+        logging.error(f"[database] claim_job_run {job} error: {e}")
+        return False
+
+
+def finish_job_run(job: str, owner: str, duration_ms: int, error: str|None = None):
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE scheduler_runs
+                       SET finished_at = NOW(), duration_ms = %s,
+                           runs = runs + 1, failures = failures + %s, last_error = %s
+                     WHERE job = %s AND owner = %s
+                """, (int(duration_ms), 1 if error else 0, error, job, owner))
     except Exception as e:
-        logging.error(f"Database connection error: {e}")
-        raise
+        logging.error(f"[database] finish_job_run {job} error: {e}")
+
+
+def _init_request_children(cur):
+    cur.execute("""
+        SELECT to_regclass('request_drivers') IS NULL
+            OR NOT EXISTS (SELECT 1 FROM information_schema.columns
+                            WHERE table_name = 'request_drivers' AND column_name = 'busy')
+    """)
+    first_run = cur.fetchone()[0]
+    for sql in _REQUEST_CHILDREN_SQL:
+        cur.execute(sql)
+    cur.execute("SAVEPOINT jm_btree_gist")
+    try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+        cur.execute(_BUSY_INDEX_SQL)
+        cur.execute("RELEASE SAVEPOINT jm_btree_gist")
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT jm_btree_gist")
+        logging.warning(f"[database] btree_gist недоступен, занятость ТС — GiST только по датам: {e}")
+        cur.execute(_BUSY_INDEX_FALLBACK_SQL)
+    if first_run:
+        # Бэкфилл заявок, сохранённых до появления таблиц (один раз)
+        cur.execute("SELECT count(jm_sync_request_children(id, data)) FROM requests")
+        logging.info(f"[database] request_drivers/request_loading_dates: backfilled {cur.fetchone()[0]} requests")
+
+
+def _init_request_query_indexes(cur):
+    for sql in _REQUEST_QUERY_FUNCTIONS:
+        cur.execute(sql)
+    for sql in _REQUEST_QUERY_INDEXES:
+        cur.execute(sql)
+    # pg_trgm — для поиска по подстроке в from/to; без прав на расширение работаем без него
+    cur.execute("SAVEPOINT jm_trgm")
+    try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for sql in _REQUEST_TRGM_INDEXES:
+            cur.execute(sql)
+        cur.execute("RELEASE SAVEPOINT jm_trgm")
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT jm_trgm")
+        logging.warning(f"[database] pg_trgm недоступен, поиск по from/to без индекса: {e}")
+
+
 # Инициализация таблиц
 
 
+# xid транзакции, записавшей строку (для водяного знака sync_since / statuses_since).
+# Старые строки получают xid миграции — они попадут в первую дельту после неё.
+_ADD_TXID_SQL = "ALTER TABLE {table} ADD COLUMN IF NOT EXISTS txid xid8 NOT NULL DEFAULT pg_current_xact_id()"
+
+# Ключ advisory-lock для init_db: воркеры стартуют одновременно, DDL выполняем по очереди
+INIT_DB_LOCK_KEY = 7300101
+
+
 def init_db():
     with get_conn() as conn:
         with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (INIT_DB_LOCK_KEY,))
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS requests (
                     id SERIAL PRIMARY KEY,
@@ -105,7 +496,268 @@ def init_db():
             cur.execute("ALTER TABLE vehicle_statuses ADD COLUMN IF NOT EXISTS status_date DATE")
             cur.execute("ALTER TABLE vehicle_statuses ADD COLUMN IF NOT EXISTS unloaded BOOLEAN NOT NULL DEFAULT FALSE")
             cur.execute("ALTER TABLE vehicle_statuses ADD COLUMN IF NOT EXISTS unload_date DATE")
+
+            # Версионирование статусов для дельта-синхронизации (statuses_delta / statuses_since):
+            # каждая вставка/изменение получает новый номер из последовательности,
+            # удаление оставляет «надгробие» с номером версии в vehicle_status_deletions.
+            cur.execute("CREATE SEQUENCE IF NOT EXISTS vehicle_statuses_version_seq")
+            cur.execute("ALTER TABLE vehicle_statuses ADD COLUMN IF NOT EXISTS version BIGINT")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_vs_version ON vehicle_statuses(version)")
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS vehicle_status_deletions (
+                    id INTEGER PRIMARY KEY,
+                    request_id INTEGER NOT NULL,
+                    vehicle_number TEXT NOT NULL,
+                    version BIGINT NOT NULL,
+                    deleted_at TIMESTAMP NOT NULL DEFAULT NOW()
+                )
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_vsd_version ON vehicle_status_deletions(version)")
+            cur.execute("SELECT NOT EXISTS (SELECT 1 FROM information_schema.columns"
+                        " WHERE table_name = 'vehicle_statuses' AND column_name = 'txid')")
+            statuses_need_txid = cur.fetchone()[0]
+            cur.execute(_ADD_TXID_SQL.format(table="vehicle_statuses"))
+            cur.execute(_ADD_TXID_SQL.format(table="vehicle_status_deletions"))
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_vs_txid ON vehicle_statuses(txid)")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_vsd_txid ON vehicle_status_deletions(txid)")
+            cur.execute("""
+                CREATE OR REPLACE FUNCTION vehicle_statuses_bump_version() RETURNS trigger AS $$
+                BEGIN
+                    NEW.version := nextval('vehicle_statuses_version_seq');
+                    NEW.txid := pg_current_xact_id();
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql
+            """)
+            cur.execute("""
+                CREATE OR REPLACE FUNCTION vehicle_statuses_log_delete() RETURNS trigger AS $$
+                BEGIN
+                    INSERT INTO vehicle_status_deletions (id, request_id, vehicle_number, version, txid)
+                    VALUES (OLD.id, OLD.request_id, OLD.vehicle_number, nextval('vehicle_statuses_version_seq'),
+                            pg_current_xact_id())
+                    ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version, txid = EXCLUDED.txid,
+                                                   deleted_at = NOW();
+                    RETURN OLD;
+                END
+                $$ LANGUAGE plpgsql
+            """)
+            cur.execute("DROP TRIGGER IF EXISTS trg_vs_version ON vehicle_statuses")
+            cur.execute("""
+                CREATE TRIGGER trg_vs_version BEFORE INSERT OR UPDATE ON vehicle_statuses
+                FOR EACH ROW EXECUTE FUNCTION vehicle_statuses_bump_version()
+            """)
+            cur.execute("DROP TRIGGER IF EXISTS trg_vs_log_delete ON vehicle_statuses")
+            cur.execute("""
+                CREATE TRIGGER trg_vs_log_delete AFTER DELETE ON vehicle_statuses
+                FOR EACH ROW EXECUTE FUNCTION vehicle_statuses_log_delete()
+            """)
+            # старые строки без версии — триггер проставит её при «пустом» UPDATE
+            cur.execute("UPDATE vehicle_statuses SET last_updated = last_updated WHERE version IS NULL")
+
+            # Ревизии заявок + журнал изменений (sync_since / постраничный sync_all)
+            cur.execute("CREATE SEQUENCE IF NOT EXISTS requests_revision_seq")
+            cur.execute("ALTER TABLE requests ADD COLUMN IF NOT EXISTS revision BIGINT")
+            cur.execute("ALTER TABLE requests ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_requests_revision ON requests(revision)")
+            cur.execute("SELECT NOT EXISTS (SELECT 1 FROM information_schema.columns"
+                        " WHERE table_name = 'requests' AND column_name = 'txid')")
+            requests_need_txid = cur.fetchone()[0]
+            cur.execute(_ADD_TXID_SQL.format(table="requests"))
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_requests_txid ON requests(txid)")
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS request_changelog (
+                    revision BIGINT PRIMARY KEY,
+                    request_id INTEGER NOT NULL,
+                    op CHAR(1) NOT NULL,            -- I / U / D
+                    changed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                )
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_request_changelog_deleted
+                ON request_changelog(revision) WHERE op = 'D'
+            """)
+            cur.execute("""
+                CREATE OR REPLACE FUNCTION requests_bump_revision() RETURNS trigger AS $$
+                BEGIN
+                    NEW.revision := nextval('requests_revision_seq');
+                    NEW.txid := pg_current_xact_id();
+                    NEW.updated_at := NOW();
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql
+            """)
+            cur.execute("""
+                CREATE OR REPLACE FUNCTION requests_log_change() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP = 'DELETE' THEN
+                        INSERT INTO request_changelog (revision, request_id, op)
+                        VALUES (nextval('requests_revision_seq'), OLD.id, 'D');
+                        RETURN OLD;
+                    END IF;
+                    INSERT INTO request_changelog (revision, request_id, op)
+                    VALUES (NEW.revision, NEW.id, CASE WHEN TG_OP = 'INSERT' THEN 'I' ELSE 'U' END);
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql
+            """)
+            cur.execute("DROP TRIGGER IF EXISTS trg_requests_revision ON requests")
+            cur.execute("""
+                CREATE TRIGGER trg_requests_revision BEFORE INSERT OR UPDATE ON requests
+                FOR EACH ROW EXECUTE FUNCTION requests_bump_revision()
+            """)
+            cur.execute("DROP TRIGGER IF EXISTS trg_requests_changelog ON requests")
+            cur.execute("""
+                CREATE TRIGGER trg_requests_changelog AFTER INSERT OR UPDATE OR DELETE ON requests
+                FOR EACH ROW EXECUTE FUNCTION requests_log_change()
+            """)
+            cur.execute("UPDATE requests SET data = data WHERE revision IS NULL")
+
+            # Комментарии — отдельная append-only таблица (вместо массива внутри JSON заявки).
+            # Ревизия из той же последовательности, что и у заявок: новый комментарий
+            # попадает в sync_since как изменение заявки.
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS request_comments (
+                    id BIGSERIAL PRIMARY KEY,
+                    request_id INTEGER NOT NULL REFERENCES requests(id) ON DELETE CASCADE,
+                    data JSONB NOT NULL,
+                    revision BIGINT NOT NULL DEFAULT nextval('requests_revision_seq'),
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                )
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_request_comments_req ON request_comments(request_id, id)")
+            # Таблица, созданная без внешнего ключа: чистим «осиротевшие» комментарии и добавляем его
+            cur.execute("""
+                SELECT 1 FROM pg_constraint
+                 WHERE conrelid = 'request_comments'::regclass AND contype = 'f'
+            """)
+            if cur.fetchone() is None:
+                cur.execute("""
+                    DELETE FROM request_comments c
+                     WHERE NOT EXISTS (SELECT 1 FROM requests r WHERE r.id = c.request_id)
+                """)
+                cur.execute("""
+                    ALTER TABLE request_comments ADD CONSTRAINT request_comments_request_id_fkey
+                    FOREIGN KEY (request_id) REFERENCES requests(id) ON DELETE CASCADE
+                """)
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_request_comments_revision ON request_comments(revision)")
+            cur.execute(_ADD_TXID_SQL.format(table="request_comments"))
+            cur.execute(_ADD_TXID_SQL.format(table="request_changelog"))
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_request_comments_txid ON request_comments(txid)")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_request_changelog_deleted_txid "
+                        "ON request_changelog(txid) WHERE op = 'D'")
+            # До txid клиенты держали ревизию/версию — с водяным знаком она несравнима:
+            # поднимаем «пол», и такие клиенты один раз получают полную выгрузку
+            for key, needed in (("request_changelog_floor", requests_need_txid),
+                                ("vehicle_status_deletions_floor", statuses_need_txid)):
+                if needed:
+                    cur.execute("""
+                        INSERT INTO app_settings (key, value) VALUES (%s, pg_current_xact_id()::text)
+                        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+                    """, (key,))
+            # Миграция: переносим старые data->'comments' в таблицу (идемпотентно — ключ удаляется)
+            cur.execute("""
+                INSERT INTO request_comments (request_id, data)
+                SELECT r.id, c.value
+                  FROM requests r
+                  CROSS JOIN LATERAL jsonb_array_elements(r.data->'comments') WITH ORDINALITY AS c(value, ord)
+                 WHERE jsonb_typeof(r.data->'comments') = 'array'
+                   AND jsonb_typeof(c.value) = 'object'
+                 ORDER BY r.id, c.ord
+            """)
+            cur.execute("UPDATE requests SET data = data - 'comments' WHERE data ? 'comments'")
+
+            # Координаты from/to для карты (/map/data). Тексты пишет триггер на любом сохранении
+            # заявки; координаты — фоновый геокодер (services/request_geo.py), только для
+            # изменившихся текстов. version — для ETag ответа /map/data.
+            cur.execute("CREATE SEQUENCE IF NOT EXISTS request_geo_version_seq")
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS request_geo (
+                    request_id INTEGER PRIMARY KEY REFERENCES requests(id) ON DELETE CASCADE,
+                    status TEXT NOT NULL DEFAULT '',
+                    from_text TEXT NOT NULL DEFAULT '',
+                    to_text TEXT NOT NULL DEFAULT '',
+                    from_lat DOUBLE PRECISION,
+                    from_lon DOUBLE PRECISION,
+                    to_lat DOUBLE PRECISION,
+                    to_lon DOUBLE PRECISION,
+                    geo_attempts INTEGER NOT NULL DEFAULT 0,
+                    version BIGINT NOT NULL DEFAULT nextval('request_geo_version_seq'),
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                )
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_request_geo_pending ON request_geo(request_id)
+                WHERE (from_lat IS NULL AND from_text <> '') OR (to_lat IS NULL AND to_text <> '')
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_request_geo_status ON request_geo(status)")
+            cur.execute("""
+                CREATE OR REPLACE FUNCTION request_geo_bump_version() RETURNS trigger AS $$
+                BEGIN
+                    NEW.version := nextval('request_geo_version_seq');
+                    NEW.updated_at := NOW();
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql
+            """)
+            cur.execute("DROP TRIGGER IF EXISTS trg_request_geo_version ON request_geo")
+            cur.execute("""
+                CREATE TRIGGER trg_request_geo_version BEFORE UPDATE ON request_geo
+                FOR EACH ROW EXECUTE FUNCTION request_geo_bump_version()
+            """)
+            cur.execute("""
+                CREATE OR REPLACE FUNCTION requests_sync_geo() RETURNS trigger AS $$
+                BEGIN
+                    INSERT INTO request_geo (request_id, status, from_text, to_text)
+                    VALUES (NEW.id,
+                            lower(COALESCE(NEW.data->>'status', '')),
+                            btrim(COALESCE(NEW.data->>'from', '')),
+                            btrim(COALESCE(NEW.data->>'to', '')))
+                    ON CONFLICT (request_id) DO UPDATE SET
+                        status = EXCLUDED.status,
+                        from_text = EXCLUDED.from_text,
+                        to_text = EXCLUDED.to_text,
+                        -- сменился текст — старые координаты больше не верны
+                        from_lat = CASE WHEN request_geo.from_text = EXCLUDED.from_text THEN request_geo.from_lat END,
+                        from_lon = CASE WHEN request_geo.from_text = EXCLUDED.from_text THEN request_geo.from_lon END,
+                        to_lat = CASE WHEN request_geo.to_text = EXCLUDED.to_text THEN request_geo.to_lat END,
+                        to_lon = CASE WHEN request_geo.to_text = EXCLUDED.to_text THEN request_geo.to_lon END,
+                        geo_attempts = CASE WHEN request_geo.from_text = EXCLUDED.from_text
+                                             AND request_geo.to_text = EXCLUDED.to_text
+                                            THEN request_geo.geo_attempts ELSE 0 END
+                    WHERE (request_geo.status, request_geo.from_text, request_geo.to_text)
+                          IS DISTINCT FROM (EXCLUDED.status, EXCLUDED.from_text, EXCLUDED.to_text);
+                    RETURN NULL;
+                END
+                $$ LANGUAGE plpgsql
+            """)
+            cur.execute("DROP TRIGGER IF EXISTS trg_requests_geo ON requests")
+            cur.execute("""
+                CREATE TRIGGER trg_requests_geo AFTER INSERT OR UPDATE OF data ON requests
+                FOR EACH ROW EXECUTE FUNCTION requests_sync_geo()
+            """)
+            # Бэкфилл для заявок, сохранённых до появления таблицы
+            cur.execute("""
+                INSERT INTO request_geo (request_id, status, from_text, to_text)
+                SELECT id, lower(COALESCE(data->>'status', '')),
+                       btrim(COALESCE(data->>'from', '')), btrim(COALESCE(data->>'to', ''))
+                  FROM requests
+                ON CONFLICT (request_id) DO NOTHING
+            """)
+            # Шина событий между воркерами: тела, не влезающие в NOTIFY (лимит ~8000 байт)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS ws_event_payloads (
+                    id BIGSERIAL PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                )
+            """)
+            _init_request_query_indexes(cur)
+            _init_request_children(cur)
+            for sql in _JOB_INDEXES:
+                cur.execute(sql)
         conn.commit()
+    # прогреваем пул до minconn, чтобы первые запросы не платили за рукопожатие
+    get_pool().warm_up()
 
 def check_tables():
     """Проверяет существование всех необходимых таблиц в БД"""
@@ -118,30 +770,340 @@ def check_tables():
                     (table,)
                 )
                 exists = cur.fetchone()[0]
-                print(f"Таблица '{table}' существует:", exists)
+                logging.info(f"Таблица '{table}' существует: {exists}")
                 if not exists:
-                    print(f"⚠️ Таблица '{table}' отсутствует в БД!")
+                    logging.error(f"⚠️ Таблица '{table}' отсутствует в БД!")
                     return False
     return True
 
 # Загрузить все заявки
 
 
+# Служебные поля, которые приходят из таблиц, а не из JSON заявки (в data их не пишем)
+REQUEST_META_KEYS = ("revision", "comments", "comments_total")
+
+# Сколько последних комментариев отдаём вместе с заявкой; остальные — через get_comments
+COMMENTS_TAIL = 20
+
+# Заявка + «хвост» последних комментариев + их общее число
+_REQUEST_SELECT = f"""
+    SELECT r.id, r.data, r.revision,
+           COALESCE(ct.tail, '[]'::jsonb) AS comments,
+           COALESCE(ct.total, 0) AS comments_total
+      FROM requests r
+      LEFT JOIN LATERAL (
+            SELECT (SELECT jsonb_agg(t.data || jsonb_build_object('comment_id', t.id) ORDER BY t.id)
+                      FROM (SELECT id, data FROM request_comments
+                             WHERE request_id = r.id
+                             ORDER BY id DESC
+                             LIMIT {COMMENTS_TAIL}) t) AS tail,
+                   (SELECT count(*) FROM request_comments c WHERE c.request_id = r.id) AS total
+      ) ct ON TRUE
+"""
+
+# Сколько изменённых заявок ещё выгоднее отдать через sync_since, а не полной выгрузкой
+SYNC_SINCE_MAX_ROWS = 1000
+
+# Ревизия для sync_since — «водяной знак», а не MAX(revision): номера из последовательности
+# выдаются при записи, а коммитятся транзакции в другом порядке. Все транзакции с xid ниже
+# xmin текущего снимка уже завершены, поэтому «изменения начиная с водяного знака» =
+# строки, записанные транзакциями с txid >= знака. Часть из них клиент уже видел —
+# повтор безопасен (клиент заменяет заявку/строку по id).
+_SYNC_WATERMARK_SQL = "SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint AS watermark"
+_REQUESTS_REVISION_SQL = _SYNC_WATERMARK_SQL
+
+
+def _row_to_request(row) -> dict:
+    row_data = dict(row['data']) if row['data'] else {}
+    row_data['id'] = row['id']
+    row_data['revision'] = row.get('revision')
+    row_data['comments'] = list(row.get('comments') or [])
+    row_data['comments_total'] = int(row.get('comments_total') or 0)
+    return row_data
+
+
+def _attach_comments_tail(cur, doc: dict):
+    """Дочитать хвост комментариев для только что записанной заявки (то же соединение)."""
+    cur.execute(f"""
+        SELECT COALESCE(jsonb_agg(t.data || jsonb_build_object('comment_id', t.id) ORDER BY t.id), '[]'::jsonb),
+               (SELECT count(*) FROM request_comments WHERE request_id = %s)
+          FROM (SELECT id, data FROM request_comments
+                 WHERE request_id = %s
+                 ORDER BY id DESC
+                 LIMIT {COMMENTS_TAIL}) t
+    """, (doc['id'], doc['id']))
+    tail, total = cur.fetchone()
+    doc['comments'] = list(tail or [])
+    doc['comments_total'] = int(total or 0)
+    return doc
+
+
 def load_all_requests():
     try:
         with get_conn() as conn:
             with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-                cur.execute("SELECT id, data FROM requests ORDER BY id")
-                result = []
-                for row in cur.fetchall():
-                    row_data = dict(row['data']) if row['data'] else {}
-                    row_data['id'] = row['id']
-                    result.append(row_data)
-                return result
+                cur.execute(_REQUEST_SELECT + " ORDER BY r.id")
+                return [_row_to_request(row) for row in cur.fetchall()]
     except Exception as e:
         logging.error(f"[database] Ошибка при чтении всех заявок: {e}")
         return []
 
+
+def count_request_places():
+    """
+    Сколько раз каждое место встречается в from/to заявок (до первой запятой) —
+    для ранжирования автокомплита. Считает сама БД, тела заявок не выгружаются.
+    Возвращает [(место, количество), ...].
+    """
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT place, count(*)
+                      FROM (SELECT btrim(split_part(r.data->>f.field, ',', 1)) AS place
+                              FROM requests r
+                             CROSS JOIN (VALUES ('from'), ('to')) AS f(field)) p
+                     WHERE place <> ''
+                     GROUP BY place
+                """)
+                return [(place, int(n)) for place, n in cur.fetchall()]
+    except Exception as e:
+        logging.error(f"[database] Ошибка подсчёта мест в заявках: {e}")
+        return []
+
+
+def get_requests_revision() -> int:
+    """Текущая (максимальная) ревизия заявок."""
+    try:
+        with get_conn() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute(_REQUESTS_REVISION_SQL)
+                return int(cur.fetchone()['watermark'] or 0)
+    except Exception as e:
+        logging.error(f"[database] Ошибка чтения ревизии заявок: {e}")
+        return 0
+
+
+def load_requests_page(after_id: int = 0, limit: int = 500):
+    """
+    Постраничная выгрузка по курсору id (для холодного старта).
+    Возвращает (rows, next_cursor|None, revision). Ревизию первой страницы клиент
+    потом отдаёт в sync_since, чтобы догнать изменения, случившиеся во время выгрузки.
+    """
+    try:
+        limit = max(1, min(int(limit or 500), 5000))
+        with get_conn() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute(_REQUESTS_REVISION_SQL)
+                revision = int(cur.fetchone()['watermark'] or 0)
+                cur.execute(_REQUEST_SELECT + """
+                    WHERE r.id > %s
+                    ORDER BY r.id
+                    LIMIT %s
+                """, (int(after_id or 0), limit + 1))
+                rows = cur.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = rows[-1]['id'] if (has_more and rows) else None
+        return [_row_to_request(r) for r in rows], next_cursor, revision
+    except Exception as e:
+        logging.error(f"[database] Ошибка постраничного чтения заявок: {e}")
+        return [], None, 0
+
+
+# --- Запрос заявок с фильтрами (query_requests) ---
+QUERY_MAX_LIMIT = 500
+
+# сортировка -> выражение ключа (id добавляется вторым ключом для однозначного курсора)
+_QUERY_SORTS = {
+    "id": None,
+    "loading_date": _LOADING_SORT_EXPR.format(data="r.data"),
+    "revision": "r.revision",
+}
+
+
+def _like_contains(text: str) -> str:
+    escaped = str(text).strip().lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _parse_filter_date(value):
+    """'YYYY-MM-DD' или 'DD-MM-YYYY' -> 'YYYY-MM-DD' (None — без границы)."""
+    s = str(value or "").strip()[:10]
+    if not s:
+        return None
+    for fmt in ("%Y-%m-%d", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%Y"):
+        try:
+            return datetime.datetime.strptime(s, fmt).date().isoformat()
+        except ValueError:
+            continue
+    raise ValueError(f"bad date: {value}")
+
+
+def build_requests_query(filters: dict|None = None, sort: str = "id", order: str = "desc",
+                         limit: int = 100, cursor=None):
+    """
+    SQL + параметры для query_requests. Каждое условие написано так, чтобы совпасть
+    с индексом из _REQUEST_QUERY_INDEXES (выражение в WHERE/ORDER BY — то же, что в индексе).
+    Курсор — [ключ сортировки, id] последней строки предыдущей страницы (keyset).
+    """
+    filters = filters or {}
+    where, params = [], {}
+
+    statuses = filters.get("status")
+    if statuses:
+        if isinstance(statuses, str):
+            statuses = [statuses]
+        params["statuses"] = sorted({normalize_request_status(x) for x in statuses})
+        where.append("r.data->>'status' = ANY(%(statuses)s)")
+
+    date_from = _parse_filter_date(filters.get("date_from"))
+    date_to = _parse_filter_date(filters.get("date_to"))
+    if date_from or date_to:
+        params.update(date_from=date_from, date_to=date_to)
+        # индекс GiST отбирает заявки, чей диапазон [min, max] задевает период;
+        # EXISTS оставляет только те, у которых в периоде есть хотя бы одна дата
+        where.append("jm_loading_span(r.data) && daterange(%(date_from)s::date, %(date_to)s::date, '[]')")
+        where.append("""EXISTS (
+            SELECT 1 FROM jsonb_array_elements(r.data->'loading_dates') ld
+             WHERE jsonb_typeof(ld) = 'object'
+               AND jm_parse_date(COALESCE(ld->>'date', ld->>'loading_date', ld->>'day'))
+                   BETWEEN COALESCE(%(date_from)s::date, '-infinity') AND COALESCE(%(date_to)s::date, 'infinity'))""")
+
+    for field in ("from", "to"):
+        if (filters.get(field) or "").strip():
+            params[field] = _like_contains(filters[field])
+            where.append(f"lower(r.data->>'{field}') LIKE %({field})s")
+
+    if (filters.get("last_editor") or "").strip():
+        params["last_editor"] = filters["last_editor"].strip()
+        where.append("r.data->>'last_editor' = %(last_editor)s")
+
+    vehicle = normalize_vehicle_number(filters.get("vehicle"))
+    if vehicle:
+        params["vehicle"] = [vehicle]
+        where.append("jm_request_vehicles(r.data) @> %(vehicle)s::text[]")
+
+    if sort not in _QUERY_SORTS:
+        raise ValueError(f"bad sort: {sort}")
+    desc = str(order).lower() != "asc"
+    key = _QUERY_SORTS[sort]
+    cmp, direction = ("<", "DESC") if desc else (">", "ASC")
+    if cursor:
+        if key is None:
+            params["cursor_id"] = int(cursor[-1] if isinstance(cursor, (list, tuple)) else cursor)
+            where.append(f"r.id {cmp} %(cursor_id)s")
+        else:
+            params["cursor_key"], params["cursor_id"] = cursor[0], int(cursor[1])
+            where.append(f"({key}, r.id) {cmp} (%(cursor_key)s, %(cursor_id)s)")
+
+    params["limit"] = max(1, min(int(limit or 100), QUERY_MAX_LIMIT)) + 1
+    order_by = f"r.id {direction}" if key is None else f"{key} {direction}, r.id {direction}"
+    # ключ курсора — текстом: 'infinity' у даты в Python не представим
+    select_key = "" if key is None else f", ({key})::text AS sort_key"
+    sql = _REQUEST_SELECT.replace("SELECT r.id,", f"SELECT r.id{select_key},", 1)
+    sql += (" WHERE " + " AND ".join(where) if where else "") + f" ORDER BY {order_by} LIMIT %(limit)s"
+    return sql, params
+
+
+def query_requests(filters: dict|None = None, sort: str = "id", order: str = "desc",
+                   limit: int = 100, cursor=None):
+    """
+    Заявки по фильтрам с keyset-пагинацией.
+    filters: status (строка/список), date_from/date_to (даты загрузки), from, to (подстрока),
+             last_editor, vehicle (номер ТС). sort: id | loading_date | revision; order: asc | desc.
+    Возвращает {"data": [...], "next_cursor": [...]|None} или None при ошибке.
+    """
+    try:
+        sql, params = build_requests_query(filters, sort, order, limit, cursor)
+        with get_conn() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute(sql, params)
+                rows = cur.fetchall()
+        limit = params["limit"] - 1
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = None
+        if has_more and rows:
+            last = rows[-1]
+            next_cursor = [last["sort_key"], last["id"]] if "sort_key" in last else [last["id"]]
+        return {"data": [_row_to_request(r) for r in rows], "next_cursor": next_cursor}
+    except Exception as e:
+        logging.error(f"[database] Ошибка query_requests: {e}")
+        return None
+
+
+def load_requests_since(revision: int, max_rows: int = SYNC_SINCE_MAX_ROWS):
+    """
+    Изменения заявок после ревизии `revision`:
+      {"from_revision", "revision", "changed": [заявка...], "deleted": [id...]}
+    None — дельта невозможна (журнал уже подчищен) или слишком велика: нужна полная выгрузка.
+    """
+    try:
+        revision = int(revision or 0)
+        if revision <= 0:
+            return None
+        with get_conn() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+                cur.execute("SELECT value FROM app_settings WHERE key = 'request_changelog_floor'")
+                floor_row = cur.fetchone()
+                floor = int(floor_row['value']) if floor_row and str(floor_row['value'] or '').isdigit() else 0
+                if revision <= floor:
+                    return None
+
+                cur.execute(_REQUESTS_REVISION_SQL)
+                current = int(cur.fetchone()['watermark'] or 0)
+                # изменённые заявки + заявки с новыми комментариями (revision — водяной знак, см. выше)
+                cur.execute(_REQUEST_SELECT + """
+                    WHERE r.txid >= %(w)s::text::xid8
+                       OR r.id IN (SELECT request_id FROM request_comments WHERE txid >= %(w)s::text::xid8)
+                    ORDER BY r.revision
+                    LIMIT %(limit)s
+                """, {"w": revision, "limit": max_rows + 1})
+                changed = cur.fetchall()
+                if len(changed) > max_rows:
+                    return None
+                cur.execute("""
+                    SELECT DISTINCT c.request_id
+                    FROM request_changelog c
+                    WHERE c.op = 'D' AND c.txid >= %s::text::xid8
+                      AND NOT EXISTS (SELECT 1 FROM requests r WHERE r.id = c.request_id)
+                """, (revision,))
+                deleted = [r['request_id'] for r in cur.fetchall()]
+        return {
+            "from_revision": revision,
+            "revision": current,
+            "changed": [_row_to_request(r) for r in changed],
+            "deleted": deleted,
+        }
+    except Exception as e:
+        logging.error(f"[database] Ошибка чтения изменений заявок: {e}")
+        return None
+
+
+def prune_request_changelog(keep_days: int = 30):
+    """Подчищаем журнал изменений; клиентам с ревизией ниже «пола» отдаём полную выгрузку."""
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    DELETE FROM request_changelog
+                     WHERE changed_at < NOW() - make_interval(days => %s)
+                 RETURNING txid::text::bigint
+                """, (int(keep_days),))
+                pruned = [r[0] for r in cur.fetchall()]
+                if pruned:
+                    cur.execute("""
+                        INSERT INTO app_settings (key, value)
+                        VALUES ('request_changelog_floor', %s)
+                        ON CONFLICT (key) DO UPDATE
+                            SET value = GREATEST(app_settings.value::bigint, EXCLUDED.value::bigint)::text
+                    """, (str(max(pruned)),))
+            conn.commit()
+    except Exception as e:
+        logging.error(f"[database] Ошибка очистки журнала изменений: {e}")
+
 # Сохранить заявку в БД
 
 
@@ -169,30 +1131,298 @@ def save_request_to_db(new_request: dict):
             # Не пускаем пустой/битый id в UPDATE, чтобы не получить клон через INSERT
             new_request.pop("id", None)
 
+        # служебные поля таблицы в JSON не пишем
+        for key in REQUEST_META_KEYS:
+            new_request.pop(key, None)
+
         with get_conn() as conn:
             with conn.cursor() as cur:
                 if norm_id is not None:
                     cur.execute("""
-                        UPDATE requests SET data=%s WHERE id=%s
+                        UPDATE requests SET data=%s WHERE id=%s RETURNING revision
                     """, (psycopg2.extras.Json(new_request), norm_id))
                     # Если строки с таким id нет — не делаем INSERT, чтобы не плодить клонов
                     if cur.rowcount == 0:
                         logging.error(f"[database] UPDATE 0 rows for id={norm_id}; запись не найдена — сохранение отменено")
                         conn.rollback()
                         return None
+                    new_request["revision"] = cur.fetchone()[0]
                 else:
                     cur.execute("""
-                        INSERT INTO requests (data) VALUES (%s) RETURNING id
+                        INSERT INTO requests (data) VALUES (%s) RETURNING id, revision
                     """, (psycopg2.extras.Json(new_request),))
-                    new_id = cur.fetchone()[0]
+                    new_id, revision = cur.fetchone()
                     new_request["id"] = new_id
+                    new_request["revision"] = revision
+                _attach_comments_tail(cur, new_request)
+                _cache_publish(cur, new_request["id"])
             conn.commit()
+        if _request_cache is not None:
+            _request_cache.put(new_request)
         return new_request
     except Exception as e:
         logging.error(f"[database] Ошибка при сохранении заявки: {e}")
         return None
 
 
+def patch_request(request_id: int, patch: dict, expected_revision: int|None = None):
+    """
+    Атомарный патч верхнеуровневых ключей заявки одним UPDATE: data = data || patch.
+    Без чтения перед записью и без перезаписи всего документа из Python.
+    expected_revision — оптимистичная блокировка: патч применится, только если ревизия совпала.
+
+    Возвращает (status, заявка):
+      ("ok", обновлённая), ("conflict", текущая версия), ("not_found", None), ("error", None)
+    """
+    try:
+        rid = int(str(request_id).strip())
+        patch = dict(patch or {})
+        patch.pop("id", None)
+        for key in REQUEST_META_KEYS:
+            patch.pop(key, None)
+        if 'status' in patch:
+            patch['status'] = normalize_request_status(patch.get('status'))
+
+        with get_conn() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                if expected_revision is None:
+                    cur.execute("""
+                        UPDATE requests SET data = data || %s
+                         WHERE id = %s
+                     RETURNING id, data, revision
+                    """, (psycopg2.extras.Json(patch), rid))
+                else:
+                    cur.execute("""
+                        UPDATE requests SET data = data || %s
+                         WHERE id = %s AND revision = %s
+                     RETURNING id, data, revision
+                    """, (psycopg2.extras.Json(patch), rid, int(expected_revision)))
+                row = cur.fetchone()
+                if row is None:
+                    # либо заявки нет, либо её уже изменил кто-то другой
+                    cur.execute(_REQUEST_SELECT + " WHERE r.id = %s", (rid,))
+                    current = cur.fetchone()
+                    conn.rollback()
+                    if current is None:
+                        return "not_found", None
+                    current = _row_to_request(current)
+                    if _request_cache is not None:
+                        _request_cache.put(current)
+                    return "conflict", current
+                updated = _attach_comments_tail(cur, _row_to_request(row))
+                _cache_publish(cur, rid)
+            conn.commit()
+        if _request_cache is not None:
+            _request_cache.put(updated)
+        return "ok", updated
+    except Exception as e:
+        logging.error(f"[database] Ошибка патча заявки: {e}")
+        return "error", None
+
+
+# --- Комментарии ---
+
+
+def add_request_comment(request_id, comment: dict):
+    """
+    Добавить комментарий одним INSERT по индексу (без чтения/перезаписи заявки).
+    Возвращает комментарий с comment_id или None, если заявки нет / ошибка.
+    """
+    try:
+        rid = int(str(request_id).strip())
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO request_comments (request_id, data)
+                    SELECT %s, %s
+                     WHERE EXISTS (SELECT 1 FROM requests WHERE id = %s)
+                    RETURNING id
+                """, (rid, psycopg2.extras.Json(dict(comment)), rid))
+                row = cur.fetchone()
+                if row is None:
+                    return None
+                _cache_publish(cur, rid)
+            conn.commit()
+        if _request_cache is not None:
+            _request_cache.invalidate(rid)
+        return {**dict(comment), "comment_id": row[0]}
+    except Exception as e:
+        logging.error(f"[database] Ошибка добавления комментария: {e}")
+        return None
+
+
+def get_request_comments(request_id, before_id: int|None = None, limit: int = 50):
+    """
+    Страница комментариев (keyset по id, от новых к старым; внутри страницы — по возрастанию).
+    Возвращает {"comments": [...], "next_before": id|None, "total": N}.
+    """
+    try:
+        rid = int(str(request_id).strip())
+        limit = max(1, min(int(limit or 50), 500))
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT id, data FROM request_comments
+                     WHERE request_id = %s AND (%s::bigint IS NULL OR id < %s::bigint)
+                     ORDER BY id DESC
+                     LIMIT %s
+                """, (rid, before_id, before_id, limit + 1))
+                rows = cur.fetchall()
+                cur.execute("SELECT count(*) FROM request_comments WHERE request_id = %s", (rid,))
+                total = int(cur.fetchone()[0] or 0)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        comments = [{**dict(data), "comment_id": cid} for cid, data in reversed(rows)]
+        return {
+            "comments": comments,
+            "next_before": rows[-1][0] if (has_more and rows) else None,
+            "total": total,
+        }
+    except Exception as e:
+        logging.error(f"[database] Ошибка чтения комментариев: {e}")
+        return {"comments": [], "next_before": None, "total": 0}
+
+
+# ─── Координаты заявок для карты ──────────────────────────────────────────────
+REQUEST_GEO_COLUMNS = """
+    request_id, status, from_text, to_text, from_lat, from_lon, to_lat, to_lon, version
+"""
+
+
+def list_request_geo_pending(limit: int = 50, max_attempts: int = 3):
+    """Заявки, у которых from/to ещё без координат (и геокодер не сдался)."""
+    try:
+        with get_conn() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute(f"""
+                    SELECT {REQUEST_GEO_COLUMNS}
+                      FROM request_geo
+                     WHERE ((from_lat IS NULL AND from_text <> '') OR (to_lat IS NULL AND to_text <> ''))
+                       AND geo_attempts < %s
+                     ORDER BY request_id DESC
+                     LIMIT %s
+                """, (int(max_attempts), int(limit)))
+                return [dict(r) for r in cur.fetchall()]
+    except Exception as e:
+        logging.error(f"list_request_geo_pending error: {e}")
+        return []
+
+
+def set_request_geo_coords(request_id: int, from_text: str, to_text: str,
+                           from_pt: tuple|None, to_pt: tuple|None):
+    """
+    Записывает координаты, только если тексты не поменялись, пока шёл геокодинг.
+    Пустой результат тоже фиксируется (geo_attempts + 1), чтобы не долбить Nominatim.
+    """
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE request_geo SET
+                        from_lat = COALESCE(from_lat, %s), from_lon = COALESCE(from_lon, %s),
+                        to_lat = COALESCE(to_lat, %s), to_lon = COALESCE(to_lon, %s),
+                        geo_attempts = geo_attempts + 1
+                     WHERE request_id = %s AND from_text = %s AND to_text = %s
+                """, (*(from_pt or (None, None)), *(to_pt or (None, None)), int(request_id), from_text, to_text))
+                return cur.rowcount == 1
+    except Exception as e:
+        logging.error(f"set_request_geo_coords error: {e}")
+        return False
+
+
+def load_request_geo(statuses: list[str]|None = None, bbox: tuple|None = None, request_id: int|None = None):
+    """
+    (rows, etag_version): строки request_geo с координатами хотя бы одного конца.
+    bbox = (west, south, east, north) — хотя бы один конец внутри.
+    """
+    where, params = ["(from_lat IS NOT NULL OR to_lat IS NOT NULL)"], []
+    if request_id is not None:
+        where.append("request_id = %s")
+        params.append(int(request_id))
+    if statuses:
+        where.append("status = ANY(%s)")
+        params.append(list(statuses))
+    if bbox:
+        w, s_, e, n = bbox
+        where.append("""((from_lon BETWEEN %s AND %s AND from_lat BETWEEN %s AND %s)
+                      OR (to_lon BETWEEN %s AND %s AND to_lat BETWEEN %s AND %s))""")
+        params += [w, e, s_, n, w, e, s_, n]
+    try:
+        with get_conn() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+                cur.execute("SELECT COALESCE(MAX(version), 0) AS v, COUNT(*) AS n FROM request_geo")
+                row = cur.fetchone()
+                version = f"{row['v']}-{row['n']}"
+                cur.execute(f"""
+                    SELECT {REQUEST_GEO_COLUMNS}
+                      FROM request_geo
+                     WHERE {' AND '.join(where)}
+                     ORDER BY request_id
+                """, params)
+                return [dict(r) for r in cur.fetchall()], version
+    except Exception as e:
+        logging.error(f"load_request_geo error: {e}")
+        return [], None
+
+
+def request_geo_version():
+    """Версия данных карты (для ETag) без выборки строк."""
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COALESCE(MAX(version), 0), COUNT(*) FROM request_geo")
+                v, n = cur.fetchone()
+                return f"{v}-{n}"
+    except Exception as e:
+        logging.error(f"request_geo_version error: {e}")
+        return None
+
+
+# --- Шина событий WebSocket (LISTEN/NOTIFY) ---
+def publish_event(channel: str, envelope: dict, data: str, max_inline: int) -> bool:
+    """
+    NOTIFY с событием для других воркеров. Если тело не влезает в уведомление,
+    кладём его в ws_event_payloads и шлём ссылку "r" (в той же транзакции).
+    """
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                message = json.dumps({**envelope, "d": data}, ensure_ascii=False)
+                if len(message.encode("utf-8")) > max_inline:
+                    cur.execute("INSERT INTO ws_event_payloads (payload) VALUES (%s) RETURNING id", (data,))
+                    message = json.dumps({**envelope, "r": cur.fetchone()[0]})
+                cur.execute("SELECT pg_notify(%s, %s)", (channel, message))
+            conn.commit()
+            return True
+    except Exception as e:
+        logging.error(f"publish_event error: {e}")
+        return False
+
+
+def load_event_payload(payload_id: int):
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT payload FROM ws_event_payloads WHERE id = %s", (int(payload_id),))
+                row = cur.fetchone()
+                return row[0] if row else None
+    except Exception as e:
+        logging.error(f"load_event_payload error: {e}")
+        return None
+
+
+def prune_event_payloads(keep_seconds: int = 300):
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM ws_event_payloads WHERE created_at < NOW() - make_interval(secs => %s)",
+                            (int(keep_seconds),))
+            conn.commit()
+    except Exception as e:
+        logging.error(f"prune_event_payloads error: {e}")
+
+
 def addTask(task_data: dict):
     return save_request_to_db(task_data)
 
@@ -206,11 +1436,14 @@ def deleteTask(task_id: int):
         with get_conn() as conn:
             with conn.cursor() as cur:
                 cur.execute("DELETE FROM requests WHERE id=%s", (task_id,))
+                _cache_publish(cur, task_id)
                 conn.commit()
-        print(f"deleteTask: task_id={task_id} удалена")
+        if _request_cache is not None:
+            _request_cache.invalidate(int(task_id) if str(task_id).strip().isdigit() else task_id)
+        logging.info(f"deleteTask: task_id={task_id} удалена")
         return True
     except Exception as e:
-        print(f"deleteTask: error={e}")
+        logging.error(f"deleteTask: error={e}")
         return False
 
 # --- Пользователи ---
@@ -240,10 +1473,10 @@ def add_user(username: str, password: str, role: str):
                     ON CONFLICT (username) DO NOTHING
                 """, (username, password_hash, role))
                 conn.commit()
-        print(f"add_user: user '{username}' added successfully")
+        logging.info(f"add_user: user '{username}' added successfully")
         return True
     except Exception as e:
-        print(f"add_user: error={e}")
+        logging.error(f"add_user: error={e}")
         return False
 
 def get_user(username: str):
@@ -255,7 +1488,7 @@ def get_user(username: str):
                 """, (username,))
                 return cur.fetchone()
     except Exception as e:
-        print(f"get_user: error={e}")
+        logging.error(f"get_user: error={e}")
         return None
 
 # --- Настройки ---
@@ -306,18 +1539,25 @@ def get_request_from_db(task_id):
         elif isinstance(task_id, float):
             task_id = int(task_id)
 
+        use_cache = _request_cache is not None and isinstance(task_id, int)
+        if use_cache:
+            cached = _request_cache.get(task_id)
+            if cached is not None:
+                return cached
+
         with get_conn() as conn:
             with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-                cur.execute("SELECT id, data FROM requests WHERE id = %s", (task_id,))
+                cur.execute(_REQUEST_SELECT + " WHERE r.id = %s", (task_id,))
                 row = cur.fetchone()
                 if row:
-                    row_data = dict(row['data']) if row['data'] else {}
-                    row_data['id'] = row['id']
-                    return row_data
+                    req = _row_to_request(row)
+                    if use_cache:
+                        _request_cache.put(req)
+                    return req
                 else:
                     return None
     except Exception as e:
-        print(f"get_request_from_db: error={e}")
+        logging.error(f"get_request_from_db: error={e}")
         return None
 
 # ===== Статусы машин =====
@@ -344,13 +1584,23 @@ def ensure_vehicle_statuses_table():
     except Exception as e:
         logging.error(f"ensure_vehicle_statuses_table error: {e}")
 
+VEHICLE_STATUS_COLUMNS = """
+    id, request_id, vehicle_number, load_date, status_text, status_date,
+    unloaded, unload_date, created_at, last_updated, version
+"""
+
+# Сколько изменённых строк ещё выгоднее отправить дельтой, а не полным снапшотом
+STATUSES_DELTA_MAX_ROWS = 500
+
+_STATUSES_VERSION_SQL = _SYNC_WATERMARK_SQL
+
+
 def list_vehicle_statuses():
     try:
         with get_conn() as conn:
             with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT id, request_id, vehicle_number, load_date, status_text, status_date,
-                           unloaded, unload_date, created_at, last_updated
+                cur.execute(f"""
+                    SELECT {VEHICLE_STATUS_COLUMNS}
                     FROM vehicle_statuses
                     ORDER BY unloaded ASC, last_updated DESC, request_id, vehicle_number
                 """)
@@ -359,6 +1609,102 @@ def list_vehicle_statuses():
         logging.error(f"list_vehicle_statuses error: {e}")
         return []
 
+
+def list_vehicle_statuses_snapshot():
+    """Полный снапшот статусов и его версия: (rows, version)."""
+    try:
+        with get_conn() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                # строки и версия — из одного снимка БД
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+                cur.execute(f"""
+                    SELECT {VEHICLE_STATUS_COLUMNS}
+                    FROM vehicle_statuses
+                    ORDER BY unloaded ASC, last_updated DESC, request_id, vehicle_number
+                """)
+                rows = [dict(r) for r in cur.fetchall()]
+                cur.execute(_STATUSES_VERSION_SQL)
+                version = int(cur.fetchone()['watermark'] or 0)
+            return rows, version
+    except Exception as e:
+        logging.error(f"list_vehicle_statuses_snapshot error: {e}")
+        return [], 0
+
+
+def list_vehicle_statuses_since(version: int, max_rows: int = STATUSES_DELTA_MAX_ROWS):
+    """
+    Изменения статусов после версии `version`:
+      {"from_version", "version", "upserts": [row...], "deletes": [{id, request_id, vehicle_number, version}...]}
+    Возвращает None, если дельта невозможна или слишком велика — тогда нужен полный снапшот.
+    """
+    try:
+        version = int(version or 0)
+        if version <= 0:
+            return None
+        with get_conn() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+                # Надгробия старше «пола» уже вычищены — дельту по ним не собрать
+                cur.execute("SELECT value FROM app_settings WHERE key = 'vehicle_status_deletions_floor'")
+                floor_row = cur.fetchone()
+                floor = int(floor_row['value']) if floor_row and str(floor_row['value'] or '').isdigit() else 0
+                if version <= floor:
+                    return None
+
+                # version — водяной знак (см. _SYNC_WATERMARK_SQL), а не номер строки
+                cur.execute(_STATUSES_VERSION_SQL)
+                new_version = int(cur.fetchone()['watermark'] or 0)
+                cur.execute(f"""
+                    SELECT {VEHICLE_STATUS_COLUMNS}
+                    FROM vehicle_statuses
+                    WHERE txid >= %s::text::xid8
+                    ORDER BY version
+                    LIMIT %s
+                """, (version, max_rows + 1))
+                upserts = [dict(r) for r in cur.fetchall()]
+                cur.execute("""
+                    SELECT id, request_id, vehicle_number, version
+                    FROM vehicle_status_deletions
+                    WHERE txid >= %s::text::xid8
+                    ORDER BY version
+                    LIMIT %s
+                """, (version, max_rows + 1))
+                deletes = [dict(r) for r in cur.fetchall()]
+        if len(upserts) + len(deletes) > max_rows:
+            return None
+        return {
+            "from_version": version,
+            "version": new_version,
+            "upserts": upserts,
+            "deletes": deletes,
+        }
+    except Exception as e:
+        logging.error(f"list_vehicle_statuses_since error: {e}")
+        return None
+
+
+def prune_vehicle_status_deletions(keep_days: int = 7):
+    """Удаляем старые «надгробия»; клиентам старше «пола» отдаём полный снапшот."""
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    DELETE FROM vehicle_status_deletions
+                     WHERE deleted_at < NOW() - make_interval(days => %s)
+                 RETURNING txid::text::bigint
+                """, (int(keep_days),))
+                pruned = [r[0] for r in cur.fetchall()]
+                if pruned:
+                    cur.execute("""
+                        INSERT INTO app_settings (key, value)
+                        VALUES ('vehicle_status_deletions_floor', %s)
+                        ON CONFLICT (key) DO UPDATE
+                            SET value = GREATEST(app_settings.value::bigint, EXCLUDED.value::bigint)::text
+                    """, (str(max(pruned)),))
+            conn.commit()
+    except Exception as e:
+        logging.error(f"prune_vehicle_status_deletions error: {e}")
+
 def upsert_vehicle_status(request_id: int, vehicle_number: str, load_date: str|None):
     if not request_id or not vehicle_number:
         return
@@ -378,111 +1724,119 @@ def upsert_vehicle_status(request_id: int, vehicle_number: str, load_date: str|N
         logging.error(f"upsert_vehicle_status error: {e}")
 
 
+_RECONCILE_SQL = """
+    WITH incoming AS ({incoming}),
+    upserted AS (
+        INSERT INTO vehicle_statuses (request_id, vehicle_number, load_date)
+        SELECT %(rid)s, i.vehicle_number, i.load_date FROM incoming i
+        {on_conflict}
+        RETURNING vehicle_number, (xmax = 0) AS inserted
+    ),
+    deleted AS (
+        DELETE FROM vehicle_statuses vs
+         WHERE vs.request_id = %(rid)s
+           AND NOT EXISTS (
+                SELECT 1 FROM incoming i
+                 WHERE i.vehicle_number = {normalized}
+           )
+        RETURNING vs.vehicle_number
+    )
+    SELECT vehicle_number, CASE WHEN inserted THEN 'inserted' ELSE 'updated' END AS op FROM upserted
+    UNION ALL
+    SELECT vehicle_number, 'deleted' AS op FROM deleted
+"""
+
+# Машины из явного списка (номер -> текст даты)
+_INCOMING_FROM_LIST = """
+        SELECT v.vehicle_number, jm_parse_date(v.load_date) AS load_date
+        FROM unnest(%(vehicles)s::text[], %(dates)s::text[]) AS v(vehicle_number, load_date)
+"""
+
+# Машины из request_drivers: дата водителя, иначе первая дата загрузки заявки;
+# один номер у нескольких водителей — берём последнего (как и раньше в Python)
+_INCOMING_FROM_DRIVERS = """
+        SELECT DISTINCT ON (d.vehicle_number)
+               d.vehicle_number,
+               COALESCE(d.driver_date, (SELECT ld.load_date FROM request_loading_dates ld
+                                         WHERE ld.request_id = %(rid)s AND ld.load_date IS NOT NULL
+                                         ORDER BY ld.pos LIMIT 1)) AS load_date
+          FROM request_drivers d
+         WHERE d.request_id = %(rid)s AND d.vehicle_number IS NOT NULL
+         ORDER BY d.vehicle_number, d.pos DESC
+"""
+
+_ON_CONFLICT_UPDATE_DATE = """
+        ON CONFLICT (request_id, vehicle_number) DO UPDATE SET
+            load_date    = COALESCE(EXCLUDED.load_date, vehicle_statuses.load_date),
+            last_updated = NOW()
+        WHERE vehicle_statuses.load_date IS DISTINCT FROM COALESCE(EXCLUDED.load_date, vehicle_statuses.load_date)
+"""
+
+_ON_CONFLICT_NOTHING = """
+        ON CONFLICT (request_id, vehicle_number) DO NOTHING
+"""
+
+
+def _reconcile_vehicle_rows(request_id: int, vehicle_to_date: dict|None, update_existing: bool = True) -> dict:
+    """
+    Одним SQL-запросом: multi-row upsert + anti-join DELETE лишних строк.
+    vehicle_to_date — явный список машин; None — машины заявки из request_drivers.
+    Возвращает {"inserted": [...], "updated": [...], "deleted": [...]} — номера ТС.
+    Неизменившиеся строки не трогаем (и не поднимаем им version/last_updated).
+    """
+    params = {"rid": request_id}
+    if vehicle_to_date is not None:
+        params["vehicles"] = list(vehicle_to_date.keys())
+        params["dates"] = [vehicle_to_date[v] for v in params["vehicles"]]
+    sql = _RECONCILE_SQL.format(
+        incoming=_INCOMING_FROM_LIST if vehicle_to_date is not None else _INCOMING_FROM_DRIVERS,
+        on_conflict=_ON_CONFLICT_UPDATE_DATE if update_existing else _ON_CONFLICT_NOTHING,
+        normalized=_SQL_NORMALIZE_VEHICLE.format(col="vs.vehicle_number"),
+    )
+    changes = {"inserted": [], "updated": [], "deleted": []}
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            for vehicle_number, op in cur.fetchall():
+                changes[op].append(vehicle_number)
+        conn.commit()
+    return changes
+
+
 def reconcile_statuses_for_request(request_id: int, vehicles: list[str], load_date: str|None):
     """Синхронизировать строки по заявке: добавить недостающие, удалить отсутствующие."""
     try:
-        vset = set([ normalize_vehicle_number(v) for v in (vehicles or []) if (v or '').strip() ])
-        with get_conn() as conn:
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-                # Текущие
-                cur.execute("SELECT vehicle_number FROM vehicle_statuses WHERE request_id=%s", (request_id,))
-                current = set([ normalize_vehicle_number(r['vehicle_number']) for r in cur.fetchall() ])
-
-                # Добавить недостающие
-                for v in vset - current:
-                    cur.execute("""
-                        INSERT INTO vehicle_statuses (request_id, vehicle_number, load_date)
-                        VALUES (%s, %s, %s)
-                        ON CONFLICT (request_id, vehicle_number) DO NOTHING
-                    """, (request_id, v, load_date))
-
-                # Удалить лишние
-                if current - vset:
-                    cur.execute("""
-                        DELETE FROM vehicle_statuses
-                        WHERE request_id=%s AND vehicle_number = ANY(%s)
-                    """, (request_id, list(current - vset)))
-
-            conn.commit()
+        vehicle_to_date = {
+            normalize_vehicle_number(v): load_date
+            for v in (vehicles or []) if (v or '').strip()
+        }
+        return _reconcile_vehicle_rows(request_id, vehicle_to_date, update_existing=False)
     except Exception as e:
         logging.error(f"reconcile_statuses_for_request error: {e}")
+        return None
 
 def reconcile_statuses_from_request(req: dict):
     """
     НОВОЕ: синхронизация vehicle_statuses ПО КАЖДОМУ ВОДИТЕЛЮ.
     Для каждой машины берём ДАТУ ЗАГРУЗКИ ИЗ driver.date (если нет — из первой loading_dates).
+    Машины и даты читаются из request_drivers / request_loading_dates, которые триггер
+    обновил вместе с сохранением заявки, — req нужен только ради id.
+    Возвращает {"inserted": [...], "updated": [...], "deleted": [...]} или None при ошибке.
     """
     try:
         if not req:
-            return
+            return None
         # request_id приводим к int
         rid = req.get("id")
         if isinstance(rid, str) and rid.strip().isdigit():
             rid = int(rid.strip())
         if not isinstance(rid, int):
-            return
-
-        # 1) Собрать: { НОРМ_номер_ТС -> дата_загрузки(DD-MM-YYYY)|None }
-        vehicle_to_date: dict[str, str|None] = {}
-        # fallback — первая дата из loading_dates (если у конкретного водителя даты нет)
-        fallback_date = None
-        for ld in (req.get("loading_dates") or []):
-            d = (ld.get("date") or ld.get("loading_date") or ld.get("day") or "").strip()
-            if d:
-                fallback_date = d[:10]
-                break
-
-        for d in (req.get("drivers") or []):
-            # вытаскиваем номер ТС из любого из поддерживаемых ключей
-            v = None
-            for key in ("stateNumber", "vehicleNumber", "plate", "carNumber", "number", "tsNumber"):
-                vv = d.get(key)
-                if vv:
-                    v = normalize_vehicle_number(str(vv))
-                    break
-            if not v:
-                continue
-
-            # дата именно ЭТОГО водителя
-            drv_date = (d.get("date") or "").strip()
-            if drv_date:
-                drv_date = drv_date[:10]
-            else:
-                drv_date = fallback_date
-
-            vehicle_to_date[v] = drv_date  # может быть None
-
-        vset = set(vehicle_to_date.keys())
-
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                # текущие номера в таблице — в «сыром» и нормализованном виде
-                cur.execute("SELECT vehicle_number FROM vehicle_statuses WHERE request_id=%s", (rid,))
-                raw_rows = [ (r[0] or "").strip() for r in cur.fetchall() ]
-                current_norm = set([ normalize_vehicle_number(x) for x in raw_rows ])
-
-                # Добавить/обновить недостающие — с ПЕРСОНАЛЬНОЙ датой
-                for v in vset:
-                    cur.execute("""
-                        INSERT INTO vehicle_statuses (request_id, vehicle_number, load_date)
-                        VALUES (%s, %s, %s)
-                        ON CONFLICT (request_id, vehicle_number)
-                        DO UPDATE SET
-                            load_date    = COALESCE(EXCLUDED.load_date, vehicle_statuses.load_date),
-                            last_updated = NOW()
-                    """, (rid, v, vehicle_to_date.get(v)))
-
-                # Удалить «лишние» строки, чей нормализованный номер не входит в vset
-                extra_raw = [ raw for raw in raw_rows if normalize_vehicle_number(raw) not in vset ]
-                if extra_raw:
-                    cur.execute(
-                        "DELETE FROM vehicle_statuses WHERE request_id=%s AND vehicle_number = ANY(%s)",
-                        (rid, extra_raw)
-                    )
-
-            conn.commit()
+            return None
+        # Один запрос: upsert всех машин заявки + удаление лишних
+        return _reconcile_vehicle_rows(rid, None)
     except Exception as e:
         logging.error(f"reconcile_statuses_from_request error: {e}")
+        return None
 
 
 def set_vehicle_status_text(request_id: int, vehicle_number: str, text: str|None):
@@ -534,7 +1888,7 @@ def cleanup_unloaded_rows_older_than_48h():
                     DELETE FROM vehicle_statuses
                      WHERE unloaded = TRUE
                        AND unload_date IS NOT NULL
-                       AND unload_date < CURRENT_DATE - INTERVAL '2 days'
+                       AND unload_date < CURRENT_DATE - 2
                 """)
             conn.commit()
     except Exception as e:
@@ -571,56 +1925,179 @@ def toggle_vehicle_unloaded(request_id: int, vehicle_number: str, unloaded: bool
     except Exception as e:
         logging.error(f"toggle_vehicle_unloaded error: {e}")
 
+# --- История и занятость ТС (по request_drivers) ---
+VEHICLE_HISTORY_MAX_LIMIT = 200
+VEHICLE_CONFLICTS_LIMIT = 50
+
+_VEHICLE_CONFLICTS_SQL = """
+    WITH mine AS ({mine})
+    SELECT DISTINCT ON (m.vehicle_number, d.request_id)
+           m.vehicle_number, d.request_id,
+           lower(d.busy)::text AS date_from, (upper(d.busy) - 1)::text AS date_to,
+           r.data->>'status' AS status, r.data->>'from' AS "from", r.data->>'to' AS "to"
+      FROM mine m
+      JOIN request_drivers d ON d.vehicle_number = m.vehicle_number AND d.busy && m.busy
+                            AND d.request_id <> %(rid)s
+      JOIN requests r ON r.id = d.request_id
+     WHERE COALESCE(r.data->>'status', '') <> 'closed'
+     ORDER BY m.vehicle_number, d.request_id
+     LIMIT %(limit)s
+"""
+_MINE_SAVED = ("SELECT vehicle_number, busy FROM request_drivers "
+               "WHERE request_id = %(rid)s AND vehicle_number IS NOT NULL AND busy IS NOT NULL")
+_MINE_DRAFT = ("SELECT vehicle_number, busy FROM jm_request_driver_rows(%(doc)s::jsonb) "
+               "WHERE vehicle_number IS NOT NULL AND busy IS NOT NULL")
+
+
+def find_vehicle_conflicts(request_id=None, draft: dict|None = None) -> list|None:
+    """
+    Машины заявки, уже стоящие в других незакрытых заявках на пересекающиеся даты.
+    draft — ещё не сохранённая заявка (проверка до сохранения); без него — сохранённая request_id.
+    Возвращает [{"vehicle_number", "request_id", "date_from", "date_to", "status", "from", "to"}, ...]
+    или None при ошибке.
+    """
+    try:
+        try:
+            rid = int(str(request_id).strip()) if request_id not in (None, "") else -1
+        except ValueError:
+            rid = -1
+        params = {"rid": rid, "limit": VEHICLE_CONFLICTS_LIMIT}
+        if draft is not None:
+            params["doc"] = psycopg2.extras.Json(draft)
+        elif rid < 0:
+            return []
+        sql = _VEHICLE_CONFLICTS_SQL.format(mine=_MINE_DRAFT if draft is not None else _MINE_SAVED)
+        with get_conn() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute(sql, params)
+                return [dict(r) for r in cur.fetchall()]
+    except Exception as e:
+        logging.error(f"[database] Ошибка find_vehicle_conflicts: {e}")
+        return None
+
+
+def vehicle_history(vehicle_number: str, limit: int = 50, before_id=None) -> dict|None:
+    """
+    Заявки, в которых была машина (по нормализованному номеру), новые первыми.
+    Страницы — по курсору before_id (id последней заявки предыдущей страницы).
+    Возвращает {"vehicle_number", "data": [...], "next_cursor": id|None} или None при ошибке.
+    """
+    try:
+        vehicle_number = normalize_vehicle_number(vehicle_number)
+        if not vehicle_number:
+            return {"vehicle_number": "", "data": [], "next_cursor": None}
+        limit = max(1, min(int(limit or 50), VEHICLE_HISTORY_MAX_LIMIT))
+        with get_conn() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT d.request_id,
+                           min(lower(d.busy))::text AS date_from, max(upper(d.busy) - 1)::text AS date_to,
+                           r.data->>'status' AS status, r.data->>'from' AS "from", r.data->>'to' AS "to",
+                           bool_or(vs.unloaded) AS unloaded
+                      FROM request_drivers d
+                      JOIN requests r ON r.id = d.request_id
+                      LEFT JOIN vehicle_statuses vs ON vs.request_id = d.request_id
+                                                   AND vs.vehicle_number = d.vehicle_number
+                     WHERE d.vehicle_number = %(v)s
+                       AND (%(before)s::int IS NULL OR d.request_id < %(before)s::int)
+                     GROUP BY d.request_id, r.id
+                     ORDER BY d.request_id DESC
+                     LIMIT %(limit)s
+                """, {"v": vehicle_number, "before": int(before_id) if before_id else None, "limit": limit + 1})
+                rows = [dict(r) for r in cur.fetchall()]
+        next_cursor = rows[limit - 1]["request_id"] if len(rows) > limit else None
+        return {"vehicle_number": vehicle_number, "data": rows[:limit], "next_cursor": next_cursor}
+    except Exception as e:
+        logging.error(f"[database] Ошибка vehicle_history: {e}")
+        return None
+
+
+# Все машины заявки {rid} выгружены: есть хотя бы одна машина и ни одной без unloaded=TRUE
+_ALL_UNLOADED_COND = """
+    EXISTS (SELECT 1 FROM request_drivers d
+             WHERE d.request_id = {rid} AND d.vehicle_number IS NOT NULL)
+    AND NOT EXISTS (
+        SELECT 1 FROM request_drivers d
+         WHERE d.request_id = {rid} AND d.vehicle_number IS NOT NULL
+           AND NOT EXISTS (
+               SELECT 1 FROM vehicle_statuses vs
+                WHERE vs.request_id = d.request_id AND vs.unloaded
+                  AND {normalized} = d.vehicle_number))
+""".format(rid="{rid}", normalized=_SQL_NORMALIZE_VEHICLE.format(col="vs.vehicle_number"))
+
+# Закрыть заявку(и) одним UPDATE: условие «всё выгружено» проверяется в том же операторе,
+# поэтому между проверкой и записью никто не вклинится; RETURNING — готовый документ для рассылки
+_CLOSE_UNLOADED_SQL = """
+    UPDATE requests r SET data = r.data || '{{"status": "closed"}}'::jsonb
+     WHERE {where}
+       AND COALESCE(r.data->>'status', '') <> 'closed'
+       AND {cond}
+ RETURNING r.id, r.data, r.revision
+"""
+
+
 def all_unloaded_for_request(request_id: int) -> bool:
     """Возвращает True, если ДЛЯ ВСЕХ МАШИН ИЗ ЗАЯВКИ стоит признак unloaded=TRUE.
     Сравнение ведём по НОРМАЛИЗОВАННЫМ номерам, чтобы игнорировать дубликаты/формат."""
     try:
-        # 1) Собираем нормализованные номера из заявки
-        req = get_request_from_db(request_id)
-        if not req:
-            return False
-        expected = set()
-        for d in (req.get("drivers") or []):
-            v = None
-            for key in ("stateNumber","vehicleNumber","plate","carNumber","number","tsNumber"):
-                vv = d.get(key)
-                if vv:
-                    v = normalize_vehicle_number(str(vv))
-                    break
-            if v:
-                expected.add(v)
-        if not expected:
-            return False
-        # 2) Берём все записи по заявке и сводим по нормализованному номеру
-        actual_unloaded = {}
         with get_conn() as conn:
             with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT vehicle_number, unloaded FROM vehicle_statuses WHERE request_id=%s",
-                    (request_id,)
-                )
-                for veh, un in cur.fetchall():
-                    norm = normalize_vehicle_number(veh)
-                    actual_unloaded[norm] = actual_unloaded.get(norm, False) or bool(un)
-        # 3) Для каждой ожидаемой машины должен быть True
-        for v in expected:
-            if not actual_unloaded.get(v, False):
-                return False
-        return True
+                cur.execute("SELECT " + _ALL_UNLOADED_COND.format(rid="%(rid)s"), {"rid": request_id})
+                return bool(cur.fetchone()[0])
     except Exception as e:
         logging.error(f"all_unloaded_for_request error: {e}")
         return False
 
+
+def _close_unloaded(where: str, params: dict) -> list:
+    sql = _CLOSE_UNLOADED_SQL.format(where=where, cond=_ALL_UNLOADED_COND.format(rid="r.id"))
+    closed = []
+    with get_conn() as conn:
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+            for row in rows:
+                closed.append(_attach_comments_tail(cur, _row_to_request(row)))
+                _cache_publish(cur, row["id"])
+        conn.commit()
+    if _request_cache is not None:
+        for doc in closed:
+            _request_cache.put(doc)
+    return closed
+
+
+def close_request_if_unloaded(request_id: int) -> dict|None:
+    """
+    Если все машины заявки выгружены, а она ещё не закрыта — закрываем одним UPDATE.
+    Возвращает закрытую заявку (для request_updated) или None, если закрывать нечего/ошибка.
+    """
+    try:
+        closed = _close_unloaded("r.id = %(rid)s", {"rid": int(request_id)})
+        return closed[0] if closed else None
+    except Exception as e:
+        logging.error(f"close_request_if_unloaded error: {e}")
+        return None
+
+
+def close_all_unloaded_requests() -> list:
+    """Массовая проверка (после импорта/чисток): закрывает все открытые заявки, где всё выгружено."""
+    try:
+        closed = _close_unloaded("TRUE", {})
+        if closed:
+            logging.info(f"[database] auto-closed {len(closed)} requests: {[r['id'] for r in closed]}")
+        return closed
+    except Exception as e:
+        logging.error(f"close_all_unloaded_requests error: {e}")
+        return []
+
+
 def set_request_status_closed(request_id: int):
     """Помечаем заявку закрытой в таблице requests.data (JSON)."""
     try:
-        req = get_request_from_db(request_id)
-        if not req:
-            return
-        data = dict(req)
         # ПИШЕМ КЛЮЧ 'closed' (с ним работают фильтры/цвета/сортировки на фронте)
-        data['status'] = 'closed'
-        save_request_to_db(data)
+        status, _ = patch_request(request_id, {"status": "closed"})
+        if status != "ok":
+            logging.error(f"set_request_status_closed: {status} for {request_id}")
     except Exception as e:
         logging.error(f"set_request_status_closed error: {e}")
 
@@ -0,0 +1,250 @@
+# backend/core/db_pool.py — ПУЛ СОЕДИНЕНИЙ К POSTGRES
+"""
+Ограниченный потокобезопасный пул соединений psycopg2.
+
+- min/max размер, ожидание свободного соединения с таймаутом;
+- проверка здоровья при выдаче (SELECT 1 — только если соединение долго простаивало);
+- вытеснение простаивающих соединений сверх minconn и слишком «старых» соединений;
+- метрики: время ожидания, занятые/свободные, сколько создано/закрыто.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+
+class PoolTimeout(Exception):
+    """Не дождались свободного соединения за acquire_timeout секунд."""
+
+
+class ConnectionPool:
+    def __init__(self, conn_params: dict, minconn: int = 1, maxconn: int = 10,
+                 acquire_timeout: float = 10.0, max_idle: float = 300.0,
+                 health_check_after: float = 30.0, max_lifetime: float = 3600.0):
+        if maxconn < 1:
+            raise ValueError("maxconn must be >= 1")
+        self._params = dict(conn_params)
+        self.minconn = max(0, min(int(minconn), int(maxconn)))
+        self.maxconn = int(maxconn)
+        self.acquire_timeout = float(acquire_timeout)
+        self.max_idle = float(max_idle)
+        self.health_check_after = float(health_check_after)
+        self.max_lifetime = float(max_lifetime)
+
+        self._cond = threading.Condition()
+        self._idle = deque()          # (conn, last_used) — справа самые «горячие»
+        self._born = {}               # id(conn) -> время создания
+        self._size = 0                # всего открытых (idle + in_use + создаваемые)
+        self._in_use = 0
+        self._closed = False
+
+        # метрики
+        self._created = 0
+        self._closed_count = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._health_failures = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._peak_in_use = 0
+
+    # ── создание / закрытие ──────────────────────────────────────────────────
+    def _connect(self):
+        conn = psycopg2.connect(**self._params)
+        with self._cond:
+            self._born[id(conn)] = time.monotonic()
+            self._created += 1
+        return conn
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._born.pop(id(conn), None)
+            self._closed_count += 1
+
+    def _expired(self, conn, now: float) -> bool:
+        born = self._born.get(id(conn), now)
+        return self.max_lifetime > 0 and (now - born) > self.max_lifetime
+
+    def _evict_idle_locked(self, now: float) -> list:
+        """Снимаем с учёта простаивающие соединения сверх minconn (самые старые — слева)."""
+        victims = []
+        while self._idle and self._size > self.minconn:
+            conn, last_used = self._idle[0]
+            if (now - last_used) <= self.max_idle and not self._expired(conn, now):
+                break
+            self._idle.popleft()
+            self._size -= 1
+            victims.append(conn)
+        return victims
+
+    # ── выдача / возврат ─────────────────────────────────────────────────────
+    def getconn(self):
+        t0 = time.monotonic()
+        deadline = t0 + self.acquire_timeout
+        while True:
+            conn, last_used, need_new, victims = None, None, False, []
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise psycopg2.InterfaceError("connection pool is closed")
+                    now = time.monotonic()
+                    victims = self._evict_idle_locked(now)
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        need_new = True
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"no free DB connection in {self.acquire_timeout:.1f}s "
+                            f"(maxconn={self.maxconn})")
+                    self._cond.wait(remaining)
+                self._in_use += 1
+                self._peak_in_use = max(self._peak_in_use, self._in_use)
+
+            for v in victims:
+                self._close_quietly(v)
+
+            if need_new:
+                try:
+                    conn = self._connect()
+                except Exception as e:
+                    logging.error(f"Database connection error: {e}")
+                    with self._cond:
+                        self._size -= 1
+                        self._in_use -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(conn, last_used):
+                with self._cond:
+                    self._health_failures += 1
+                    self._size -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                self._close_quietly(conn)
+                continue
+
+            waited = time.monotonic() - t0
+            with self._cond:
+                self._checkouts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            return conn
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        if self._expired(conn, time.monotonic()):
+            return False
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        # Пинг только для долго простаивавших — иначе теряем весь выигрыш пула
+        if time.monotonic() - last_used < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception as e:
+            logging.warning(f"[db_pool] health check failed: {e}")
+            return False
+
+    def putconn(self, conn, discard: bool = False):
+        if not discard and not conn.closed:
+            try:
+                # Никогда не возвращаем в пул соединение с открытой транзакцией
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        now = time.monotonic()
+        with self._cond:
+            self._in_use -= 1
+            keep = (not discard and not conn.closed and not self._closed
+                    and not self._expired(conn, now))
+            if keep:
+                self._idle.append((conn, now))
+            else:
+                self._size -= 1
+            self._cond.notify()
+        if not keep:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Соединение на время блока. Семантика как у `with psycopg2.connect() as conn`:
+        commit при нормальном выходе, rollback при исключении.
+        """
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+            if not conn.closed:
+                conn.commit()
+        except BaseException as e:
+            # разорванное соединение не возвращаем в пул
+            discard = conn.closed or isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except Exception:
+                    discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def warm_up(self):
+        """Открыть minconn соединений заранее (вызывается при старте)."""
+        conns = []
+        try:
+            for _ in range(self.minconn):
+                conns.append(self.getconn())
+        finally:
+            for c in conns:
+                self.putconn(c)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = [c for c, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for c in idle:
+            self._close_quietly(c)
+
+    def stats(self) -> dict:
+        with self._cond:
+            checkouts = self._checkouts
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "peak_in_use": self._peak_in_use,
+                "minconn": self.minconn,
+                "maxconn": self.maxconn,
+                "created": self._created,
+                "closed": self._closed_count,
+                "checkouts": checkouts,
+                # сколько рукопожатий сэкономили по сравнению с connect-per-call
+                "reused": max(0, checkouts - self._created),
+                "timeouts": self._timeouts,
+                "health_check_failures": self._health_failures,
+                "wait_total_ms": round(self._wait_total * 1000, 3),
+                "wait_max_ms": round(self._wait_max * 1000, 3),
+                "wait_avg_ms": round(self._wait_total * 1000 / checkouts, 3) if checkouts else 0.0,
+            }
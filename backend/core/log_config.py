@@ -1,20 +1,160 @@
+# backend/core/log_config.py — ЛОГИРОВАНИЕ СЕРВЕРА
+"""
+Логирование не должно тормозить цикл событий WebSocket-сервера.
+
+- QueueHandler → QueueListener: вызов logging.* только кладёт запись в очередь,
+  запись на консоль и в файл делает отдельный поток;
+- файл — RotatingFileHandler (ротация по размеру), записи в JSON по строке
+  (format: "json") или привычным текстом (format: "text");
+- в воркерах (ws-worker-N) — свой файл server.ws-worker-N.log: ротация одного файла
+  из нескольких процессов небезопасна;
+- log_action(): запись о входящем сообщении клиента с выборкой по action
+  (ping — не пишем, server_status — каждое N-е) и урезанным/скрытым телом
+  (filedata, content_base64, пароли и токены не попадают в лог).
+
+Настройки — секция "logging" в config/config.json.
+"""
+import atexit
+import json
 import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
 import sys
+import time
+from collections import Counter
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "../config/config.json")
+try:
+    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+        LOG_CONFIG = json.load(f).get("logging") or {}
+except (OSError, ValueError):
+    LOG_CONFIG = {}
+
+REDACT_KEYS = {k.lower() for k in LOG_CONFIG.get("redact_keys", [
+    "filedata", "content_base64", "password", "token", "session_token",
+])}
+MAX_STR = int(LOG_CONFIG.get("max_str", 200))
+MAX_ITEMS = int(LOG_CONFIG.get("max_items", 20))
+MAX_DEPTH = 4
+
+# action -> {"level": "DEBUG"|"INFO"|..., "every": N (0 — не писать, 1 — каждое)}
+ACTION_RULES = {
+    "ping": {"every": 0},
+    "server_status": {"every": 100},
+    **(LOG_CONFIG.get("actions") or {}),
+}
+DEFAULT_RULE = ACTION_RULES.get("*", {"level": "INFO", "every": 1})
+
+_listener = None
+_action_counts = Counter()
+ws_log = logging.getLogger("ws")
+
+_STD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def _extra_fields(record) -> dict:
+    return {k: v for k, v in vars(record).items() if k not in _STD_ATTRS and not k.startswith("_")}
+
+
+class TextFormatter(logging.Formatter):
+    """Привычный текстовый формат; поля из extra={...} — хвостом key=value."""
+
+    def format(self, record):
+        line = super().format(record)
+        extra = _extra_fields(record)
+        if extra:
+            line += " | " + " ".join(f"{k}={json.dumps(v, ensure_ascii=False, default=str)}" for k, v in extra.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON; поля из extra={...} попадают в запись как есть."""
+
+    def format(self, record):
+        out = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "src": f"{record.filename}:{record.lineno}",
+            "pid": record.process,
+            "msg": record.getMessage(),
+        }
+        out.update(_extra_fields(record))
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+def redact(value, depth: int = 0):
+    """Копия для лога: секреты скрыты, длинные строки и списки урезаны."""
+    if isinstance(value, dict):
+        if depth >= MAX_DEPTH:
+            return f"<dict {len(value)} keys>"
+        return {
+            k: (f"<redacted {len(str(v))} chars>" if str(k).lower() in REDACT_KEYS and v else redact(v, depth + 1))
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        if depth >= MAX_DEPTH:
+            return f"<list {len(value)} items>"
+        items = [redact(v, depth + 1) for v in value[:MAX_ITEMS]]
+        if len(value) > MAX_ITEMS:
+            items.append(f"<+{len(value) - MAX_ITEMS} items>")
+        return items
+    if isinstance(value, str) and len(value) > MAX_STR:
+        return value[:MAX_STR] + f"…<+{len(value) - MAX_STR} chars>"
+    return value
+
+
+def log_action(action, data: dict, **fields):
+    """Запись о входящем сообщении клиента с учётом выборки и уровня для action."""
+    rule = ACTION_RULES.get(action) or DEFAULT_RULE
+    every = int(rule.get("every", 1))
+    if every <= 0:
+        return
+    _action_counts[action] += 1
+    if (_action_counts[action] - 1) % every:
+        return
+    level = logging.getLevelName(str(rule.get("level", DEFAULT_RULE.get("level", "INFO"))).upper())
+    if not ws_log.isEnabledFor(level):
+        return
+    ws_log.log(level, f"recv {action}", extra={"action": action, "payload": redact(data), **fields}, stacklevel=2)
+
+
+def _log_file() -> str:
+    path = LOG_CONFIG.get("file", "server.log")
+    name = multiprocessing.current_process().name
+    if name != "MainProcess":
+        root, ext = os.path.splitext(path)
+        path = f"{root}.{name}{ext}"
+    return path
 
 
 def setup_logging():
+    global _listener
     logger = logging.getLogger()
     # Только INFO и выше! (можно WARNING для продакшена)
-    logger.setLevel(logging.INFO)
-    if not logger.hasHandlers():
-        console_handler = logging.StreamHandler(sys.stdout)
-        file_handler = logging.FileHandler("server.log", encoding="utf-8")
-        formatter = logging.Formatter(
+    logger.setLevel(getattr(logging, str(LOG_CONFIG.get("level", "INFO")).upper(), logging.INFO))
+    if _listener is None and not logger.hasHandlers():
+        text_formatter = TextFormatter(
             '%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s')
-        console_handler.setFormatter(formatter)
-        file_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
-        logger.addHandler(file_handler)
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(text_formatter)
+        file_handler = logging.handlers.RotatingFileHandler(
+            _log_file(),
+            maxBytes=int(LOG_CONFIG.get("max_bytes", 10 * 1024 * 1024)),
+            backupCount=int(LOG_CONFIG.get("backup_count", 5)),
+            encoding="utf-8",
+        )
+        file_handler.setFormatter(JsonFormatter() if LOG_CONFIG.get("format", "json") == "json" else text_formatter)
+
+        log_queue = queue.SimpleQueue()
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, console_handler, file_handler)
+        _listener.start()
+        atexit.register(_listener.stop)
 
     # Отключаем лишний шум от сторонних библиотек:
     logging.getLogger("websockets").setLevel(logging.WARNING)
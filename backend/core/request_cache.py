@@ -0,0 +1,149 @@
+# backend/core/request_cache.py — КЭШ ЗАЯВОК В ПАМЯТИ ПРОЦЕССА
+"""
+Write-through кэш заявок по id.
+
+- открытые заявки (active/priority/current) — рабочий набор, не вытесняются;
+- закрытые/выполненные (closed/done) — в LRU ограниченного размера;
+- опционально — согласованность между процессами через Postgres LISTEN/NOTIFY:
+  каждый процесс шлёт NOTIFY при сохранении/удалении, остальные сбрасывают запись.
+"""
+import copy
+import logging
+import select
+import threading
+import uuid
+from collections import OrderedDict
+
+import psycopg2
+import psycopg2.extensions
+
+NOTIFY_CHANNEL = "request_cache"
+EVICTABLE_STATUSES = ("closed", "done")
+
+
+class RequestCache:
+    def __init__(self, max_closed: int = 500):
+        self.max_closed = int(max_closed)
+        self._lock = threading.RLock()
+        self._open = {}                 # id -> заявка
+        self._closed = OrderedDict()    # id -> заявка, в порядке использования
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, rid: int):
+        with self._lock:
+            doc = self._open.get(rid)
+            if doc is None:
+                doc = self._closed.get(rid)
+                if doc is not None:
+                    self._closed.move_to_end(rid)
+            if doc is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # копия: обработчики свободно мутируют полученную заявку
+        return copy.deepcopy(doc)
+
+    def put(self, doc: dict):
+        rid = doc.get("id") if doc else None
+        if not isinstance(rid, int):
+            return
+        doc = copy.deepcopy(doc)
+        with self._lock:
+            # не затираем более свежую версию (параллельное чтение «старой» строки из БД)
+            existing = self._open.get(rid) or self._closed.get(rid)
+            if existing is not None and (existing.get("revision") or 0) > (doc.get("revision") or 0):
+                return
+            self._open.pop(rid, None)
+            self._closed.pop(rid, None)
+            if str(doc.get("status") or "").lower() in EVICTABLE_STATUSES:
+                self._closed[rid] = doc
+                while len(self._closed) > self.max_closed:
+                    self._closed.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self._open[rid] = doc
+
+    def invalidate(self, rid):
+        with self._lock:
+            found = self._open.pop(rid, None) is not None
+            found = (self._closed.pop(rid, None) is not None) or found
+            if found:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._open.clear()
+            self._closed.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "open": len(self._open),
+                "closed": len(self._closed),
+                "max_closed": self.max_closed,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class CacheInvalidationListener(threading.Thread):
+    """
+    Фоновый поток: LISTEN request_cache на отдельном соединении (не из пула).
+    Полезная нагрузка NOTIFY — "<токен процесса>:<id>"; свои уведомления пропускаем.
+    """
+
+    def __init__(self, cache: RequestCache, conn_params: dict, process_token: str):
+        super().__init__(name="request-cache-listener", daemon=True)
+        self.cache = cache
+        self.conn_params = dict(conn_params)
+        self.process_token = process_token
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.conn_params)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                # пока слушатель не работал, уведомления могли потеряться
+                self.cache.clear()
+                while not self._stop_event.is_set():
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._handle(conn.notifies.pop(0).payload)
+            except Exception as e:
+                logging.error(f"[request_cache] listener error: {e}")
+                self._stop_event.wait(5.0)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _handle(self, payload: str):
+        token, _, rid = (payload or "").partition(":")
+        if token == self.process_token:
+            return
+        if rid == "*":
+            self.cache.clear()
+        elif rid.isdigit():
+            self.cache.invalidate(int(rid))
+
+
+def new_process_token() -> str:
+    return uuid.uuid4().hex
@@ -0,0 +1,73 @@
+# backend/core/serialization.py — СЕРИАЛИЗАЦИЯ ОТВЕТОВ СЕРВЕРА
+"""
+Один путь сериализации для всех ответов и рассылок WebSocket.
+
+Бэкенд выбирается при импорте:
+  orjson  — C-расширение (pip install orjson): datetime/date/time сериализует сам,
+            Decimal — через хук; результат сразу bytes в UTF-8;
+  json    — стандартная библиотека с тем же хуком (если orjson не установлен).
+
+Формат у обоих одинаковый: даты — ISO 8601, Decimal — число, прочее — str(),
+кириллица и грузинский — как есть (без \\uXXXX).
+
+    python -m backend.tools.bench_serialization   — сравнение путей на типичных заявках
+"""
+import datetime as dt
+import json
+from decimal import Decimal
+
+try:
+    import orjson  # опционально
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def default(o):
+    """
+    Хук для типов, которые JSON/MessagePack не знают:
+    - date/datetime/time -> ISO-строки
+    - Decimal -> float
+    - всё прочее -> str (как крайняя мера)
+    """
+    if isinstance(o, (dt.datetime, dt.date, dt.time)):
+        return o.isoformat()
+    if isinstance(o, Decimal):
+        return float(o)
+    try:
+        return str(o)
+    except Exception:
+        return None
+
+
+def _stdlib_dumps(obj) -> str:
+    # ensure_ascii=False — чтобы грузинский/русский текст не превращался в \uXXXX
+    return json.dumps(obj, default=default, ensure_ascii=False)
+
+
+def dumps_bytes(obj) -> bytes:
+    """JSON в UTF-8. Для рассылки: кодируем один раз, сокетам отдаём готовые байты."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS)
+        except TypeError:
+            pass  # например, int больше 64 бит — stdlib справится
+    return _stdlib_dumps(obj).encode("utf-8")
+
+
+def dumps(obj) -> str:
+    """JSON-текст (для websocket.send → текстовый кадр)."""
+    if orjson is not None:
+        return dumps_bytes(obj).decode("utf-8")
+    return _stdlib_dumps(obj)
+
+
+def loads(data):
+    """str или bytes JSON → объект."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -5,7 +5,7 @@ from threading import Thread
 
 from backend.core.database import init_db
 from backend.services.autocomplete import run_autocomplete_server
-from backend.services.websocket_server import main as ws_main
+from backend.services.websocket_server import main as ws_main, run_workers, WS_WORKERS
 
 # === Инициализация БД (создает таблицы если их нет) ===
 try:
@@ -29,9 +29,12 @@ def run_flask():
         sys.exit(1)
 
 def run_websocket():
-    """Поднимаем WebSocket-сервер на :8766."""
+    """Поднимаем WebSocket-сервер на :8766 (ws.workers > 1 — несколько процессов на одном порту)."""
     try:
-        asyncio.run(ws_main())
+        if WS_WORKERS > 1:
+            run_workers(WS_WORKERS)
+        else:
+            asyncio.run(ws_main())
     except Exception as e:
         print(f"WebSocket server error: {e}")
         sys.exit(1)
@@ -1,74 +1,133 @@
 # backend/services/autocomplete.py — МНОГОЯЗЫЧНЫЙ АВТОКОМПЛИТ + КАРТА
 from __future__ import annotations
 import json
+import logging
+import mimetypes
 import re
-import requests
+import threading
+import time
 from pathlib import Path
 from typing import Dict, List, Tuple, Optional
 from flask import Flask, request, jsonify, send_from_directory, Response
 
+from backend.core.database import request_geo_version
+from backend.services import geo_cache, request_geo
+from backend.services.place_matcher import detect_lang
+
 APP_PORT = 9101  # ⬅️ СТАВИМ 9101, чтобы открываться по http://192.168.0.101:9101
 
+BASE_DIR     = Path(__file__).resolve().parent.parent.parent
+FRONTEND_DIR = BASE_DIR / "frontend"
+STATIC_DIR   = BASE_DIR / "backend" / "static"
+ATTACH_DIR   = BASE_DIR / "attachments"          # куда пишет file_transfer (upload_commit)
+LEGACY_ATTACH_DIR = Path("attachments")          # старый upload_file писал относительно cwd
+
+FILES_MAX_AGE = 7 * 24 * 3600  # вложения меняются редко; при перезаливке сработает ETag
+
+DIST_DIR = FRONTEND_DIR / "dist"   # сборка backend/tools/build_assets.py
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# на Windows реестр иногда отдаёт .js как text/plain — модули браузер тогда не грузит
+mimetypes.add_type("text/javascript", ".js")
+mimetypes.add_type("text/javascript", ".mjs")
+
+
+def _load_http_config() -> dict:
+    try:
+        with open(BASE_DIR / "backend" / "config" / "config.json", "r", encoding="utf-8") as f:
+            return json.load(f).get("http") or {}
+    except Exception:
+        return {}
+
+
+HTTP_CONFIG = _load_http_config()
+
+
+class RateLimiter:
+    """Token bucket на клиента (IP): rate запросов в секунду, всплеск до burst."""
+
+    def __init__(self, rate: float, burst: int, max_clients: int = 10000):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_clients = max_clients
+        self._buckets: Dict[str, Tuple[float, float]] = {}   # ip -> (tokens, last_ts)
+        self._lock = threading.Lock()
+
+    def allow(self, key: str) -> Tuple[bool, float]:
+        """(можно ли, через сколько секунд появится токен)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            ok = tokens >= 1.0
+            if ok:
+                tokens -= 1.0
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                # выкидываем давно молчащих (их ведро всё равно уже полное)
+                idle = now - self.burst / self.rate
+                self._buckets = {k: v for k, v in self._buckets.items() if v[1] >= idle}
+            return ok, 0.0 if ok else (1.0 - tokens) / self.rate
+
+
+_geo_limiter = RateLimiter(HTTP_CONFIG.get("autocomplete_rate", 5), HTTP_CONFIG.get("autocomplete_burst", 20))
+
+
+def _client_ip() -> str:
+    # за локальным туннелем (cloudflared и т.п.) реальный адрес — в заголовках
+    ip = request.remote_addr or ""
+    if ip in ("127.0.0.1", "::1"):
+        fwd = request.headers.get("CF-Connecting-IP") or (request.headers.get("X-Forwarded-For") or "").split(",")[0]
+        ip = fwd.strip() or ip
+    return ip
+
 
 def search_cities(q: str, limit: int = 8, lang_hint: Optional[str] = None) -> List[dict]:
     """
-    Чистый прокси к Nominatim (без локального JSON).
-    Возвращает список в формате [{label, country_code, type}]
+    Локальный индекс/кэш (geo_cache), Nominatim — только при промахе.
+    Возвращает список в формате [{label, country_code, type, lat?, lon?}]
     """
     q = (q or "").strip()
     if not q:
         return []
 
-    # Язык для подписей: берем из ?lang=..., иначе из Accept-Language браузера (если прокинут),
-    # иначе не навязываем — используем 'en' как безопасный дефолт.
-    lang = (lang_hint or request.headers.get('Accept-Language') or 'en').split(',')[0].split('-')[0].lower()
+    # Язык для подписей: берем из ?lang=..., иначе по письменности запроса (ka/ru),
+    # иначе из Accept-Language браузера (если прокинут), иначе 'en' как безопасный дефолт.
+    lang = (lang_hint or detect_lang(q) or request.headers.get('Accept-Language') or 'en').split(',')[0].split('-')[0].lower()
+    return geo_cache.search(q, int(limit or 8), lang)
 
-    try:
-        r = requests.get(
-            "https://nominatim.openstreetmap.org/search",
-            params={
-                "format": "jsonv2",
-                "addressdetails": 1,
-                "limit": int(limit or 8),
-                "q": q,
-                "accept-language": lang,   # ← как вы просили
-            },
-            headers={
-                "Accept-Language": lang,
-                "User-Agent": "jm-autocomplete/1.0"
-            },
-            timeout=6
-        )
-        rows = r.json() if r.ok else []
-    except Exception:
-        rows = []
-
-    results: List[dict] = []
-    seen = set()
-    for it in rows:
-        label = (it.get("display_name") or "").strip()
-        code  = (((it.get("address") or {}).get("country_code")) or "").upper()
-        typ   = (it.get("type") or "city")
-        if not label:
-            continue
-        key = (label.lower(), code)
-        if key in seen:
-            continue
-        seen.add(key)
-        results.append({
-            "label": label,
-            "country_code": code,
-            "type": typ
-        })
-        if len(results) >= int(limit or 8):
+
+def _send_static(root: Path, filename: str, cache_control: str):
+    """
+    Файл из root с учётом Accept-Encoding: рядом лежащие .br/.gz (от build_assets)
+    отдаются как есть с Content-Encoding; ETag/304 — через conditional.
+    """
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    resp = None
+    for encoding, ext in (("br", ".br"), ("gzip", ".gz")):
+        if request.accept_encodings[encoding] and (root / (filename + ext)).is_file():
+            resp = send_from_directory(str(root), filename + ext, mimetype=mimetype, conditional=True, etag=True)
+            resp.headers["Content-Encoding"] = encoding
             break
+    if resp is None:
+        resp = send_from_directory(str(root), filename, mimetype=mimetype, conditional=True, etag=True)
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.headers["Cache-Control"] = cache_control
+    return resp
+
 
-    return results
+def _send_index():
+    # есть сборка — её index.html (с <base> на версионированный каталог), иначе исходники
+    if (DIST_DIR / "index.html").is_file():
+        return _send_static(DIST_DIR, "index.html", REVALIDATE)
+    return _send_static(FRONTEND_DIR, "index.html", REVALIDATE)
 
 
 # ── Flask app ─────────────────────────────────────────────────────────────────
 def create_app() -> Flask:
-    app = Flask(__name__, static_folder=str(FRONTEND_DIR), static_url_path="/frontend")
+    # static_folder=None: фронт раздают свои маршруты ниже (сжатие, кэш-заголовки)
+    app = Flask(__name__, static_folder=None)
 
     @app.get("/healthz")
     def healthz(): return "ok", 200
@@ -83,26 +142,50 @@ def create_app() -> Flask:
     # Корень: отдаём фронт
     @app.get("/")
     def root_index():
-        return send_from_directory(str(FRONTEND_DIR), "index.html")
+        return _send_index()
 
     # Автокомплит
     @app.route("/autocomplete_geo", methods=["GET", "OPTIONS"])
     def autocomplete_geo():
         if request.method == "OPTIONS":
             return ("", 204)
+        ok, retry_after = _geo_limiter.allow(_client_ip())
+        if not ok:
+            resp = jsonify({"error": "too many requests"})
+            resp.status_code = 429
+            resp.headers["Retry-After"] = str(max(1, round(retry_after)))
+            return resp
         q     = request.args.get("q", "", type=str)
         limit = request.args.get("limit", 8, type=int)
         lang  = request.args.get("lang")  # ← возьмём язык из запроса, если передали
         return jsonify(search_cities(q, limit, lang_hint=lang))
 
+    # Вложения: /files/request_<id>/<name> (url из upload_file / upload_commit).
+    # conditional=True → Range/206, ETag + Last-Modified → 304; тело отдаётся через
+    # wsgi.file_wrapper (sendfile, если сервер умеет).
+    @app.get("/files/<path:filename>")
+    def attachment_files(filename):
+        for base in (ATTACH_DIR, LEGACY_ATTACH_DIR):
+            if (base / filename).is_file():
+                return send_from_directory(
+                    str(base.resolve()), filename,
+                    conditional=True, etag=True, max_age=FILES_MAX_AGE,
+                )
+        return ("Not found", 404)
+
     # Раздача фронта
     @app.get("/frontend/")
     def frontend_index():
-        return send_from_directory(str(FRONTEND_DIR), "index.html")
+        return _send_index()
+
+    # Версионированная сборка: содержимое по URL не меняется никогда
+    @app.get("/frontend/dist/<version>/<path:filename>")
+    def frontend_dist_files(version, filename):
+        return _send_static(DIST_DIR / version, filename, IMMUTABLE)
 
     @app.get("/frontend/<path:filename>")
     def frontend_files(filename):
-        return send_from_directory(str(FRONTEND_DIR), filename)
+        return _send_static(FRONTEND_DIR, filename, REVALIDATE)
 
     # Карта: умный фолбэк между двумя версиями
     CDN_LEAFLET_JS  = "https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"
@@ -142,13 +225,55 @@ window.addEventListener('message',ev=>{{ const d=(ev&&ev.data)||{{}}; if(d.type=
 </script></body></html>"""
         return Response(fallback, mimetype="text/html; charset=utf-8")
 
-    # Демо-данные для карты (оставил как у тебя)
+    # Заявки на карте: GeoJSON с координатами, посчитанными на сервере (request_geo).
+    # ?status=active,priority|all  ?bbox=west,south,east,north  ?zoom=N (кластеры)  ?id=<заявка>
     @app.get("/map/data")
     def map_data():
-        return jsonify({"features": []})
+        statuses = [x for x in (request.args.get("status") or "active,priority,current").split(",") if x]
+        if "all" in statuses:
+            statuses = None
+        try:
+            bbox = tuple(float(x) for x in request.args["bbox"].split(",")) if request.args.get("bbox") else None
+            if bbox is not None and len(bbox) != 4:
+                raise ValueError("bbox")
+        except ValueError:
+            return jsonify({"error": "bbox = west,south,east,north"}), 400
+        zoom = request.args.get("zoom", type=int)
+        rid = request.args.get("id", type=int)
+
+        # дешёвая проверка версии до выборки строк: ничего не менялось — 304
+        version = request_geo_version()
+        if version and request.if_none_match.contains(f"map-{version}"):
+            resp = Response(status=304)
+        else:
+            fc, version = request_geo.feature_collection(statuses, bbox, zoom, rid)
+            resp = jsonify(fc)
+        if version:
+            resp.set_etag(f"map-{version}")
+        resp.headers["Cache-Control"] = "no-cache"
+        return resp
 
     return app
 
 def run_autocomplete_server():
+    """
+    Продакшн-сервер waitress (пул потоков: медленный Nominatim не держит остальных).
+    Если waitress не установлен — встроенный сервер Flask, но хотя бы многопоточный.
+    """
     app = create_app()
-    app.run(host="0.0.0.0", port=APP_PORT, debug=False, use_reloader=False)
+    request_geo.start_worker()   # фоновый геокодинг from/to заявок для /map/data
+    host = HTTP_CONFIG.get("host", "0.0.0.0")
+    port = int(HTTP_CONFIG.get("port", APP_PORT))
+    try:
+        from waitress import serve
+    except ImportError:
+        logging.warning("[http] waitress не установлен (pip install waitress) — Flask dev server")
+        app.run(host=host, port=port, debug=False, use_reloader=False, threaded=True)
+        return
+    serve(
+        app, host=host, port=port,
+        threads=int(HTTP_CONFIG.get("threads", 16)),
+        connection_limit=int(HTTP_CONFIG.get("connection_limit", 500)),
+        channel_timeout=int(HTTP_CONFIG.get("channel_timeout", 60)),
+        ident="jm-http",
+    )
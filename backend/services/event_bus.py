@@ -0,0 +1,197 @@
+# backend/services/event_bus.py — ШИНА СОБЫТИЙ МЕЖДУ ВОРКЕРАМИ WEBSOCKET-СЕРВЕРА
+"""
+Рассылка не должна зависеть от того, какой воркер (процесс или хост) принял сокет клиента.
+
+broadcast() публикует уже сериализованное событие в шину; шина доставляет его
+своим клиентам сразу (deliver = hub.publish) и всем остальным воркерам.
+
+  InMemoryEventBus  — один процесс; несколько экземпляров с общим network
+                      имитируют несколько воркеров (для проверок без Postgres).
+  PostgresEventBus  — LISTEN/NOTIFY на канале ws_events. Тело больше ~7.5 КБ
+                      кладётся в ws_event_payloads, в уведомлении — только ссылка.
+
+Порядок: публикации одного воркера уходят в NOTIFY по одной (одна задача-отправитель).
+Если слушатель переподключался, уведомления могли потеряться — своим клиентам шлём
+{"action": "resync"}, и они догоняют по ревизии (sync_since / statuses_since).
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+import uuid
+from typing import Callable, List, Optional
+
+import psycopg2
+import psycopg2.extensions
+
+from backend.core.async_database import run_db
+from backend.core.database import DB_CONFIG, publish_event, load_event_payload, prune_event_payloads
+
+CHANNEL = "ws_events"
+MAX_INLINE_BYTES = 7500        # лимит NOTIFY — 8000 байт, оставляем запас на конверт
+PUBLISH_QUEUE_SIZE = 1000
+PAYLOAD_KEEP_SECONDS = 300
+RESYNC_TOPICS = ("requests", "statuses")
+
+Deliver = Callable[[str, set, object], int]   # hub.publish(data, topics, exclude_ws)
+
+
+class EventBus:
+    """Интерфейс шины. deliver — доставка своим клиентам (hub.publish)."""
+
+    def __init__(self, deliver: Deliver):
+        self.deliver = deliver
+        self.origin = uuid.uuid4().hex
+        self.published = 0
+        self.received = 0
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, data, topics: set, exclude_ws=None):
+        """data — готовый JSON (str или bytes в UTF-8)."""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {"kind": type(self).__name__, "published": self.published, "received": self.received}
+
+
+class InMemoryEventBus(EventBus):
+    """Шина внутри процесса. Общий список network — «кластер» из нескольких воркеров."""
+
+    def __init__(self, deliver: Deliver, network: Optional[List["InMemoryEventBus"]] = None):
+        super().__init__(deliver)
+        self.network = network if network is not None else []
+        self.network.append(self)
+
+    async def publish(self, data, topics: set, exclude_ws=None):
+        self.published += 1
+        self.deliver(data, topics, exclude_ws)
+        for peer in list(self.network):
+            if peer is not self:
+                peer.received += 1
+                peer.deliver(data, topics, None)
+
+
+class PostgresEventBus(EventBus):
+    def __init__(self, deliver: Deliver, conn_params: Optional[dict] = None):
+        super().__init__(deliver)
+        self.conn_params = dict(conn_params if conn_params is not None else DB_CONFIG)
+        self.dropped = 0
+        self.reconnects = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._sender: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._listener: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._pruned_at = 0.0
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=PUBLISH_QUEUE_SIZE)
+        self._sender = asyncio.create_task(self._send_loop())
+        self._listener = threading.Thread(target=self._listen, name="ws-event-bus", daemon=True)
+        self._listener.start()
+
+    async def stop(self):
+        self._stop_event.set()
+        if self._sender is not None:
+            self._sender.cancel()
+
+    async def publish(self, data, topics: set, exclude_ws=None):
+        # свои клиенты — сразу, не дожидаясь круга через Postgres
+        self.deliver(data, topics, exclude_ws)
+        self.published += 1
+        if self._queue is None:
+            return
+        try:
+            self._queue.put_nowait((data, sorted(topics)))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logging.error("[event_bus] publish queue full, event dropped for other workers")
+
+    async def _send_loop(self):
+        while True:
+            data, topics = await self._queue.get()
+            if isinstance(data, bytes):
+                data = data.decode("utf-8")
+            envelope = {"o": self.origin, "t": topics}
+            if not await run_db(publish_event, CHANNEL, envelope, data, MAX_INLINE_BYTES):
+                self.dropped += 1
+            if time.monotonic() - self._pruned_at > PAYLOAD_KEEP_SECONDS:
+                self._pruned_at = time.monotonic()
+                await run_db(prune_event_payloads, PAYLOAD_KEEP_SECONDS)
+
+    # ── слушатель: отдельное соединение (не из пула), свой поток ────────────
+    def _listen(self):
+        connected_before = False
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.conn_params)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CHANNEL}")
+                if connected_before:
+                    self.reconnects += 1
+                    self._loop.call_soon_threadsafe(self._resync_local)
+                connected_before = True
+                while not self._stop_event.is_set():
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._handle(conn.notifies.pop(0).payload)
+            except Exception as e:
+                logging.error(f"[event_bus] listener error: {e}")
+                self._stop_event.wait(2.0)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _handle(self, payload: str):
+        try:
+            msg = json.loads(payload)
+        except ValueError:
+            return
+        if msg.get("o") == self.origin:
+            return
+        data = msg.get("d")
+        if data is None and msg.get("r") is not None:
+            data = load_event_payload(msg["r"])
+        if data is None:
+            logging.error(f"[event_bus] event payload {msg.get('r')} not found")
+            return
+        self._loop.call_soon_threadsafe(self._deliver_remote, data, set(msg.get("t") or ()))
+
+    def _deliver_remote(self, data: str, topics: set):
+        self.received += 1
+        self.deliver(data, topics, None)
+
+    def _resync_local(self):
+        data = json.dumps({"action": "resync", "topics": list(RESYNC_TOPICS)})
+        self.deliver(data, set(RESYNC_TOPICS), None)
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "dropped": self.dropped,
+            "reconnects": self.reconnects,
+        }
+
+
+def create_bus(kind: str, deliver: Deliver) -> EventBus:
+    if kind == "postgres":
+        return PostgresEventBus(deliver)
+    return InMemoryEventBus(deliver)
@@ -0,0 +1,238 @@
+# backend/services/file_transfer.py — ПОТОКОВАЯ ПЕРЕДАЧА ФАЙЛОВ ПО WEBSOCKET
+"""
+Чанковая передача вложений бинарными кадрами вместо base64 внутри JSON.
+
+Бинарный кадр:  b"JMF1" | transfer_id (16 байт, uuid) | offset (8 байт, big-endian) | данные
+
+Загрузка:
+  → {"action": "upload_begin", "request_id", "filename", "size", "transfer_id"?}
+  ← {"action": "upload_begin", "status": "ok", "transfer_id", "offset", "chunk_size"}
+  → бинарные кадры по порядку, ← {"action": "upload_ack", "transfer_id", "offset"} на каждый
+  → {"action": "upload_commit", "transfer_id"}
+  ← {"action": "upload_commit", "status": "ok", "file": {"name", "url"}}
+  Докачка: повторный upload_begin с тем же transfer_id вернёт offset уже принятых байт.
+
+Скачивание:
+  → {"action": "download_begin", "task_id", "filename", "offset"?}
+  ← {"action": "download_begin", "status": "ok", "transfer_id", "size", "offset", "chunk_size"}
+  ← бинарные кадры ..., ← {"action": "download_end", "transfer_id", "size"}
+  Докачка: download_begin с offset = сколько уже получено.
+
+В памяти на передачу — не больше одного чанка; диск — в пуле потоков (asyncio.to_thread).
+"""
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+import uuid
+from pathlib import Path
+
+ATTACH_DIR = Path(__file__).parent.parent.parent / "attachments"
+
+MAGIC = b"JMF1"
+HEADER = struct.Struct(">4s16sQ")
+CHUNK_SIZE = 256 * 1024
+MAX_FILE_SIZE = 200 * 1024 * 1024
+UPLOAD_IDLE_TTL = 24 * 3600  # незавершённые загрузки старше суток забываем
+
+_uploads = {}  # transfer_id(hex) -> _Upload
+
+
+class _Upload:
+    __slots__ = ("transfer_id", "request_id", "filename", "size", "received", "part_path", "final_path", "touched")
+
+    def __init__(self, transfer_id, request_id, filename, size, part_path, final_path):
+        self.transfer_id = transfer_id
+        self.request_id = request_id
+        self.filename = filename
+        self.size = size
+        self.received = 0
+        self.part_path = part_path
+        self.final_path = final_path
+        self.touched = time.monotonic()
+
+
+def safe_filename(name: str) -> str:
+    name = (name or "").replace("/", "_").replace("\\", "_").strip()
+    if name in ("", ".", ".."):
+        raise ValueError("bad filename")
+    return name
+
+
+def pack_frame(transfer_id: str, offset: int, payload: bytes) -> bytes:
+    return HEADER.pack(MAGIC, uuid.UUID(hex=transfer_id).bytes, offset) + payload
+
+
+def unpack_frame(frame: bytes):
+    if len(frame) < HEADER.size or frame[:4] != MAGIC:
+        raise ValueError("not a file frame")
+    _, tid, offset = HEADER.unpack_from(frame)
+    return uuid.UUID(bytes=tid).hex, offset, memoryview(frame)[HEADER.size:]
+
+
+def find_attachment(task_id: str, filename: str) -> Path|None:
+    """Ищем вложение в attachments/request_<id>/ и в старом attachments/task_<id>/."""
+    name = safe_filename(filename)
+    for base in (ATTACH_DIR, Path("attachments")):
+        for sub in (f"request_{task_id}", f"task_{task_id}"):
+            p = base / sub / name
+            if p.is_file():
+                return p
+    return None
+
+
+def _file_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def _write_at(path: Path, offset: int, data: bytes):
+    mode = "r+b" if path.exists() else "wb"
+    with open(path, mode) as f:
+        f.seek(offset)
+        f.write(data)
+        f.truncate()
+
+
+def _read_at(path: Path, offset: int, size: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def _expire_idle_uploads():
+    now = time.monotonic()
+    for tid in [t for t, u in _uploads.items() if now - u.touched > UPLOAD_IDLE_TTL]:
+        _uploads.pop(tid, None)
+
+
+async def _send(websocket, message: dict):
+    await websocket.send(json.dumps(message, ensure_ascii=False))
+
+
+# ── загрузка ─────────────────────────────────────────────────────────────────
+async def upload_begin(websocket, data: dict):
+    try:
+        request_id = str(data.get("request_id") or "").strip()
+        if not request_id.isdigit():
+            raise ValueError("bad request_id")
+        filename = safe_filename(data.get("filename"))
+        size = int(data.get("size"))
+        if size < 0 or size > MAX_FILE_SIZE:
+            raise ValueError("bad size")
+        transfer_id = uuid.UUID(hex=data["transfer_id"]).hex if data.get("transfer_id") else uuid.uuid4().hex
+    except Exception as e:
+        await _send(websocket, {"action": "upload_begin", "status": "error", "error": f"Некорректные параметры: {e}"})
+        return
+
+    _expire_idle_uploads()
+    save_dir = ATTACH_DIR / f"request_{request_id}"
+    await asyncio.to_thread(save_dir.mkdir, parents=True, exist_ok=True)
+    part_path = save_dir / f".upload-{transfer_id}.part"
+    up = _uploads.get(transfer_id)
+    if up is None:
+        up = _Upload(transfer_id, request_id, filename, size, part_path, save_dir / filename)
+        _uploads[transfer_id] = up
+    # докачка: продолжаем с того, что уже лежит на диске
+    up.received = await asyncio.to_thread(_file_size, part_path)
+    up.touched = time.monotonic()
+    await _send(websocket, {
+        "action": "upload_begin",
+        "status": "ok",
+        "transfer_id": transfer_id,
+        "offset": up.received,
+        "chunk_size": CHUNK_SIZE,
+    })
+
+
+async def handle_binary(websocket, frame: bytes):
+    """Бинарный кадр с чанком загрузки."""
+    try:
+        transfer_id, offset, payload = unpack_frame(frame)
+    except ValueError:
+        await _send(websocket, {"action": "upload_ack", "status": "error", "error": "bad frame"})
+        return
+    up = _uploads.get(transfer_id)
+    if up is None:
+        await _send(websocket, {"action": "upload_ack", "transfer_id": transfer_id, "status": "error", "error": "unknown transfer"})
+        return
+    if offset != up.received or offset + len(payload) > up.size or len(payload) > CHUNK_SIZE:
+        # клиент должен продолжить с offset, который мы знаем
+        await _send(websocket, {"action": "upload_ack", "transfer_id": transfer_id, "status": "resync", "offset": up.received})
+        return
+    await asyncio.to_thread(_write_at, up.part_path, offset, bytes(payload))
+    up.received = offset + len(payload)
+    up.touched = time.monotonic()
+    await _send(websocket, {"action": "upload_ack", "transfer_id": transfer_id, "status": "ok", "offset": up.received})
+
+
+async def upload_commit(websocket, data: dict):
+    up = _uploads.get(str(data.get("transfer_id") or ""))
+    if up is None:
+        await _send(websocket, {"action": "upload_commit", "status": "error", "error": "unknown transfer"})
+        return
+    if up.received != up.size:
+        await _send(websocket, {"action": "upload_commit", "status": "error", "error": "incomplete", "offset": up.received})
+        return
+    if up.size == 0:
+        await asyncio.to_thread(_write_at, up.part_path, 0, b"")
+    await asyncio.to_thread(os.replace, up.part_path, up.final_path)
+    _uploads.pop(up.transfer_id, None)
+    logging.info(f"[files] upload committed: {up.final_path} ({up.size} bytes)")
+    await _send(websocket, {
+        "action": "upload_commit",
+        "status": "ok",
+        "transfer_id": up.transfer_id,
+        "file": {"name": up.filename, "url": f"/files/request_{up.request_id}/{up.filename}"},
+    })
+
+
+# ── скачивание ───────────────────────────────────────────────────────────────
+async def download_begin(websocket, data: dict):
+    """Запускает потоковую отдачу; возвращает задачу (её отменяют при разрыве соединения)."""
+    task_id = str(data.get("task_id") or "").strip()
+    filename = data.get("filename")
+    try:
+        path = await asyncio.to_thread(find_attachment, task_id, filename)
+    except ValueError:
+        path = None
+    if path is None:
+        await _send(websocket, {"action": "download_begin", "status": "error", "filename": filename, "error": "File not found"})
+        return None
+    transfer_id = uuid.uuid4().hex
+    size = await asyncio.to_thread(_file_size, path)
+    offset = min(max(int(data.get("offset") or 0), 0), size)
+    await _send(websocket, {
+        "action": "download_begin",
+        "status": "ok",
+        "transfer_id": transfer_id,
+        "filename": filename,
+        "size": size,
+        "offset": offset,
+        "chunk_size": CHUNK_SIZE,
+    })
+    return asyncio.create_task(_stream_file(websocket, transfer_id, path, offset, size))
+
+
+async def _stream_file(websocket, transfer_id: str, path: Path, offset: int, size: int):
+    try:
+        while offset < size:
+            chunk = await asyncio.to_thread(_read_at, path, offset, CHUNK_SIZE)
+            if not chunk:
+                break
+            # send() ждёт, пока кадр уйдёт в сокет — в памяти не больше одного чанка
+            await websocket.send(pack_frame(transfer_id, offset, chunk))
+            offset += len(chunk)
+        await _send(websocket, {"action": "download_end", "transfer_id": transfer_id, "size": offset})
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logging.error(f"[files] download stream failed: {e}")
+        try:
+            await _send(websocket, {"action": "download_end", "transfer_id": transfer_id, "status": "error", "error": str(e)})
+        except Exception:
+            pass
@@ -0,0 +1,464 @@
+# backend/services/geo_cache.py — ЛОКАЛЬНЫЙ ГЕОКОДЕР ДЛЯ /autocomplete_geo
+"""
+Автокомплит городов без похода в Nominatim на каждую букву.
+
+1) Локальный префиксный индекс (отсортированный список ключей + bisect) по встроенному
+   справочнику config/places.json и по местам, которые уже приходили из Nominatim.
+2) Кэш запросов (нормализованный запрос + язык) — LRU ограниченного размера с TTL,
+   сохраняется в config/city_coords_cache.json (с задержкой, не на каждый запрос).
+3) Nominatim — только если ни индекс, ни кэш ничего не знают.
+
+Ключи — place_matcher.fold(): грузинское, русское и латинское написание одного города
+сходятся в один ключ; при промахе префикса — нечёткий поиск с опечатками, порядок —
+по популярности места в заявках.
+
+Прогрев из существующих заявок (поля from/to):
+    python -m backend.services.geo_cache --prewarm
+"""
+from __future__ import annotations
+
+import argparse
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from backend.services.place_matcher import Popularity, TrigramIndex, fold
+
+CONFIG_DIR  = Path(__file__).resolve().parent.parent / "config"
+PLACES_PATH = CONFIG_DIR / "places.json"
+CACHE_PATH  = CONFIG_DIR / "city_coords_cache.json"
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+USER_AGENT    = "jm-autocomplete/1.0"
+
+
+def _load_config() -> dict:
+    try:
+        with open(CONFIG_DIR / "config.json", "r", encoding="utf-8") as f:
+            return json.load(f).get("geo_cache") or {}
+    except Exception:
+        return {}
+
+
+GEO_CONFIG = _load_config()
+MAX_ENTRIES  = int(GEO_CONFIG.get("max_entries", 5000))
+TTL_SECONDS  = int(GEO_CONFIG.get("ttl_days", 30)) * 24 * 3600
+SAVE_DELAY   = float(GEO_CONFIG.get("save_delay", 5.0))
+UPSTREAM_TIMEOUT = float(GEO_CONFIG.get("upstream_timeout", 6.0))
+POPULARITY_REFRESH = float(GEO_CONFIG.get("popularity_refresh", 600))
+
+
+# ── индекс мест ──────────────────────────────────────────────────────────────
+class PlaceIndex:
+    """
+    Место: {"names": {lang: name}, "labels"?: {lang: label}, "country_code", "lat", "lon", "type"}.
+    Ключи — fold() названий на всех языках (и каждого слова после первого);
+    поиск по префиксу через bisect, с опечатками — через TrigramIndex.
+    """
+
+    def __init__(self, countries: Optional[dict] = None):
+        self.countries = countries or {}
+        self.places: List[dict] = []
+        self._by_coord: Dict[tuple, int] = {}
+        self._keys: List[tuple] = []   # (key, idx), отсортирован
+        self._sorted = True
+        self._fuzzy = TrigramIndex()
+        self.popularity = lambda idx: 0
+
+    def __len__(self):
+        return len(self.places)
+
+    @staticmethod
+    def _coord_key(place: dict) -> tuple:
+        return (place.get("country_code") or "", round(float(place["lat"]), 2), round(float(place["lon"]), 2))
+
+    def add(self, place: dict) -> int:
+        """Добавляет место (или новые названия к уже известному по координатам)."""
+        ck = self._coord_key(place)
+        idx = self._by_coord.get(ck)
+        if idx is None:
+            idx = len(self.places)
+            self.places.append({**place, "names": dict(place.get("names") or {}),
+                                "labels": dict(place.get("labels") or {})})
+            self._by_coord[ck] = idx
+            names = self.places[idx]["names"].values()
+        else:
+            known = self.places[idx]
+            names = [n for lang, n in (place.get("names") or {}).items() if known["names"].get(lang) != n]
+            for lang, n in (place.get("names") or {}).items():
+                known["names"].setdefault(lang, n)
+            for lang, lbl in (place.get("labels") or {}).items():
+                known["labels"].setdefault(lang, lbl)
+        for name in names:
+            key = fold(name)
+            words = key.split(" ")
+            # «Нижний Новгород» находится и по «новгород»
+            for key in [key] + [" ".join(words[i:]) for i in range(1, len(words))]:
+                if key:
+                    self._keys.append((key, idx))
+                    self._fuzzy.add(key, idx)
+                    self._sorted = False
+        return idx
+
+    def _ensure_sorted(self):
+        if not self._sorted:
+            self._keys = sorted(set(self._keys))
+            self._sorted = True
+
+    def prefix(self, fq: str) -> List[int]:
+        """
+        Места, у которых какое-то название начинается с fq. Порядок: точное совпадение,
+        популярность в заявках, длина названия; если префикс ничего не дал — с опечатками.
+        """
+        self._ensure_sorted()
+        best: Dict[int, tuple] = {}
+        i = bisect.bisect_left(self._keys, (fq, -1))
+        while i < len(self._keys) and self._keys[i][0].startswith(fq):
+            key, idx = self._keys[i]
+            rank = (key != fq, len(key))
+            if idx not in best or rank < best[idx]:
+                best[idx] = rank
+            i += 1
+        if not best:
+            best = {idx: (typos, 0) for idx, typos in self._fuzzy.search(fq).items()}
+        return sorted(best, key=lambda idx: (best[idx][0], -self.popularity(idx), best[idx][1]))
+
+    def resolve(self, text: str) -> Optional[int]:
+        """Место с точно таким названием (в любом написании) или None."""
+        fq = fold(text)
+        self._ensure_sorted()
+        i = bisect.bisect_left(self._keys, (fq, -1))
+        if fq and i < len(self._keys) and self._keys[i][0] == fq:
+            return self._keys[i][1]
+        return None
+
+    def label(self, place: dict, lang: str) -> str:
+        lbl = place["labels"].get(lang)
+        if lbl:
+            return lbl
+        names = place["names"]
+        name = names.get(lang) or names.get("en") or next(iter(names.values()), "")
+        country = (self.countries.get(place.get("country_code")) or {})
+        cname = country.get(lang) or country.get("en")
+        return f"{name}, {cname}" if cname else name
+
+    def to_result(self, idx: int, lang: str) -> dict:
+        p = self.places[idx]
+        return {
+            "label": self.label(p, lang),
+            "country_code": p.get("country_code") or "",
+            "type": p.get("type") or "city",
+            "lat": p["lat"],
+            "lon": p["lon"],
+        }
+
+    def search(self, fq: str, limit: int, lang: str) -> List[dict]:
+        return [self.to_result(idx, lang) for idx in self.prefix(fq)[:limit]]
+
+    def learned(self) -> List[dict]:
+        """Места не из встроенного справочника — их сохраняем вместе с кэшем."""
+        return [p for p in self.places if p.get("source") == "nominatim"]
+
+
+# ── кэш запросов ─────────────────────────────────────────────────────────────
+class QueryCache:
+    def __init__(self, max_entries: int = MAX_ENTRIES, ttl: int = TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, dict]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[List[dict]]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry["t"] > self.ttl:
+            self._data.pop(key, None)
+            return None
+        self._data.move_to_end(key)
+        return entry["results"]
+
+    def put(self, key: str, results: List[dict], ts: Optional[float] = None):
+        self._data[key] = {"t": ts or time.time(), "results": results}
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def items(self):
+        return self._data.items()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# ── сервис ───────────────────────────────────────────────────────────────────
+_lock = threading.RLock()
+_index: Optional[PlaceIndex] = None
+_cache: Optional[QueryCache] = None
+_save_timer: Optional[threading.Timer] = None
+_inflight: Dict[str, Future] = {}   # одинаковые запросы в Nominatim ждут один ответ
+_stats = {"local_hits": 0, "cache_hits": 0, "upstream_calls": 0, "upstream_errors": 0, "coalesced": 0}
+
+# keep-alive пул соединений к Nominatim (TLS-рукопожатие — не на каждый запрос)
+_session = requests.Session()
+_session.headers.update({"User-Agent": USER_AGENT})
+_session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=int(GEO_CONFIG.get("upstream_pool", 8))))
+
+
+def _ensure_loaded():
+    global _index, _cache
+    if _index is not None:
+        return
+    with _lock:
+        if _index is not None:
+            return
+        index, cache = PlaceIndex(), QueryCache()
+        try:
+            with open(PLACES_PATH, "r", encoding="utf-8") as f:
+                bundled = json.load(f)
+            index.countries = bundled.get("countries") or {}
+            for p in bundled.get("places") or []:
+                index.add(p)
+        except Exception as e:
+            logging.error(f"[geo_cache] places.json не загружен: {e}")
+        try:
+            if CACHE_PATH.exists() and CACHE_PATH.stat().st_size > 0:
+                with open(CACHE_PATH, "r", encoding="utf-8") as f:
+                    saved = json.load(f)
+                for p in saved.get("places") or []:
+                    index.add(p)
+                for key, entry in (saved.get("queries") or {}).items():
+                    cache.put(key, entry.get("results") or [], entry.get("t"))
+        except Exception as e:
+            logging.error(f"[geo_cache] кэш не прочитан: {e}")
+        index._ensure_sorted()
+        index.popularity = Popularity(_count_places, _locked_resolver(index), POPULARITY_REFRESH).get
+        _cache = cache
+        _index = index
+
+
+def _locked_resolver(index: PlaceIndex):
+    """resolve() для фонового пересчёта популярности: индекс меняют HTTP-потоки под _lock."""
+    def resolve(text: str) -> Optional[int]:
+        with _lock:
+            return index.resolve(text)
+    return resolve
+
+
+def _load_requests():
+    from backend.core.database import load_all_requests
+    return load_all_requests()
+
+
+def _count_places():
+    from backend.core.database import count_request_places
+    return count_request_places()
+
+
+def _save_now():
+    global _save_timer
+    with _lock:
+        _save_timer = None
+        payload = {
+            "version": 1,
+            "places": _index.learned() if _index else [],
+            "queries": {k: v for k, v in _cache.items()} if _cache else {},
+        }
+    try:
+        tmp = CACHE_PATH.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp, CACHE_PATH)
+    except Exception as e:
+        logging.error(f"[geo_cache] кэш не сохранён: {e}")
+
+
+def _schedule_save():
+    global _save_timer
+    with _lock:
+        if _save_timer is None:
+            _save_timer = threading.Timer(SAVE_DELAY, _save_now)
+            _save_timer.daemon = True
+            _save_timer.start()
+
+
+def flush():
+    """Немедленно записать кэш на диск (CLI, завершение процесса)."""
+    global _save_timer
+    with _lock:
+        if _save_timer is not None:
+            _save_timer.cancel()
+    _save_now()
+
+
+def nominatim_search(q: str, limit: int, lang: str) -> List[dict]:
+    r = _session.get(
+        NOMINATIM_URL,
+        params={
+            "format": "jsonv2",
+            "addressdetails": 1,
+            "limit": int(limit or 8),
+            "q": q,
+            "accept-language": lang,
+        },
+        headers={"Accept-Language": lang},
+        timeout=UPSTREAM_TIMEOUT,
+    )
+    r.raise_for_status()
+    return r.json()
+
+
+def _upstream_results(rows: List[dict], limit: int, lang: str) -> List[dict]:
+    results, seen = [], set()
+    for it in rows:
+        label = (it.get("display_name") or "").strip()
+        code  = (((it.get("address") or {}).get("country_code")) or "").upper()
+        typ   = (it.get("type") or "city")
+        if not label:
+            continue
+        key = (label.lower(), code)
+        if key in seen:
+            continue
+        seen.add(key)
+        res = {"label": label, "country_code": code, "type": typ}
+        try:
+            res["lat"], res["lon"] = float(it["lat"]), float(it["lon"])
+        except (KeyError, TypeError, ValueError):
+            pass
+        results.append(res)
+        if len(results) >= limit:
+            break
+    return results
+
+
+def _learn(results: List[dict], lang: str):
+    """Результаты Nominatim пополняют локальный индекс — следующий раз ответим сами."""
+    for res in results:
+        if "lat" not in res:
+            continue
+        name = res["label"].split(",")[0].strip()
+        _index.add({
+            "names": {lang: name},
+            "labels": {lang: res["label"]},
+            "country_code": res["country_code"],
+            "lat": res["lat"],
+            "lon": res["lon"],
+            "type": res["type"],
+            "source": "nominatim",
+        })
+
+
+def search(q: str, limit: int = 8, lang: str = "en", upstream: bool = True) -> List[dict]:
+    """[{label, country_code, type, lat?, lon?}] — индекс → кэш → Nominatim."""
+    _ensure_loaded()
+    limit = int(limit or 8)
+    fq = fold(q)
+    if not fq:
+        return []
+    with _lock:
+        local = _index.search(fq, limit, lang)
+        if local:
+            _stats["local_hits"] += 1
+            return local
+        cached = _cache.get(f"{lang}:{fq}")
+        if cached is not None:
+            _stats["cache_hits"] += 1
+            return cached[:limit]
+    if not upstream:
+        return []
+
+    key = f"{lang}:{fq}"
+    with _lock:
+        pending = _inflight.get(key)
+        leader = pending is None
+        if leader:
+            pending = _inflight[key] = Future()
+        else:
+            _stats["coalesced"] += 1
+    if not leader:
+        try:
+            return pending.result(timeout=UPSTREAM_TIMEOUT + 1)[:limit]
+        except Exception:
+            return []
+
+    results: List[dict] = []
+    try:
+        _stats["upstream_calls"] += 1
+        rows = nominatim_search(q, limit, lang)
+        results = _upstream_results(rows, limit, lang)
+        with _lock:
+            _cache.put(key, results)
+            _learn(results, lang)
+        _schedule_save()
+    except Exception as e:
+        _stats["upstream_errors"] += 1
+        logging.error(f"[geo_cache] nominatim error for {q!r}: {e}")
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+        pending.set_result(results)
+    return results
+
+
+def geocode(text: str, lang: str = "en", upstream: bool = True) -> Optional[dict]:
+    """Лучшее совпадение с координатами или None."""
+    for res in search(text, 1, lang, upstream=upstream):
+        if "lat" in res:
+            return res
+    return None
+
+
+def stats() -> dict:
+    _ensure_loaded()
+    with _lock:
+        return {**_stats, "places": len(_index), "queries": len(_cache)}
+
+
+def prewarm_from_requests(lang: str = "en", delay: float = 1.0) -> dict:
+    """
+    Прогрев по полям from/to всех заявок. Nominatim просит не чаще 1 запроса в секунду,
+    поэтому между обращениями наружу — пауза delay.
+    """
+    seen, warmed, missing = set(), 0, 0
+    for req in _load_requests() or []:
+        for field in ("from", "to"):
+            text = str(req.get(field) or "").strip()
+            fq = fold(text)
+            if not fq or fq in seen:
+                continue
+            seen.add(fq)
+            if search(text, 1, lang, upstream=False):
+                continue
+            if geocode(text, lang):
+                warmed += 1
+            else:
+                missing += 1
+            time.sleep(delay)
+    flush()
+    return {"distinct": len(seen), "warmed": warmed, "missing": missing, **stats()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Кэш геокодера для /autocomplete_geo")
+    parser.add_argument("--prewarm", action="store_true", help="прогреть по from/to заявок")
+    parser.add_argument("--lang", default="en")
+    parser.add_argument("--query", help="проверить поиск по строке")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.prewarm:
+        print(json.dumps(prewarm_from_requests(args.lang), ensure_ascii=False, indent=2))
+    if args.query:
+        t0 = time.perf_counter()
+        found = search(args.query, 8, args.lang)
+        print(json.dumps(found, ensure_ascii=False, indent=2))
+        print(f"{(time.perf_counter() - t0) * 1000:.3f} ms")
+        flush()
@@ -0,0 +1,175 @@
+# backend/services/place_matcher.py — ТРАНСЛИТЕРАЦИЯ И НЕЧЁТКИЙ ПОИСК ГОРОДОВ
+"""
+Диспетчеры пишут один и тот же город по-грузински, по-русски и латиницей
+(თბილისი / Тбилиси / Tbilisi), да ещё с опечатками. Здесь:
+
+- fold(): сводит все три письменности к общему латинскому «скелету»;
+- TrigramIndex: поиск с опечатками (кандидаты по триграммам + ограниченный Левенштейн);
+- Popularity: сколько раз место встречалось в from/to заявок — для ранжирования;
+- detect_lang(): язык подписи по письменности запроса, если lang не передан.
+"""
+from __future__ import annotations
+
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Грузинский → латиница (национальная система, упрощённо)
+_KA = {
+    "ა": "a", "ბ": "b", "გ": "g", "დ": "d", "ე": "e", "ვ": "v", "ზ": "z", "თ": "t",
+    "ი": "i", "კ": "k", "ლ": "l", "მ": "m", "ნ": "n", "ო": "o", "პ": "p", "ჟ": "zh",
+    "რ": "r", "ს": "s", "ტ": "t", "უ": "u", "ფ": "p", "ქ": "k", "ღ": "gh", "ყ": "q",
+    "შ": "sh", "ჩ": "ch", "ც": "ts", "ძ": "dz", "წ": "ts", "ჭ": "ch", "ხ": "kh", "ჯ": "j",
+    "ჰ": "h",
+}
+# Кириллица → латиница
+_RU = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh",
+    "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya", "і": "i", "ї": "yi", "є": "ye", "ґ": "g",
+}
+_TRANSLIT = str.maketrans({**_KA, **_RU})
+
+# Латинский «скелет»: убираем различия, которые дают разные системы транслитерации
+_SKELETON = [
+    (re.compile(r"shch"), "sh"),
+    (re.compile(r"dzh"), "j"),
+    (re.compile(r"ph"), "f"),
+    (re.compile(r"f"), "p"),
+    (re.compile(r"kh"), "h"),
+    (re.compile(r"c(?!h)"), "k"),
+    (re.compile(r"q"), "k"),
+    (re.compile(r"w"), "v"),
+    (re.compile(r"y"), "i"),
+    (re.compile(r"(.)\1+"), r"\1"),
+]
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+_GEORGIAN = re.compile(r"[Ⴀ-ჿ]")
+_CYRILLIC = re.compile(r"[Ѐ-ӿ]")
+
+
+def fold(text: str) -> str:
+    """თბილისი / Тбилиси / Tbilissi → 'tbilisi'."""
+    s = _NON_WORD.sub(" ", (text or "").casefold()).strip()
+    s = s.translate(_TRANSLIT)
+    for rx, repl in _SKELETON:
+        s = rx.sub(repl, s)
+    return s
+
+
+def detect_lang(text: str) -> Optional[str]:
+    if _GEORGIAN.search(text or ""):
+        return "ka"
+    if _CYRILLIC.search(text or ""):
+        return "ru"
+    return None
+
+
+def _trigrams(s: str) -> set:
+    s = f"  {s}"
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def _bounded_levenshtein(a: str, b: str, limit: int) -> int:
+    """Расстояние Левенштейна, но не дальше limit (иначе limit + 1)."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i] + [0] * len(b)
+        best = cur[0]
+        for j, cb in enumerate(b, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            best = min(best, cur[j])
+        if best > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+
+def max_typos(query: str) -> int:
+    return 0 if len(query) < 4 else (1 if len(query) < 8 else 2)
+
+
+class TrigramIndex:
+    """Нечёткий префиксный поиск: запрос сравнивается с началом названия той же длины."""
+
+    def __init__(self):
+        self._postings: Dict[str, set] = defaultdict(set)
+        self._keys: List[tuple] = []   # (folded key, idx)
+
+    def add(self, key: str, idx: int):
+        kid = len(self._keys)
+        self._keys.append((key, idx))
+        for g in _trigrams(key):
+            self._postings[g].add(kid)
+
+    def search(self, query: str) -> Dict[int, int]:
+        """{idx места: число опечаток} для мест, чьё название похоже на query."""
+        limit = max_typos(query)
+        if not limit:
+            return {}
+        grams = _trigrams(query)
+        counts = Counter()
+        for g in grams:
+            counts.update(self._postings.get(g, ()))
+        # при k опечатках теряется не больше 3k триграмм
+        need = max(1, len(grams) - 3 * limit)
+        found: Dict[int, int] = {}
+        for kid, common in counts.items():
+            if common < need:
+                continue
+            key, idx = self._keys[kid]
+            d = min(_bounded_levenshtein(query, key[:n], limit)
+                    for n in range(max(1, len(query) - limit), len(query) + limit + 1))
+            if d <= limit and d < found.get(idx, limit + 1):
+                found[idx] = d
+        return found
+
+
+class Popularity:
+    """
+    Частота мест в from/to заявок. Пересчитывается в фоне не чаще раза в refresh секунд;
+    пока не посчитано — все места равны. loader отдаёт уже агрегированные пары (место, количество).
+    """
+
+    def __init__(self, loader: Callable[[], Iterable[tuple]], resolve: Callable[[str], Optional[int]],
+                 refresh: float = 600.0):
+        self._loader = loader
+        self._resolve = resolve
+        self.refresh = refresh
+        self._counts: Counter = Counter()
+        self._loaded_at: Optional[float] = None
+        self._busy = threading.Lock()
+
+    def get(self, idx: int) -> int:
+        self._maybe_refresh()
+        return self._counts.get(idx, 0)
+
+    def _maybe_refresh(self):
+        if self._busy.locked() or (self._loaded_at is not None
+                                   and time.monotonic() - self._loaded_at < self.refresh):
+            return
+        self._loaded_at = time.monotonic()  # не плодим потоки, пока идёт пересчёт
+        threading.Thread(target=self._recount, name="place-popularity", daemon=True).start()
+
+    def _recount(self):
+        if not self._busy.acquire(blocking=False):
+            return
+        try:
+            counts = Counter()
+            for text, n in self._loader() or []:
+                idx = self._resolve(text) if str(text or "").strip() else None
+                if idx is not None:
+                    counts[idx] += int(n)
+            self._counts = counts
+        except Exception as e:
+            logging.error(f"[place_matcher] popularity recount failed: {e}")
+        finally:
+            self._loaded_at = time.monotonic()
+            self._busy.release()
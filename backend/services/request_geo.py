@@ -0,0 +1,151 @@
+# backend/services/request_geo.py — КООРДИНАТЫ ЗАЯВОК И GEOJSON ДЛЯ КАРТЫ
+"""
+Тексты from/to попадают в таблицу request_geo триггером при каждом сохранении заявки.
+Здесь:
+- фоновый поток, который один раз геокодирует новые/изменившиеся тексты
+  (локальный индекс geo_cache, Nominatim — только при промахе и не чаще 1 раза в секунду);
+- сборка GeoJSON FeatureCollection для /map/data: фильтр по bbox и статусу,
+  кластеризация по сетке в пикселях текущего zoom.
+"""
+from __future__ import annotations
+
+import logging
+import math
+import threading
+import time
+from typing import Dict, List, Optional
+
+from backend.core.database import list_request_geo_pending, set_request_geo_coords, load_request_geo
+from backend.services import geo_cache
+from backend.services.place_matcher import detect_lang
+
+WORKER_INTERVAL = 15.0       # секунд между проходами по «ожидающим» заявкам
+UPSTREAM_DELAY = 1.0         # политика Nominatim: не чаще 1 запроса в секунду
+CLUSTER_MAX_ZOOM = 12        # с этого zoom и ближе — без кластеров
+CLUSTER_CELL_PX = 64         # размер ячейки сетки на экране
+CLUSTER_MAX_IDS = 100
+
+_worker: Optional[threading.Thread] = None
+
+
+# ── геокодинг ────────────────────────────────────────────────────────────────
+def _geocode(text: str) -> Optional[tuple]:
+    """(lat, lon) или None. Сначала локально: весь текст, потом город до запятой."""
+    if not text:
+        return None
+    lang = detect_lang(text) or "en"
+    head = text.split(",")[0].strip()
+    for q, upstream in ((text, False), (head, False), (text, True)):
+        if not q:
+            continue
+        res = geo_cache.geocode(q, lang, upstream=upstream)
+        if res:
+            return res["lat"], res["lon"]
+    return None
+
+
+def resolve_pending(limit: int = 50) -> int:
+    """Один проход: геокодирует заявки без координат. Возвращает число обновлённых."""
+    done = 0
+    for row in list_request_geo_pending(limit):
+        calls = geo_cache.stats()["upstream_calls"]
+        from_pt = _geocode(row["from_text"]) if row["from_lat"] is None else None
+        to_pt = _geocode(row["to_text"]) if row["to_lat"] is None else None
+        if set_request_geo_coords(row["request_id"], row["from_text"], row["to_text"], from_pt, to_pt):
+            done += 1
+        if geo_cache.stats()["upstream_calls"] != calls:
+            time.sleep(UPSTREAM_DELAY)
+    return done
+
+
+def _worker_loop():
+    while True:
+        try:
+            # ожидающие заявки кончаются: геокодер сдаётся после нескольких попыток
+            while resolve_pending():
+                pass
+        except Exception as e:
+            logging.error(f"[request_geo] worker error: {e}")
+        time.sleep(WORKER_INTERVAL)
+
+
+def start_worker():
+    global _worker
+    if _worker is None:
+        _worker = threading.Thread(target=_worker_loop, name="request-geo", daemon=True)
+        _worker.start()
+
+
+# ── GeoJSON ──────────────────────────────────────────────────────────────────
+def _point(lon: float, lat: float, props: dict) -> dict:
+    return {"type": "Feature", "geometry": {"type": "Point", "coordinates": [lon, lat]}, "properties": props}
+
+
+def _endpoints(rows: List[dict], bbox: Optional[tuple]) -> List[dict]:
+    out = []
+    for r in rows:
+        ends = {
+            "from": (r["from_lon"], r["from_lat"], r["from_text"]),
+            "to": (r["to_lon"], r["to_lat"], r["to_text"]),
+        }
+        for kind, (lon, lat, label) in ends.items():
+            if lat is None or lon is None:
+                continue
+            if bbox and not (bbox[0] <= lon <= bbox[2] and bbox[1] <= lat <= bbox[3]):
+                continue
+            other = ends["to" if kind == "from" else "from"]
+            out.append(_point(lon, lat, {
+                "kind": kind,
+                "request_id": r["request_id"],
+                "status": r["status"],
+                "label": label,
+                "other": [other[0], other[1]] if other[1] is not None else None,
+            }))
+    return out
+
+
+def _mercator(lon: float, lat: float) -> tuple:
+    """Нормированные координаты Web Mercator в [0, 1]."""
+    lat = max(min(lat, 85.05112878), -85.05112878)
+    x = (lon + 180.0) / 360.0
+    s = math.sin(math.radians(lat))
+    y = 0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)
+    return x, y
+
+
+def _cluster(points: List[dict], zoom: int) -> List[dict]:
+    cell = CLUSTER_CELL_PX / (256.0 * (2 ** zoom))
+    cells: Dict[tuple, List[dict]] = {}
+    for f in points:
+        x, y = _mercator(*f["geometry"]["coordinates"])
+        cells.setdefault((int(x / cell), int(y / cell)), []).append(f)
+
+    out = []
+    for members in cells.values():
+        if len(members) == 1:
+            out.append(members[0])
+            continue
+        lon = sum(m["geometry"]["coordinates"][0] for m in members) / len(members)
+        lat = sum(m["geometry"]["coordinates"][1] for m in members) / len(members)
+        ids = sorted({m["properties"]["request_id"] for m in members})
+        out.append(_point(lon, lat, {
+            "cluster": True,
+            "count": len(members),
+            "from_count": sum(1 for m in members if m["properties"]["kind"] == "from"),
+            "to_count": sum(1 for m in members if m["properties"]["kind"] == "to"),
+            "request_ids": ids[:CLUSTER_MAX_IDS],
+        }))
+    return out
+
+
+def feature_collection(statuses: Optional[List[str]] = None, bbox: Optional[tuple] = None,
+                       zoom: Optional[int] = None, request_id: Optional[int] = None) -> tuple:
+    """(FeatureCollection, version) — version для ETag."""
+    rows, version = load_request_geo(statuses, bbox, request_id)
+    features = _endpoints(rows, bbox)
+    if zoom is not None and zoom < CLUSTER_MAX_ZOOM:
+        features = _cluster(features, zoom)
+    fc = {"type": "FeatureCollection", "features": features, "version": version}
+    if bbox:
+        fc["bbox"] = list(bbox)
+    return fc, version
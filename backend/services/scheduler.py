@@ -0,0 +1,196 @@
+# backend/services/scheduler.py — ФОНОВЫЕ ЗАДАЧИ ПО РАСПИСАНИЮ
+"""
+Вместо «while True: sleep» в websocket_server — задачи с расписанием в стиле cron.
+
+- расписание — подмножество cron из пяти полей «минута час день месяц день_недели»:
+  *, */N, A-B, A-B/N, списки через запятую (день недели: 0 или 7 — воскресенье);
+  время локальное, как и у прежней «полуночи»;
+- jitter — случайная задержка 0..N секунд, чтобы воркеры не били в БД одновременно;
+- лидерство: каждый процесс планирует все задачи, но запускает только тот, кто захватил
+  слот в scheduler_runs под pg_try_advisory_xact_lock (database.claim_job_run) —
+  при нескольких воркерах/хостах задача отрабатывает один раз за слот;
+- метрики: запуски, пропуски (слот забрал другой), ошибки, длительность — stats()
+  (в server_status) и таблица scheduler_runs (общая для всех процессов).
+
+Настройки — секция "scheduler" в config/config.json:
+  {"jobs": {"<имя>": {"cron": "...", "jitter": 30, "enabled": true}}}
+"""
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import logging
+import os
+import random
+import socket
+import time
+from typing import Awaitable, Callable, Optional
+
+from backend.core.async_database import claim_job_run, finish_job_run
+
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+DEFAULT_LEASE = 3600
+
+
+class CronSchedule:
+    """Разбор пятипольного cron-выражения и поиск следующего срабатывания."""
+
+    _FIELDS = (("minute", 0, 59), ("hour", 0, 23), ("day", 1, 31), ("month", 1, 12), ("weekday", 0, 7))
+
+    def __init__(self, expr: str):
+        parts = str(expr).split()
+        if len(parts) != 5:
+            raise ValueError(f"cron: нужно 5 полей, получено {expr!r}")
+        self.expr = expr
+        values = [self._parse(p, lo, hi) for p, (_, lo, hi) in zip(parts, self._FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = values
+        self.weekdays = {d % 7 for d in weekdays}
+        # как в cron: если ограничены и день месяца, и день недели — подходит любой из них
+        self._day_any = parts[2] == "*"
+        self._weekday_any = parts[4] == "*"
+
+    @staticmethod
+    def _parse(field: str, lo: int, hi: int) -> set:
+        out = set()
+        for item in field.split(","):
+            rng, _, step = item.partition("/")
+            step = int(step) if step else 1
+            if rng == "*":
+                start, end = lo, hi
+            elif "-" in rng:
+                start, end = (int(x) for x in rng.split("-", 1))
+            else:
+                start = end = int(rng)
+                if step > 1:
+                    end = hi
+            if start < lo or end > hi or start > end or step < 1:
+                raise ValueError(f"cron: поле {field!r} вне диапазона {lo}-{hi}")
+            out.update(range(start, end + 1, step))
+        return out
+
+    def _day_matches(self, day: dt.date) -> bool:
+        in_month = day.day in self.days
+        in_week = (day.isoweekday() % 7) in self.weekdays
+        if self._day_any and self._weekday_any:
+            return True
+        if self._day_any:
+            return in_week
+        if self._weekday_any:
+            return in_month
+        return in_month or in_week
+
+    def next_after(self, after: dt.datetime) -> dt.datetime:
+        """Ближайшее время срабатывания строго после after (с точностью до минуты)."""
+        t = after.replace(second=0, microsecond=0) + dt.timedelta(minutes=1)
+        limit = t + dt.timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months or not self._day_matches(t.date()):
+                t = dt.datetime.combine(t.date() + dt.timedelta(days=1), dt.time(0, 0), t.tzinfo)
+                continue
+            if t.hour not in self.hours:
+                t = t.replace(minute=0) + dt.timedelta(hours=1)
+                continue
+            if t.minute not in self.minutes:
+                t += dt.timedelta(minutes=1)
+                continue
+            return t
+        raise ValueError(f"cron: {self.expr!r} не срабатывает никогда")
+
+
+class Job:
+    def __init__(self, name: str, cron: str, fn: Callable[[], Awaitable[None]],
+                 jitter: float = 0.0, run_at_start: bool = False, lease: int = DEFAULT_LEASE):
+        self.name = name
+        self.schedule = CronSchedule(cron)
+        self.fn = fn
+        self.jitter = max(0.0, float(jitter))
+        self.run_at_start = run_at_start
+        self.lease = lease
+        self.next_run: Optional[dt.datetime] = None
+        self.runs = 0
+        self.skipped = 0
+        self.failures = 0
+        self.last_duration_ms: Optional[float] = None
+        self.max_duration_ms = 0.0
+        self.total_duration_ms = 0.0
+        self.last_error: Optional[str] = None
+
+    def stats(self) -> dict:
+        return {
+            "cron": self.schedule.expr,
+            "next_run": self.next_run.isoformat(timespec="seconds") if self.next_run else None,
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "last_ms": self.last_duration_ms,
+            "avg_ms": round(self.total_duration_ms / self.runs, 1) if self.runs else None,
+            "max_ms": round(self.max_duration_ms, 1),
+            "last_error": self.last_error,
+        }
+
+
+class Scheduler:
+    def __init__(self, config: Optional[dict] = None):
+        self.config = (config or {}).get("jobs") or {}
+        self.jobs: dict[str, Job] = {}
+        self._tasks: list[asyncio.Task] = []
+
+    def add(self, name: str, cron: str, fn: Callable[[], Awaitable[None]], jitter: float = 0.0,
+            run_at_start: bool = False, lease: int = DEFAULT_LEASE):
+        """Регистрация задачи; cron/jitter/enabled можно переопределить в config["jobs"][name]."""
+        override = self.config.get(name) or {}
+        if not override.get("enabled", True):
+            logging.info(f"[scheduler] job {name} disabled in config")
+            return
+        self.jobs[name] = Job(name, override.get("cron", cron), fn,
+                              jitter=override.get("jitter", jitter), run_at_start=run_at_start, lease=lease)
+
+    def start(self):
+        for job in self.jobs.values():
+            self._tasks.append(asyncio.create_task(self._loop(job), name=f"job:{job.name}"))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _loop(self, job: Job):
+        if job.run_at_start:
+            await self.run(job, dt.datetime.now().astimezone().replace(second=0, microsecond=0))
+        while True:
+            job.next_run = job.schedule.next_after(dt.datetime.now()).astimezone()
+            delay = (job.next_run - dt.datetime.now().astimezone()).total_seconds()
+            await asyncio.sleep(max(0.0, delay) + random.uniform(0, job.jitter))
+            await self.run(job, job.next_run)
+
+    async def run(self, job: Job, slot: dt.datetime) -> bool:
+        """Запуск за слот slot, если его не забрал другой процесс. True — задача выполнялась здесь."""
+        if not await claim_job_run(job.name, slot, OWNER, job.lease):
+            job.skipped += 1
+            return False
+        t0 = time.perf_counter()
+        error = None
+        try:
+            await job.fn()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            logging.exception(f"[scheduler] job {job.name} failed")
+        ms = (time.perf_counter() - t0) * 1000
+        job.runs += 1
+        job.failures += 1 if error else 0
+        job.last_error = error
+        job.last_duration_ms = round(ms, 1)
+        job.total_duration_ms += ms
+        job.max_duration_ms = max(job.max_duration_ms, ms)
+        await finish_job_run(job.name, OWNER, round(ms), error)
+        logging.info(f"[scheduler] job {job.name} done", extra={
+            "job": job.name, "slot": slot.isoformat(timespec="minutes"), "duration_ms": round(ms, 1),
+            "ok": error is None,
+        })
+        return True
+
+    def stats(self) -> dict:
+        return {name: job.stats() for name, job in self.jobs.items()}
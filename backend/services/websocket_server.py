@@ -1,34 +1,54 @@
-import json
 import os
 import base64
 import asyncio
 import websockets
-import traceback
 import logging
 import time  # модуль времени (оставляем как модуль!)
+import multiprocessing
+import socket
 from backend.core.database import (
+    APP_CONFIG, init_db, pool_stats, request_cache_stats, start_request_cache_listener,
+    driver_vehicle, first_loading_date,
+)
+from backend.core.async_database import (
     load_all_requests,
+    load_requests_page,
+    load_requests_since,
+    query_requests,
+    get_requests_revision,
+    prune_request_changelog,
     save_request_to_db,
+    patch_request,
+    add_request_comment,
+    get_request_comments,
     add_user,
     get_user,
     deleteTask,
-    init_db,
     get_request_from_db,
     check_password,
-    list_vehicle_statuses,
+    list_vehicle_statuses_snapshot,
+    list_vehicle_statuses_since,
+    prune_vehicle_status_deletions,
     reconcile_statuses_for_request,
     reconcile_statuses_from_request,
     set_vehicle_status_text,
     toggle_vehicle_unloaded,
     all_unloaded_for_request,
-    set_request_status_closed,
+    find_vehicle_conflicts,
+    vehicle_history,
+    close_request_if_unloaded,
+    close_all_unloaded_requests,
     clear_daily_status_texts,
     cleanup_unloaded_rows_older_than_48h
 )
-from backend.core.log_config import setup_logging
+from backend.core.log_config import setup_logging, log_action, redact
+from backend.core import serialization
+from backend.services import file_transfer
+from backend.services.ws_hub import Hub, topics_for
+from backend.services.event_bus import create_bus
+from backend.services import ws_codec
+from backend.services.scheduler import Scheduler
 from pathlib import Path
-import datetime as dt  # модуль datetime под коротким именем
-from decimal import Decimal
 import uuid  # вверху файла, если ещё нет
 import datetime
 session_token = str(uuid.uuid4())
@@ -38,111 +58,152 @@ init_db()
 
 ATTACH_DIR = Path(__file__).parent.parent.parent / "attachments"
 
-connected_clients = set()
+WS_CONFIG = APP_CONFIG.get("ws") or {}
+WS_HOST = WS_CONFIG.get("host", "0.0.0.0")
+WS_PORT = int(WS_CONFIG.get("port", 8766))
+WS_WORKERS = max(1, int(WS_CONFIG.get("workers", 1)))
+if WS_WORKERS > 1 and not hasattr(socket, "SO_REUSEPORT"):
+    # Windows: без SO_REUSEPORT второй воркер не сможет занять порт и будет падать по кругу
+    logging.warning(f"[ws] workers={WS_WORKERS} requires SO_REUSEPORT, not available on this platform; running 1 worker")
+    WS_WORKERS = 1
+# несколько воркеров/хостов видят события друг друга только через Postgres
+WS_BUS = "postgres" if WS_WORKERS > 1 else WS_CONFIG.get("bus", "memory")
+
+# Сессии клиентов: очередь исходящих + писатель на каждое соединение, подписки на топики
+hub = Hub()
+# Шина событий: свои клиенты + остальные воркеры (event_bus.py)
+bus = create_bus(WS_BUS, hub.publish)
+# Фоновые задачи: расписание + лидерство через Postgres (scheduler.py)
+scheduler = Scheduler(APP_CONFIG.get("scheduler"))
+
+logging.info(f"🟢 Сервер JM Trans Group запущен на порту {WS_PORT}")
+
+
+def _encode_for(session, message: dict):
+    """Ответ одному клиенту в его кодировке: MessagePack (бинарный кадр) или JSON-текст."""
+    if session.encoding == ws_codec.MSGPACK:
+        return ws_codec.packb(message)
+    return serialization.dumps(message)
 
-def _json_default(o):
+
+async def broadcast(message, exclude_ws=None, topics=None):
     """
-    Безопасная сериализация для json.dumps:
-    - date/datetime/time -> ISO-строки
-    - Decimal -> float
-    - всё прочее -> str (как крайняя мера)
+    Сериализуем один раз (в байты UTF-8) и раскладываем по очередям подписанных
+    клиентов — без ожидания сокетов: медленный клиент не задерживает остальных.
+    Через шину событие получают и клиенты других воркеров.
+    topics — по умолчанию по action/id заявки (ws_hub.topics_for).
     """
-    if isinstance(o, (dt.datetime, dt.date, dt.time)):
-        return o.isoformat()
-    if isinstance(o, Decimal):
-        return float(o)
-    try:
-        return str(o)
-    except Exception:
-        return None
-
-def _json_dumps_safe(message: dict) -> str:
-    # ensure_ascii=False — чтобы грузинский/русский текст не превращался в \uXXXX
-    return json.dumps(message, default=_json_default, ensure_ascii=False)
-
-print("🟢 Сервер JM Trans Group запущен на порту 8766")
-logging.info("🟢 Сервер JM Trans Group запущен на порту 8766")
-
-
-async def broadcast(message, exclude_ws=None):
-    data = _json_dumps_safe(message)
-    for client in list(connected_clients):
-        if client is exclude_ws:
-            continue
-        try:
-            # пропускаем уже закрытые соединения
-            if getattr(client, "closed", False):
-                connected_clients.discard(client)
-                continue
-            await client.send(data)
-        except Exception as e:
-            logging.error(f"Ошибка отправки клиенту: {e}")
-            try:
-                await client.close()
-            except Exception:
-                pass
-            connected_clients.discard(client)
+    data = serialization.dumps_bytes(message)
+    await bus.publish(data, set(topics) if topics else topics_for(message), exclude_ws=exclude_ws)
+
+
+# Водяной знак vehicle_statuses, до которого изменения уже разосланы клиентам
+# (database._SYNC_WATERMARK_SQL: не теряет правки, закоммиченные не по порядку,
+# в том числе другими воркерами). Блокировка лишь не даёт двум обработчикам
+# этого процесса разослать одну дельту дважды.
+_statuses_version = 0
+_statuses_lock = asyncio.Lock()
+
+
+async def _broadcast_statuses_snapshot():
+    global _statuses_version
+    rows, version = await list_vehicle_statuses_snapshot()
+    _statuses_version = max(_statuses_version, version)
+    await broadcast({"action": "statuses_sync", "data": rows, "version": version})
+
+
+async def _broadcast_statuses_delta():
+    """Разослать только изменившиеся строки vehicle_statuses (statuses_delta).
+    Вызывать под _statuses_lock. Если дельта слишком велика — полный снапшот."""
+    global _statuses_version
+    delta = await list_vehicle_statuses_since(_statuses_version)
+    if delta is None:
+        await _broadcast_statuses_snapshot()
+        return
+    if not delta["upserts"] and not delta["deletes"]:
+        return
+    _statuses_version = delta["version"]
+    await broadcast({"action": "statuses_delta", **delta})
 
 
 async def handle_client(websocket):
     ip, port = websocket.remote_address
     logging.info(
         f"🟢 კლიენტი შეერთებულია — IP: {ip}, Port: {port}")
-    connected_clients.add(websocket)
+    session = hub.register(websocket)
+    downloads = set()  # активные потоковые скачивания этого клиента
 
     try:
         async for message in websocket:
             try:
-                data = json.loads(message)
+                if isinstance(message, bytes):
+                    # бинарный кадр — чанк загрузки файла (file_transfer)
+                    await file_transfer.handle_binary(websocket, message)
+                    continue
+                data = serialization.loads(message)
                 action = data.get("action")
-                print("[SERVER] ⏱ ПОЛУЧЕНО ОТ КЛИЕНТА:", time.time(), action)
-                print(f"[SERVER RECEIVE] action={action} | data={data}")
-                logging.info(f"[SERVER RECEIVE] action={action} | data={data}")
+                log_action(action, data, ip=ip)
 
                 if action == "ping":
-                    await websocket.send(json.dumps({"action": "pong"}))
+                    await websocket.send(serialization.dumps({"action": "pong"}))
 
                 elif action == "server_status":
-                    await websocket.send(json.dumps({"action": "server_status", "status": "running"}))
+                    await websocket.send(serialization.dumps({"action": "server_status", "status": "running", "db_pool": pool_stats(), "request_cache": request_cache_stats(), "ws": hub.stats(), "bus": bus.stats(), "scheduler": scheduler.stats(), "pid": os.getpid()}))
+
+                # --- Подписки на топики (requests / statuses / request:<id>) ---
+                elif action == "subscribe":
+                    session.subscribe(data.get("topics"), replace=bool(data.get("replace")))
+                    await websocket.send(serialization.dumps({"action": "subscribe", "topics": sorted(session.topics)}))
+
+                elif action == "unsubscribe":
+                    session.unsubscribe(data.get("topics"))
+                    await websocket.send(serialization.dumps({"action": "unsubscribe", "topics": sorted(session.topics)}))
 
                 elif action == "add_request":
                     request_data = data.get("data")
                     if request_data:
                         try:
                             t0 = time.time()
-                            print(f"[SERVER] [add_request] start: {t0:.6f}")
 
-                            saved = save_request_to_db(request_data)  # ← ВАЖНО: получить объект С УЖЕ ВЫДАННЫМ id
+                            saved = await save_request_to_db(request_data)  # ← ВАЖНО: получить объект С УЖЕ ВЫДАННЫМ id
                             if not saved or not saved.get("id"):
                                 raise RuntimeError("save_request_to_db returned no id")
 
                             t1 = time.time()
-                            print(f"[SERVER] [add_request] после save_request_to_db: {t1:.6f} (+{t1 - t0:.4f}s)")
+                            conflicts = await find_vehicle_conflicts(saved.get("id")) or []
 
                             # Отправляем инициатору и вещаем остальным уже сохранённую заявку
-                            await websocket.send(json.dumps({
+                            await websocket.send(serialization.dumps({
                                 "action": "new_request",
                                 "status": "success",
                                 "data": saved,
-                                "message": "✅ განაცხადი წარმატებით დაემატა"
+                                "message": "✅ განაცხადი წარმატებით დაემატა",
+                                **({"conflicts": conflicts} if conflicts else {}),
                             }))
                             await broadcast({"action": "new_request", "data": saved}, exclude_ws=websocket)
                             # >>> STATUSES: reconcile and broadcast (ПО КАЖДОМУ ВОДИТЕЛЮ)
                             try:
                                 req_for_status = saved or request_data or {}
-                                reconcile_statuses_from_request(req_for_status)
-                                rows = list_vehicle_statuses()
-                                await broadcast({"action": "statuses_sync", "data": rows})
+                                async with _statuses_lock:
+                                    changes = await reconcile_statuses_from_request(req_for_status)
+                                    # рассылаем, только если набор машин/дат действительно изменился
+                                    if changes is None or any(changes.values()):
+                                        await _broadcast_statuses_delta()
                                 logging.info(f"[statuses] reconcile_from_request id={req_for_status.get('id')}")
                             except Exception:
                                 logging.exception("[statuses] reconcile after add_request failed")
 
 
                             t2 = time.time()
-                            print(f"[SERVER] [add_request] после websocket.send: {t2:.6f} (+{t2 - t1:.4f}s, от начала: +{t2 - t0:.4f}s)")
+                            logging.info("[add_request] saved", extra={
+                                "request_id": saved.get("id"),
+                                "save_ms": round((t1 - t0) * 1000, 1),
+                                "conflicts": len(conflicts),
+                                "total_ms": round((t2 - t0) * 1000, 1),
+                            })
                         except Exception as e:
                             logging.error(f"Ошибка добавления заявки: {e}")
-                            await websocket.send(json.dumps({
+                            await websocket.send(serialization.dumps({
                                 "action": "new_request",
                                 "status": "error",
                                 "message": "❌ განაცხადის დამატების შეცდომა"
@@ -163,51 +224,66 @@ async def handle_client(websocket):
                             try:
                                 rid = int(str(request_id).strip())
                             except Exception:
-                                await websocket.send(json.dumps({
+                                await websocket.send(serialization.dumps({
                                     "action": "edit_request",
                                     "status": "fail",
                                     "message": "Некорректный id заявки"
                                 }))
                                 return
 
-                            req = get_request_from_db(rid)
-                            if not req:
-                                await websocket.send(json.dumps({
-                                    "action": "edit_request",
-                                    "status": "fail",
-                                    "message": "Заявка не найдена"
-                                }))
-                                return
-
                             # ✅ ЖЁСТКО сохраняем id и не даём его перезаписать
                             new_data.pop("id", None)
-                            req.update(new_data)
-                            req["id"] = rid
+                            expected_revision = data.get("expected_revision", new_data.pop("expected_revision", None))
 
                             # Метаданные правки
                             if editor:
-                                req["last_editor"] = editor
-                            req["last_edit_ts"] = time.strftime("%Y-%m-%d %H:%M:%S")
+                                new_data["last_editor"] = editor
+                            new_data["last_edit_ts"] = time.strftime("%Y-%m-%d %H:%M:%S")
 
-                            saved = save_request_to_db(req)
-                            # 1) Явный ACK инициатору
-                            await websocket.send(json.dumps({
+                            # Один UPDATE ... data = data || patch RETURNING data — без чтения до и после
+                            result, updated = await patch_request(rid, new_data, expected_revision)
+                            if result == "not_found":
+                                await websocket.send(serialization.dumps({
+                                    "action": "edit_request",
+                                    "status": "fail",
+                                    "message": "Заявка не найдена"
+                                }))
+                                return
+                            if result == "conflict":
+                                # Заявку уже изменил другой диспетчер: отдаём инициатору актуальную версию
+                                await websocket.send(serialization.dumps({
+                                    "action": "request_updated",
+                                    "status": "conflict",
+                                    "id": rid,
+                                    "data": updated,
+                                    "message": "Заявка уже изменена другим пользователем"
+                                }))
+                                continue
+                            if result != "ok":
+                                raise RuntimeError("patch_request failed")
+
+                            # 1) Явный ACK инициатору (+ предупреждение о занятых машинах)
+                            conflicts = []
+                            if "drivers" in new_data or "loading_dates" in new_data:
+                                conflicts = await find_vehicle_conflicts(rid) or []
+                            await websocket.send(serialization.dumps({
                                 "action": "edit_request",
                                 "status": "success",
                                 "id": rid,
-                                "message": "Заявка успешно отредактирована"
+                                "revision": updated.get("revision"),
+                                "message": "Заявка успешно отредактирована",
+                                **({"conflicts": conflicts} if conflicts else {}),
                             }))
 
-                            # 2) Шлём свежую версию
-                            updated = get_request_from_db(rid) or saved or req
-                            if editor:
-                                updated["last_editor"] = editor
+                            # 2) Шлём свежую версию (уже объединённую сервером)
                             await broadcast({"action": "request_updated", "data": updated})
                             # >>> STATUSES: из заявки, с привязкой даты к каждому водителю
                             try:
-                                reconcile_statuses_from_request(updated)
-                                rows = list_vehicle_statuses()
-                                await broadcast({"action": "statuses_sync", "data": rows})
+                                async with _statuses_lock:
+                                    changes = await reconcile_statuses_from_request(updated)
+                                    # рассылаем, только если набор машин/дат действительно изменился
+                                    if changes is None or any(changes.values()):
+                                        await _broadcast_statuses_delta()
                                 logging.info(f"[statuses] reconcile_from_request id={updated.get('id')}")
                             except Exception:
                                 logging.exception("[statuses] reconcile after edit_request failed")
@@ -217,7 +293,7 @@ async def handle_client(websocket):
 
                         except Exception as e:
                             logging.error(f"Ошибка редактирования заявки: {e}")
-                            await websocket.send(json.dumps({
+                            await websocket.send(serialization.dumps({
                                 "action": "edit_request",
                                 "status": "error",
                                 "message": "Ошибка редактирования заявки"
@@ -227,16 +303,16 @@ async def handle_client(websocket):
                     task_id = data.get("id")
                     if task_id:
                         try:
-                            deleteTask(task_id)
+                            await deleteTask(task_id)
                             await broadcast({"action": "trigger_sync"}, exclude_ws=websocket)
-                            await websocket.send(json.dumps({
+                            await websocket.send(serialization.dumps({
                                 "action": "response",
                                 "status": "success",
                                 "message": "Заявка удалена"
                             }))
                         except Exception as e:
                             logging.error(f"Ошибка удаления заявки: {e}")
-                            await websocket.send(json.dumps({"error": "Ошибка удаления заявки"}))
+                            await websocket.send(serialization.dumps({"error": "Ошибка удаления заявки"}))
 
                 # --- Регистрация пользователя ---
                 elif action == "register":
@@ -245,22 +321,22 @@ async def handle_client(websocket):
                     role = data.get("role", "user")
 
                     if not username or not password:
-                        await websocket.send(json.dumps({
+                        await websocket.send(serialization.dumps({
                             "action": "register",
                             "status": "fail",
                             "message": "❌ Необходимо указать логин и пароль"
                         }))
                         return
 
-                    success = add_user(username, password, role)
+                    success = await add_user(username, password, role)
                     if success:
-                        await websocket.send(json.dumps({
+                        await websocket.send(serialization.dumps({
                             "action": "register",
                             "status": "success",
                             "message": "✅ რეგისტრაცია წარმატებით შესრულდა"
                         }))
                     else:
-                        await websocket.send(json.dumps({
+                        await websocket.send(serialization.dumps({
                             "action": "register",
                             "status": "fail",
                             "message": "❌ Этот пользователь уже существует или данные некорректны"
@@ -271,12 +347,12 @@ async def handle_client(websocket):
                 elif action == "auth":
                     username = data.get("username")
                     password = data.get("password")
-                    user = get_user(username)
-                    print(f"USER FROM DB: {user}")
-                    if user and check_password(password, user["password"]):
+                    user = await get_user(username)
+                    logging.info("[auth] login attempt", extra={"username": username, "found": bool(user), "ip": ip})
+                    if user and await check_password(password, user["password"]):
                         import uuid
                         session_token = str(uuid.uuid4())
-                        await websocket.send(json.dumps({
+                        await websocket.send(serialization.dumps({
                             "action": "auth",
                             "status": "success",
                             "role": user.get("role", "user"),
@@ -284,7 +360,7 @@ async def handle_client(websocket):
                             "session_token": session_token
                         }))
                     else:
-                        await websocket.send(json.dumps({
+                        await websocket.send(serialization.dumps({
                             "action": "auth",
                             "status": "fail",
                             "message": "❌ მომხმარებელი არ მოიძებნა ან პაროლი არასწორია"
@@ -294,7 +370,7 @@ async def handle_client(websocket):
                     token = data.get("token")
                     # Здесь должна быть ваша логика проверки токена, если вы её делаете
                     # Для MVP достаточно просто принять любой токен как валидный:
-                    await websocket.send(json.dumps({
+                    await websocket.send(serialization.dumps({
                         "action": "resume_session",
                         "status": "success"
                     }))
@@ -306,26 +382,24 @@ async def handle_client(websocket):
                     filename = data.get("filename")
                     filedata = data.get("filedata")
                     if not all([task_id, filename, filedata]):
-                        print("UPLOAD ERROR: missing params")
+                        logging.warning("[file] upload: missing params", extra={"task_id": task_id, "file_name": filename})
                         return
 
                     # Декодируем и сохраняем файл
-                    os.makedirs(f"attachments/task_{task_id}", exist_ok=True)
                     file_path = f"attachments/task_{task_id}/{filename}"
-                    with open(file_path, "wb") as f:
-                        f.write(base64.b64decode(filedata))
-                    print(f"[SERVER] Файл сохранён: {file_path}")
+                    await asyncio.to_thread(_write_attachment, file_path, base64.b64decode(filedata))
+                    logging.info("[file] saved", extra={"path": file_path})
 
                     # Обновляем заявку в БД
-                    req = get_request_from_db(task_id)
+                    req = await get_request_from_db(task_id)
                     if req is not None:
                         if "attachments" not in req or not isinstance(req["attachments"], list):
                             req["attachments"] = []
                         if filename not in req["attachments"]:
                             req["attachments"].append(filename)
-                        saved = save_request_to_db(req)
+                        saved = await save_request_to_db(req)
                         rid = (saved or req).get("id")
-                        updated = get_request_from_db(rid) or saved or req
+                        updated = await get_request_from_db(rid) or saved or req
                         await broadcast({"action": "request_updated", "data": updated})
 
                 
@@ -337,7 +411,7 @@ async def handle_client(websocket):
                         file_type = data.get("file_type", "driver_file")  # не используется, но может пригодиться
 
                         if not all([request_id, filename, content_base64]):
-                            await websocket.send(json.dumps({
+                            await websocket.send(serialization.dumps({
                                 "action": "upload_file",
                                 "status": "error",
                                 "error": "Некорректные параметры для загрузки файла"
@@ -346,17 +420,14 @@ async def handle_client(websocket):
 
                         # Декодируем файл
                         file_bytes = base64.b64decode(content_base64)
-                        save_dir = f"attachments/request_{request_id}"
-                        os.makedirs(save_dir, exist_ok=True)
                         safe_name = filename.replace("/", "_").replace("\\", "_")
-                        file_path = os.path.join(save_dir, safe_name)
-                        with open(file_path, "wb") as f:
-                            f.write(file_bytes)
+                        file_path = os.path.join(f"attachments/request_{request_id}", safe_name)
+                        await asyncio.to_thread(_write_attachment, file_path, file_bytes)
 
                         # Формируем url (пусть отдаётся как /files/request_id/filename через nginx/flask)
                         url = f"/files/request_{request_id}/{safe_name}"
 
-                        await websocket.send(json.dumps({
+                        await websocket.send(serialization.dumps({
                             "action": "upload_file",
                             "status": "ok",
                             "file": {
@@ -365,7 +436,7 @@ async def handle_client(websocket):
                             }
                         }))
                     except Exception as e:
-                        await websocket.send(json.dumps({
+                        await websocket.send(serialization.dumps({
                             "action": "upload_file",
                             "status": "error",
                             "error": str(e)
@@ -382,9 +453,8 @@ async def handle_client(websocket):
                         found = False
                         for file_path in paths:
                             if os.path.exists(file_path):
-                                with open(file_path, "rb") as f:
-                                    filedata = base64.b64encode(f.read()).decode("utf-8")
-                                await websocket.send(json.dumps({
+                                filedata = base64.b64encode(await asyncio.to_thread(Path(file_path).read_bytes)).decode("utf-8")
+                                await websocket.send(serialization.dumps({
                                     "action": "download_file",
                                     "filename": filename,
                                     "filedata": filedata
@@ -392,127 +462,223 @@ async def handle_client(websocket):
                                 found = True
                                 break
                         if not found:
-                            await websocket.send(json.dumps({
+                            await websocket.send(serialization.dumps({
                                 "action": "download_file",
                                 "filename": filename,
                                 "filedata": None,
                                 "error": "File not found"
                             }))
                     except Exception as e:
-                        await websocket.send(json.dumps({
+                        await websocket.send(serialization.dumps({
                             "action": "download_file",
                             "filename": filename,
                             "filedata": None,
                             "error": f"Server error: {e}"
                         }))
 
+                # --- Потоковая передача файлов бинарными чанками (см. file_transfer) ---
+                elif action == "upload_begin":
+                    await file_transfer.upload_begin(websocket, data)
+
+                elif action == "upload_commit":
+                    await file_transfer.upload_commit(websocket, data)
+
+                elif action == "download_begin":
+                    task = await file_transfer.download_begin(websocket, data)
+                    if task is not None:
+                        downloads.add(task)
+                        task.add_done_callback(downloads.discard)
+
                 elif action == "add_comment":
                     task_id = data.get("task_id")
                     comment = data.get("comment")
                     if not (task_id and comment):
-                        await websocket.send(json.dumps({"error": "Нет данных для комментария"}))
+                        await websocket.send(serialization.dumps({"error": "Нет данных для комментария"}))
                         return
-                    all_requests = load_all_requests()
-                    for req in all_requests:
-                        if str(req.get("id")) == str(task_id):
-                            comments = req.get("comments", [])
-                            comments.append(comment)
-                            req["comments"] = comments
-                            save_request_to_db(req)
-                            break
-                    await websocket.send(json.dumps({"action": "add_comment", "status": "success"}))
-                    # req — это заявка с обновлённым комментарием
+                    # O(1): один INSERT в request_comments, без выгрузки всех заявок
+                    stored = await add_request_comment(task_id, comment)
+                    if stored is None:
+                        await websocket.send(serialization.dumps({"action": "add_comment", "status": "error", "message": "Заявка не найдена"}))
+                        continue
+                    await websocket.send(serialization.dumps({"action": "add_comment", "status": "success", "comment_id": stored["comment_id"]}))
                     await broadcast({
                         "action": "add_comment",
                         "task_id": task_id,
-                        "comment": comment
+                        "comment": stored
                     })
-                    print("[SERVER] ⏱ ОТПРАВЛЕНО КЛИЕНТУ:",
-                          time.time(), action)
+
+                elif action == "get_comments":
+                    # Постраничная подгрузка старых комментариев (в заявке — только последние)
+                    task_id = data.get("task_id")
+                    if not task_id:
+                        await websocket.send(serialization.dumps({"action": "get_comments", "status": "error", "message": "bad params"}))
+                        continue
+                    page = await get_request_comments(task_id, data.get("before_id"), data.get("limit") or 50)
+                    await websocket.send(serialization.dumps({"action": "get_comments", "task_id": task_id, **page}))
 
                 elif action == "update_request":
                     request_data = data.get("data")
                     if not request_data or not request_data.get("id"):
-                        await websocket.send(json.dumps({"action": "update_request", "status": "error", "message": "Нет данных для обновления"}))
+                        await websocket.send(serialization.dumps({"action": "update_request", "status": "error", "message": "Нет данных для обновления"}))
                         return
                     try:
-                        print(
-                            f"[DEBUG] server.py update_request: id={request_data.get('id')}, drivers={request_data.get('drivers')}")
-                        saved = save_request_to_db(request_data)
-                        await websocket.send(json.dumps({"action": "update_request", "status": "success"}))
+                        logging.debug("[update_request]", extra={
+                            "request_id": request_data.get("id"),
+                            "drivers": redact(request_data.get("drivers")),
+                        })
+                        saved = await save_request_to_db(request_data)
+                        conflicts = await find_vehicle_conflicts((saved or request_data).get("id")) or []
+                        await websocket.send(serialization.dumps({
+                            "action": "update_request", "status": "success",
+                            **({"conflicts": conflicts} if conflicts else {}),
+                        }))
                         # берём «свежую» версию из БД на всякий случай
                         rid = (saved or request_data).get("id")
-                        updated = get_request_from_db(rid) or saved or request_data
+                        updated = await get_request_from_db(rid) or saved or request_data
                         await broadcast({"action": "request_updated", "data": updated})
 
                         # >>> STATUSES: reconcile and broadcast (после обычного сохранения)
                         try:
-                            reconcile_statuses_from_request(updated)
-                            rows = list_vehicle_statuses()
-                            await broadcast({"action": "statuses_sync", "data": rows})
+                            async with _statuses_lock:
+                                changes = await reconcile_statuses_from_request(updated)
+                                # рассылаем, только если набор машин/дат действительно изменился
+                                if changes is None or any(changes.values()):
+                                    await _broadcast_statuses_delta()
                             logging.info(f"[statuses] reconcile_from_request id={updated.get('id')}")
                         except Exception:
                             logging.exception("[statuses] reconcile after update_request failed")
                                                                         
                     except Exception as e:
-                        import traceback
-                        traceback.print_exc()
-                        await websocket.send(json.dumps({"action": "update_request", "status": "error", "message": f"Ошибка при сохранении: {e}"}))
+                        logging.exception("[update_request] save failed")
+                        await websocket.send(serialization.dumps({"action": "update_request", "status": "error", "message": f"Ошибка при сохранении: {e}"}))
 
                 elif action == "unknown":
-                    await websocket.send(json.dumps({
+                    await websocket.send(serialization.dumps({
                         "action": "error",
                         "message": "Неизвестная команда"
                     }))
                     
                 elif action == "sync_all":
-                    all_data = load_all_requests()
-                    await websocket.send(_json_dumps_safe({"action": "sync_all", "data": all_data}))
+                    if data.get("limit"):
+                        # Холодный старт по страницам: курсор = последний id предыдущей страницы
+                        rows, next_cursor, revision = await load_requests_page(data.get("cursor") or 0, data.get("limit"))
+                        await websocket.send(_encode_for(session, {
+                            "action": "sync_all",
+                            "data": rows,
+                            "cursor": data.get("cursor") or 0,
+                            "next_cursor": next_cursor,
+                            "revision": revision
+                        }))
+                    else:
+                        # ревизию берём ДО выгрузки: изменения во время чтения клиент догонит через sync_since
+                        revision = await get_requests_revision()
+                        all_data = await load_all_requests()
+                        await websocket.send(_encode_for(session, {"action": "sync_all", "data": all_data, "revision": revision}))
+
+                elif action == "sync_since":
+                    # Реконнект: только изменённые заявки и id удалённых после ревизии клиента
+                    delta = await load_requests_since(data.get("revision") or 0)
+                    if delta is not None:
+                        await websocket.send(_encode_for(session, {"action": "sync_since", "full": False, **delta}))
+                    else:
+                        revision = await get_requests_revision()
+                        all_data = await load_all_requests()
+                        await websocket.send(_encode_for(session, {
+                            "action": "sync_since",
+                            "full": True,
+                            "data": all_data,
+                            "revision": revision
+                        }))
+
+                elif action == "query_requests":
+                    # Фильтры/сортировка на сервере (индексы по JSONB), страницы по курсору
+                    page = await query_requests(
+                        data.get("filters") or {},
+                        data.get("sort") or "id",
+                        data.get("order") or "desc",
+                        data.get("limit") or 100,
+                        data.get("cursor"),
+                    )
+                    if page is None:
+                        await websocket.send(serialization.dumps({"action": "query_requests", "status": "error", "query_id": data.get("query_id")}))
+                    else:
+                        await websocket.send(_encode_for(session, {"action": "query_requests", "status": "success", "query_id": data.get("query_id"), **page}))
+
+                elif action == "vehicle_history":
+                    # В каких заявках была машина (по нормализованному номеру), страницы по before_id
+                    history = await vehicle_history(data.get("vehicle_number") or "", data.get("limit") or 50, data.get("before_id"))
+                    if history is None:
+                        await websocket.send(serialization.dumps({"action": "vehicle_history", "status": "error", "history_id": data.get("history_id")}))
+                    else:
+                        await websocket.send(serialization.dumps({"action": "vehicle_history", "status": "success", "history_id": data.get("history_id"), **history}))
+
+                elif action == "check_vehicle_conflicts":
+                    # Проверка формы до сохранения: data — черновик заявки (drivers, loading_dates), id — при правке
+                    draft = data.get("data")
+                    conflicts = await find_vehicle_conflicts(data.get("id"), draft if isinstance(draft, dict) else None)
+                    await websocket.send(serialization.dumps({
+                        "action": "check_vehicle_conflicts",
+                        "status": "error" if conflicts is None else "success",
+                        "check_id": data.get("check_id"),
+                        "conflicts": conflicts or [],
+                    }))
 
                 elif action == "statuses_sync":
                     try:
-                        rows = list_vehicle_statuses()
-                        await websocket.send(_json_dumps_safe({"action": "statuses_sync", "data": rows}))
+                        rows, version = await list_vehicle_statuses_snapshot()
+                        await websocket.send(_encode_for(session, {"action": "statuses_sync", "data": rows, "version": version}))
                     except Exception as e:
-                        await websocket.send(_json_dumps_safe({"action": "statuses_sync", "status": "error", "message": str(e)}))
+                        await websocket.send(serialization.dumps({"action": "statuses_sync", "status": "error", "message": str(e)}))
+
+                elif action == "statuses_since":
+                    # Переподключение: только изменения после версии клиента, иначе полный снапшот
+                    try:
+                        delta = await list_vehicle_statuses_since(data.get("version") or 0)
+                        if delta is not None:
+                            await websocket.send(_encode_for(session, {"action": "statuses_delta", **delta}))
+                        else:
+                            rows, version = await list_vehicle_statuses_snapshot()
+                            await websocket.send(_encode_for(session, {"action": "statuses_sync", "data": rows, "version": version}))
+                    except Exception as e:
+                        await websocket.send(serialization.dumps({"action": "statuses_sync", "status": "error", "message": str(e)}))
 
                 elif action == "statuses_set_text":
                     rid = int(data.get("request_id") or 0)
                     vehicle = (data.get("vehicle_number") or "").strip()
                     text = data.get("text") or ""
                     if not (rid and vehicle):
-                        await websocket.send(json.dumps({"action": "statuses_set_text", "status": "error", "message": "bad params"}))
+                        await websocket.send(serialization.dumps({"action": "statuses_set_text", "status": "error", "message": "bad params"}))
                     else:
-                        set_vehicle_status_text(rid, vehicle, text)
-                        rows = list_vehicle_statuses()
-                        await broadcast({"action": "statuses_sync", "data": rows})
+                        async with _statuses_lock:
+                            await set_vehicle_status_text(rid, vehicle, text)
+                            await _broadcast_statuses_delta()
                 elif action == "set_request_status":
                     rid = int(data.get("id") or 0)
                     status = data.get("status") or (data.get("data") or {}).get("status")
                     # Если все машины по заявке выгружены, принудительно считаем статус "closed"
                     try:
-                        if str(status).lower().strip() != 'closed' and all_unloaded_for_request(rid):
+                        if str(status).lower().strip() != 'closed' and await all_unloaded_for_request(rid):
                             status = 'closed'
                     except Exception as _e:
                         logging.error(f"[statuses] enforce closed on set_request_status failed: {_e}")
                     if not rid or not status:
-                        await websocket.send(json.dumps({
+                        await websocket.send(serialization.dumps({
                             "action": "request_updated",
                             "status": "error",
                             "message": "bad params"
                         }))
                     else:
                         try:
-                            req = get_request_from_db(rid) or {"id": rid}
+                            req = await get_request_from_db(rid) or {"id": rid}
                             # Пишем статус в JSON заявки (нормализация — в save_request_to_db)
                             d = dict(req)
                             d['status'] = status
-                            save_request_to_db(d)
-                            updated = get_request_from_db(rid)
+                            await save_request_to_db(d)
+                            updated = await get_request_from_db(rid)
                             if updated:
                                 await broadcast({"action": "request_updated", "data": updated})
                         except Exception as e:
-                            await websocket.send(json.dumps({"action": "request_updated", "status": "error", "message": str(e)}))
+                            await websocket.send(serialization.dumps({"action": "request_updated", "status": "error", "message": str(e)}))
 
                 elif action == "statuses_toggle_unloaded":
                     rid = int(data.get("request_id") or 0)
@@ -521,94 +687,122 @@ async def handle_client(websocket):
                     unload_date = data.get("unload_date") or None
                     if isinstance(unload_date, str) and len(unload_date) >= 10:
                         unload_date = unload_date[:10]
-                    toggle_vehicle_unloaded(rid, vehicle, unloaded, unload_date)
+                    async with _statuses_lock:
+                        await toggle_vehicle_unloaded(rid, vehicle, unloaded, unload_date)
+                        await _broadcast_statuses_delta()
 
-                    # если поставили галочку — проверяем, не закрылась ли заявка целиком
+                    # если поставили галочку — проверяем и закрываем заявку одним UPDATE ... RETURNING
                     try:
-                        if unloaded is True and all_unloaded_for_request(rid):
-                            set_request_status_closed(rid)
-                            updated = get_request_from_db(rid)
-                            if updated:
-                                await broadcast({"action": "request_updated", "data": updated})
+                        if unloaded is True:
+                            closed = await close_request_if_unloaded(rid)
+                            if closed:
+                                await broadcast({"action": "request_updated", "data": closed})
                     except Exception as e:
                         logging.error(f"[statuses] auto-close failed: {e}")
 
-                    rows = list_vehicle_statuses()
-                    await broadcast({"action": "statuses_sync", "data": rows})
-
                 elif action == "logout":
                     await websocket.close(code=1000, reason="Logout")
                     continue
 
             except Exception as e:
                 logging.error("📛 შეცდომა შეტყობინების დამუშავებისას: %s", e)
-                await websocket.send(json.dumps({"error": "💥 სერვერის შიდა შეცდომა"}))
+                await websocket.send(serialization.dumps({"error": "💥 სერვერის შიდა შეცდომა"}))
     except websockets.exceptions.ConnectionClosed:
         logging.info("🔌 კლიენტი გათიშულია — IP: %s, Port: %s", ip, port)
     finally:
-        connected_clients.discard(websocket)
+        hub.unregister(websocket)
+        for task in list(downloads):
+            task.cancel()
+
+
+def _write_attachment(file_path: str, content: bytes):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "wb") as f:
+        f.write(content)
 
 def _extract_vehicles_and_load_date(req: dict):
     """Возвращает (список номеров ТС, дата_загрузки_DD-MM-YYYY|None) из заявки."""
-    vehicles = []
-    for d in (req.get('drivers') or []):
-        for key in ('stateNumber', 'vehicleNumber', 'plate', 'carNumber', 'number', 'tsNumber'):
-            v = d.get(key)
-            if v:
-                vehicles.append(str(v).strip())
-                break
-    # Уникальные и непустые
-    vehicles = sorted({v for v in vehicles if v})
-
+    # Уникальные и непустые, нормализованные так же, как в request_drivers
+    vehicles = sorted({v for v in map(driver_vehicle, req.get('drivers') or []) if v})
     # Дата загрузки: берём первую из loading_dates (или None)
-    load_date = None
-    for ld in (req.get('loading_dates') or []):
-        date = (ld.get('date') or ld.get('loading_date') or ld.get('day') or '').strip()
-        if date:
-            load_date = date[:10]  # DD-MM-YYYY
-            break
-    return vehicles, load_date
-
-async def _run_midnight_clear_and_broadcast():
-    """Ждём до ближайшей полуночи, чистим статус дня и рассылаем обновление."""
-    while True:
-        now = dt.datetime.now()
-        tomorrow = now + dt.timedelta(days=1)
-        midnight = dt.datetime.combine(tomorrow.date(), dt.time(0, 0, 0))
-        await asyncio.sleep((midnight - now).total_seconds())
-        try:
-            clear_daily_status_texts()
-            rows = list_vehicle_statuses()
-            await broadcast({"action": "statuses_sync", "data": rows})
-        except Exception as e:
-            logging.error(f"[statuses] midnight clear failed: {e}")
-
-
-async def _run_periodic_cleanup_48h():
-    """Раз в 30 минут удаляем строки, где выгрузка старше 48ч."""
-    while True:
-        try:
-            cleanup_unloaded_rows_older_than_48h()
-        except Exception as e:
-            logging.error(f"[statuses] 48h cleanup failed: {e}")
-        await asyncio.sleep(1800)  # 30 минут
+    return vehicles, first_loading_date(req)
+
+async def _job_clear_daily_status_texts():
+    """После полуночи чистим статус дня и рассылаем обновление."""
+    async with _statuses_lock:
+        await clear_daily_status_texts()
+        await _broadcast_statuses_delta()
+
+
+async def _job_cleanup_statuses():
+    """Закрываем полностью выгруженные заявки, затем удаляем строки, где выгрузка старше 48ч."""
+    # сначала закрыть — после чистки их строк уже не будет
+    for closed in await close_all_unloaded_requests():
+        await broadcast({"action": "request_updated", "data": closed})
+    async with _statuses_lock:
+        await cleanup_unloaded_rows_older_than_48h()
+        await _broadcast_statuses_delta()
+
+
+async def _job_prune_journals():
+    await prune_vehicle_status_deletions()
+    await prune_request_changelog()
+
+
+scheduler.add("clear_daily_status_texts", "0 0 * * *", _job_clear_daily_status_texts, jitter=30, run_at_start=True)
+scheduler.add("cleanup_statuses", "*/30 * * * *", _job_cleanup_statuses, jitter=60, run_at_start=True)
+scheduler.add("prune_journals", "15 * * * *", _job_prune_journals, jitter=60)
 
 
 async def main():
-    logging.info("სერვერის გაშვება...")
-    async with websockets.serve(handle_client, "0.0.0.0", 8766):
-        # фоновые задачи для статусов
-        asyncio.create_task(_run_midnight_clear_and_broadcast())
-        asyncio.create_task(_run_periodic_cleanup_48h())
-        # initial daily clear and statuses snapshot
-        try:
-            clear_daily_status_texts()
-            rows = list_vehicle_statuses()
-            await broadcast({"action": "statuses_sync", "data": rows})
-        except Exception as e:
-            logging.error(f"[statuses] initial clear/sync failed: {e}")
+    logging.info(f"სერვერის გაშვება... (pid {os.getpid()}, bus {WS_BUS})")
+    # кэш заявок в каждом процессе — при общей шине инвалидации тоже должны ходить между процессами
+    start_request_cache_listener(force_notify=WS_BUS == "postgres")
+    await bus.start()
+    serve_kwargs = {"subprotocols": ws_codec.SUBPROTOCOLS, "reuse_port": WS_WORKERS > 1}
+    extensions = ws_codec.deflate_extensions()
+    if extensions is not None:
+        serve_kwargs.update(compression=None, extensions=extensions)
+    async with websockets.serve(handle_client, WS_HOST, WS_PORT, **serve_kwargs):
+        # фоновые задачи (в том числе дневная очистка статусов при старте)
+        scheduler.start()
         await asyncio.Future()
 
 
-if __name__ == "__main__":
+def _worker_entry():
     asyncio.run(main())
+
+
+def run_workers(count: int):
+    """
+    count процессов слушают один порт (SO_REUSEPORT, ядро раскладывает соединения).
+    Без SO_REUSEPORT (Windows) WS_WORKERS уже сведён к 1 и сюда не попадаем.
+    Упавший воркер перезапускаем; Ctrl+C останавливает всех.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    procs = {}
+    try:
+        while True:
+            for i in range(count):
+                proc = procs.get(i)
+                if proc is None or not proc.is_alive():
+                    if proc is not None:
+                        logging.error(f"[ws] worker {i} exited with code {proc.exitcode}, restarting")
+                    proc = ctx.Process(target=_worker_entry, name=f"ws-worker-{i}", daemon=False)
+                    proc.start()
+                    procs[i] = proc
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for proc in procs.values():
+            proc.terminate()
+        for proc in procs.values():
+            proc.join(5)
+
+
+if __name__ == "__main__":
+    if WS_WORKERS > 1:
+        run_workers(WS_WORKERS)
+    else:
+        asyncio.run(main())
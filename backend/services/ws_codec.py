@@ -0,0 +1,67 @@
+# backend/services/ws_codec.py — КОДИРОВАНИЕ КАДРОВ WEBSOCKET
+"""
+Две кодировки исходящих сообщений, выбираются на рукопожатии (Sec-WebSocket-Protocol):
+
+  jm.json     — JSON-текст (по умолчанию; клиент без подпротокола получает его же)
+  jm.msgpack  — MessagePack в бинарных кадрах (опционально: pip install msgpack)
+
+Входящие сообщения клиента — всегда JSON-текст; бинарные входящие — кадры файлов (JMF1).
+Бинарный кадр MessagePack с объектом начинается с 0x80..0x8f / 0xde / 0xdf,
+кадр файла — с "JMF1" (0x4a), поэтому фронт их не путает.
+
+permessage-deflate настраивается под наши кадры: снимки sync_all/statuses_sync —
+сотни КБ однотипного JSON, поэтому окно сервера больше, чем по умолчанию в websockets.
+"""
+import logging
+
+try:
+    import msgpack  # опционально
+except ImportError:
+    msgpack = None
+
+from backend.core.database import APP_CONFIG
+from backend.core import serialization
+
+WS_CONFIG = APP_CONFIG.get("ws") or {}
+
+JSON = "jm.json"
+MSGPACK = "jm.msgpack"
+SUBPROTOCOLS = [MSGPACK, JSON] if msgpack is not None else [JSON]
+
+
+def packb(message) -> bytes:
+    return msgpack.packb(message, default=serialization.default, use_bin_type=True)
+
+
+def json_to_msgpack(data) -> bytes:
+    """Готовый JSON-текст рассылки → MessagePack (один раз на событие, не на клиента)."""
+    return packb(serialization.loads(data))
+
+
+def encoding_of(websocket) -> str:
+    return MSGPACK if getattr(websocket, "subprotocol", None) == MSGPACK and msgpack is not None else JSON
+
+
+def deflate_extensions():
+    """
+    Фабрика permessage-deflate для websockets.serve(extensions=...).
+    None — оставить настройки websockets по умолчанию (старая версия библиотеки).
+    """
+    try:
+        from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+    except ImportError:
+        return None
+    if not WS_CONFIG.get("deflate", True):
+        return []
+    try:
+        return [ServerPerMessageDeflateFactory(
+            server_max_window_bits=int(WS_CONFIG.get("deflate_window_bits", 15)),
+            client_max_window_bits=int(WS_CONFIG.get("deflate_client_window_bits", 12)),
+            compress_settings={
+                "level": int(WS_CONFIG.get("deflate_level", 6)),
+                "memLevel": int(WS_CONFIG.get("deflate_mem_level", 8)),
+            },
+        )]
+    except Exception as e:
+        logging.error(f"[ws_codec] permessage-deflate settings rejected: {e}")
+        return None
@@ -0,0 +1,193 @@
+# backend/services/ws_hub.py — СЕССИИ КЛИЕНТОВ И РАССЫЛКА ПО ТОПИКАМ
+"""
+Каждое соединение — ClientSession с ограниченной очередью исходящих и своим
+писателем (отдельная задача). Рассылка только кладёт уже сериализованную строку
+в очереди подписанных сессий и не ждёт ни одного сокета.
+
+Топики:
+  requests        — new_request / request_updated / trigger_sync / add_comment
+  statuses        — statuses_sync / statuses_delta
+  request:<id>    — события одной заявки
+Клиент, не приславший subscribe, получает всё (совместимость со старым фронтом).
+
+Медленный клиент: очередь переполнилась — накопленное выбрасываем и ставим один
+{"action": "resync"} (клиент догоняет через sync_since / statuses_since).
+Переполнилась снова, пока resync не ушёл, — закрываем соединение.
+
+Клиенты с подпротоколом jm.msgpack получают те же события в MessagePack:
+перекодируем один раз на событие и только если такие клиенты есть (ws_codec).
+"""
+import asyncio
+import inspect
+import json
+import logging
+
+from backend.core.database import APP_CONFIG
+from backend.services import ws_codec
+
+WS_CONFIG = APP_CONFIG.get("ws") or {}
+SEND_QUEUE_SIZE = int(WS_CONFIG.get("send_queue", 256))
+SEND_TIMEOUT = float(WS_CONFIG.get("send_timeout", 10))
+
+DEFAULT_TOPICS = ("requests", "statuses")
+_TOPIC_BY_ACTION = {
+    "statuses_sync": "statuses",
+    "statuses_delta": "statuses",
+}
+
+
+def _accepts_text_flag(send) -> bool:
+    """websockets >= 14: send(bytes, text=True) шлёт готовые байты UTF-8 текстовым кадром."""
+    try:
+        return "text" in inspect.signature(send).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def topics_for(message: dict) -> set:
+    """Топики события по его action и id заявки."""
+    topics = {_TOPIC_BY_ACTION.get(message.get("action"), "requests")}
+    data = message.get("data")
+    rid = message.get("task_id") or (data.get("id") if isinstance(data, dict) else None)
+    if rid is not None and topics == {"requests"}:
+        topics.add(f"request:{rid}")
+    return topics
+
+
+class ClientSession:
+    def __init__(self, websocket, maxsize: int = SEND_QUEUE_SIZE):
+        self.websocket = websocket
+        self.encoding = ws_codec.encoding_of(websocket)
+        self._text_bytes = _accepts_text_flag(websocket.send)
+        self.topics = None                # None — все топики (клиент не подписывался)
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.resync_pending = False
+        self.closing = False
+        self.sent = 0
+        self.dropped = 0
+        self.overflows = 0
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def wants(self, topics: set) -> bool:
+        return self.topics is None or not self.topics.isdisjoint(topics)
+
+    def subscribe(self, topics, replace: bool = False):
+        topics = {str(t) for t in (topics or []) if t}
+        if replace or self.topics is None:
+            self.topics = topics
+        else:
+            self.topics |= topics
+
+    def unsubscribe(self, topics):
+        if self.topics is None:
+            self.topics = set(DEFAULT_TOPICS)
+        self.topics -= {str(t) for t in (topics or [])}
+
+    def offer(self, data) -> bool:
+        """Положить сообщение в очередь без ожидания. False — клиент не успевает."""
+        try:
+            self.queue.put_nowait((data, False))
+            return True
+        except asyncio.QueueFull:
+            pass
+        self.overflows += 1
+        if self.resync_pending:
+            # даже resync не ушёл — клиент безнадёжно отстал
+            if not self.closing:
+                self.closing = True
+                logging.warning(f"[ws] slow consumer closed: {self.websocket.remote_address}")
+                asyncio.create_task(self._close(1013, "Slow consumer"))
+            return False
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.resync_pending = True
+        resync = {"action": "resync", "topics": sorted(self.topics or DEFAULT_TOPICS)}
+        resync = ws_codec.packb(resync) if self.encoding == ws_codec.MSGPACK else json.dumps(resync)
+        self.queue.put_nowait((resync, True))
+        return False
+
+    async def _write_loop(self):
+        try:
+            while True:
+                data, is_resync = await self.queue.get()
+                await asyncio.wait_for(self._send(data), SEND_TIMEOUT)
+                self.sent += 1
+                if is_resync:
+                    self.resync_pending = False
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            await self._close(1013, "Send timeout")
+        except Exception:
+            # соединение закрыто — handle_client сам снимет сессию
+            pass
+
+    def _send(self, data):
+        # JSON-клиенту — текстовый кадр, даже если рассылка закодирована в байты
+        if self.encoding != ws_codec.MSGPACK and isinstance(data, bytes):
+            if self._text_bytes:
+                return self.websocket.send(data, text=True)
+            data = data.decode("utf-8")
+        return self.websocket.send(data)
+
+    async def _close(self, code: int, reason: str):
+        self.closing = True
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    def close(self):
+        self._writer.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "overflows": self.overflows,
+            "topics": sorted(self.topics) if self.topics is not None else ["*"],
+            "encoding": self.encoding,
+        }
+
+
+class Hub:
+    def __init__(self):
+        self.sessions = {}   # websocket -> ClientSession
+
+    def register(self, websocket) -> ClientSession:
+        session = ClientSession(websocket)
+        self.sessions[websocket] = session
+        return session
+
+    def unregister(self, websocket):
+        session = self.sessions.pop(websocket, None)
+        if session is not None:
+            session.close()
+
+    def publish(self, data, topics: set, exclude_ws=None) -> int:
+        """Разослать готовый JSON (str или bytes) подписанным сессиям. Возвращает число адресатов."""
+        delivered = 0
+        packed = None
+        for ws, session in list(self.sessions.items()):
+            if ws is exclude_ws or not session.wants(topics):
+                continue
+            if session.encoding == ws_codec.MSGPACK:
+                if packed is None:
+                    packed = ws_codec.json_to_msgpack(data)
+                session.offer(packed)
+            else:
+                session.offer(data)
+            delivered += 1
+        return delivered
+
+    def stats(self) -> dict:
+        sessions = list(self.sessions.values())
+        return {
+            "clients": len(sessions),
+            "msgpack": sum(1 for s in sessions if s.encoding == ws_codec.MSGPACK),
+            "queued": sum(s.queue.qsize() for s in sessions),
+            "dropped": sum(s.dropped for s in sessions),
+            "overflows": sum(s.overflows for s in sessions),
+        }
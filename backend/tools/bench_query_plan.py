@@ -0,0 +1,96 @@
+# backend/tools/bench_query_plan.py — ПЛАНЫ ЗАПРОСОВ query_requests НА БОЛЬШОМ ОБЪЁМЕ
+"""
+Проверка, что фильтры query_requests идут по индексам, а не полным перебором.
+
+    python -m backend.tools.bench_query_plan [--rows 100000] [--keep]
+
+- создаёт схему jm_bench с копией requests (LIKE ... INCLUDING ALL — вместе с индексами
+  по выражениям), заполняет её синтетическими заявками и делает ANALYZE;
+- для каждого сценария строит SQL тем же build_requests_query, что и сервер,
+  и печатает EXPLAIN (ANALYZE, BUFFERS) с отметкой, какие индексы использованы;
+- всё делается в одной транзакции и откатывается (--keep — закоммитить схему
+  для ручных экспериментов); id заявок задаются явно, последовательность public не тратится.
+
+Нужен уже инициализированный init_db() (функции jm_* и индексы в public).
+"""
+from __future__ import annotations
+
+import argparse
+import re
+
+from backend.core.database import get_conn, build_requests_query
+
+SCHEMA = "jm_bench"
+# копии индексов получают имена вида requests_expr_idx — берём имя из строки плана
+_INDEX_RE = re.compile(r"(?:Index(?: Only)? Scan(?: Backward)? using|Bitmap Index Scan on) (\w+)")
+
+_FILL_SQL = """
+    INSERT INTO requests (id, data)
+    SELECT g, jsonb_build_object(
+        'status', CASE WHEN g %% 10 < 7 THEN 'closed'
+                       ELSE (ARRAY['active', 'priority', 'current'])[1 + g %% 3] END,
+        'from', (ARRAY['Tbilisi, Georgia', 'Batumi, Georgia', 'Поти, Грузия', 'Istanbul, Turkey',
+                       'Mersin, Turkey', 'Ереван, Армения', 'Баку, Азербайджан', 'Kutaisi, Georgia'])[1 + g %% 8],
+        'to', (ARRAY['Almaty, Kazakhstan', 'Ташкент', 'Baku', 'Yerevan', 'Constanta, Romania',
+                     'Тбилиси', 'Trabzon, Turkey'])[1 + (g / 8) %% 7],
+        'last_editor', 'dispatcher' || (g %% 40),
+        'loading_dates', jsonb_build_array(
+            jsonb_build_object('date', to_char(DATE '2022-01-01' + (g %% 1200), 'DD-MM-YYYY'), 'truck_count', 1),
+            jsonb_build_object('date', to_char(DATE '2022-01-02' + (g %% 1200), 'YYYY-MM-DD'), 'truck_count', 1)),
+        'drivers', jsonb_build_array(
+            jsonb_build_object('stateNumber', 'AA-' || lpad((g %% 50000)::text, 5, '0') || '-BB', 'name', 'driver ' || g))
+    )
+    FROM generate_series(1, %s) g
+"""
+
+SCENARIOS = [
+    ("status=active, newest first", {"status": "active"}, "id", "desc"),
+    ("loading dates in one week", {"date_from": "2023-03-01", "date_to": "2023-03-07"}, "loading_date", "asc"),
+    ("vehicle", {"vehicle": "aa-01234-bb"}, "id", "desc"),
+    ("last_editor", {"last_editor": "dispatcher7"}, "id", "desc"),
+    ("from contains 'batumi'", {"from": "batumi"}, "id", "desc"),
+    ("status + dates, sorted by loading date", {"status": ["active", "priority"], "date_from": "2023-01-01",
+                                                 "date_to": "2023-01-31"}, "loading_date", "asc"),
+]
+
+
+def _fill(cur, rows: int):
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"CREATE TABLE {SCHEMA}.requests (LIKE public.requests INCLUDING ALL)")
+    cur.execute(f"ALTER TABLE {SCHEMA}.requests ALTER COLUMN id DROP DEFAULT")
+    cur.execute(f"SET LOCAL search_path TO {SCHEMA}, public")
+    cur.execute(_FILL_SQL, (rows,))
+    cur.execute("ANALYZE requests")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN для query_requests на синтетических заявках")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--keep", action="store_true", help="закоммитить схему jm_bench, а не откатывать")
+    args = parser.parse_args()
+
+    with get_conn() as conn:
+        try:
+            with conn.cursor() as cur:
+                print(f"filling {SCHEMA}.requests with {args.rows} rows...")
+                _fill(cur, args.rows)
+                for title, filters, sort, order in SCENARIOS:
+                    sql, params = build_requests_query(filters, sort, order, args.limit)
+                    cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+                    plan = [r[0] for r in cur.fetchall()]
+                    indexes = sorted(set(_INDEX_RE.findall("\n".join(plan))))
+                    seq = any("Seq Scan on requests" in line for line in plan)
+                    total = next((line for line in reversed(plan) if "Execution Time" in line), "").strip()
+                    print(f"\n=== {title} ({sort} {order}) — {total}")
+                    print(f"    indexes: {', '.join(indexes) or '-'}{'   [SEQ SCAN on requests]' if seq else ''}")
+                    for line in plan:
+                        print("    " + line)
+        finally:
+            if not args.keep:
+                conn.rollback()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# backend/tools/bench_serialization.py — СРАВНЕНИЕ ПУТЕЙ СЕРИАЛИЗАЦИИ
+"""
+Микро-бенчмарк на заявках, похожих на настоящие (грузинский/русский текст,
+даты, Decimal, водители, даты загрузки).
+
+    python -m backend.tools.bench_serialization [--requests 2000] [--clients 50] [--repeat 5]
+
+Пути:
+  stdlib        — json.dumps(default=хук, ensure_ascii=False), как было раньше
+  serialization — backend.core.serialization.dumps (orjson, если установлен)
+  broadcast     — рассылка на --clients клиентов: раньше str → UTF-8 на каждый send,
+                  теперь dumps_bytes один раз
+"""
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import json
+import random
+import time
+from decimal import Decimal
+
+from backend.core import serialization
+
+CITIES = ["თბილისი", "ბათუმი", "Тбилиси", "Поти", "Kutaisi", "Ереван", "Баку", "Istanbul", "Mersin"]
+CARGO = ["ტვირთი: ხილი", "Сборный груз, паллеты", "Construction materials", "Цемент 20т"]
+
+
+def sample_request(i: int, rnd: random.Random) -> dict:
+    day = dt.date(2024, 1, 1) + dt.timedelta(days=rnd.randint(0, 365))
+    return {
+        "id": i,
+        "status": rnd.choice(["active", "priority", "current", "closed"]),
+        "from": f"{rnd.choice(CITIES)}, {rnd.choice(CITIES)}",
+        "to": rnd.choice(CITIES),
+        "cargo": rnd.choice(CARGO),
+        "price": Decimal(rnd.randint(500, 9000)) + Decimal("0.50"),
+        "weight": Decimal(str(round(rnd.uniform(1, 24), 2))),
+        "created_at": dt.datetime(2024, 1, 1, 9, 30) + dt.timedelta(minutes=i),
+        "loading_dates": [{"date": day.strftime("%d-%m-%Y"), "time": "10:00"}],
+        "drivers": [
+            {"name": "გიორგი ბერიძე", "phone": "+995 555 12 34 56",
+             "car_number": f"AA-{rnd.randint(100, 999)}-BB", "trailer_number": f"TR{rnd.randint(1000, 9999)}"}
+            for _ in range(rnd.randint(1, 3))
+        ],
+        "note": "Позвонить за час до загрузки. " * rnd.randint(0, 4),
+        "revision": i * 3,
+    }
+
+
+def _stdlib(obj) -> str:
+    return json.dumps(obj, default=serialization.default, ensure_ascii=False)
+
+
+def bench(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк сериализации ответов сервера")
+    parser.add_argument("--requests", type=int, default=2000, help="заявок в снимке sync_all")
+    parser.add_argument("--clients", type=int, default=50, help="клиентов для рассылки")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    snapshot = {"action": "sync_all", "data": [sample_request(i, rnd) for i in range(args.requests)], "revision": 1}
+    event = {"action": "request_updated", "data": snapshot["data"][0]}
+
+    size = len(serialization.dumps_bytes(snapshot))
+    print(f"backend: {serialization.BACKEND}; snapshot {args.requests} requests, {size / 1024:.0f} KiB")
+
+    rows = [
+        ("sync_all stdlib", bench(lambda: _stdlib(snapshot), args.repeat)),
+        ("sync_all serialization.dumps", bench(lambda: serialization.dumps(snapshot), args.repeat)),
+        ("sync_all serialization.dumps_bytes", bench(lambda: serialization.dumps_bytes(snapshot), args.repeat)),
+    ]
+
+    def old_broadcast():
+        data = _stdlib(event)
+        for _ in range(args.clients):
+            data.encode("utf-8")  # websockets кодирует str на каждый send
+
+    def new_broadcast():
+        serialization.dumps_bytes(event)
+
+    n = 1000
+    rows.append((f"broadcast x{args.clients} old (per 1000 events)",
+                 bench(lambda: [old_broadcast() for _ in range(n)], args.repeat)))
+    rows.append((f"broadcast x{args.clients} once (per 1000 events)",
+                 bench(lambda: [new_broadcast() for _ in range(n)], args.repeat)))
+
+    width = max(len(name) for name, _ in rows)
+    for name, sec in rows:
+        print(f"{name:<{width}}  {sec * 1000:9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
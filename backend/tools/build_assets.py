@@ -0,0 +1,122 @@
+# backend/tools/build_assets.py — СБОРКА СТАТИКИ ФРОНТА
+"""
+Версионированная и предсжатая копия фронта для раздачи с долгим кэшем.
+
+    python -m backend.tools.build_assets [--keep 3]
+
+- версия = хэш содержимого всех файлов фронта;
+- файлы копируются в frontend/dist/<версия>/ (модули импортируют друг друга
+  относительными путями — поэтому хэшируется каталог, а не каждый файл отдельно);
+- абсолютные ссылки '/frontend/...' в js/css/html переписываются на '/frontend/dist/<версия>/...';
+- текстовые файлы сжимаются в .gz (и .br, если установлен пакет brotli);
+- frontend/dist/index.html — точка входа с <base href="/frontend/dist/<версия>/">,
+  отдаётся с no-cache, всё внутри <версия>/ — immutable.
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import hashlib
+import json
+import re
+import shutil
+from pathlib import Path
+
+try:
+    import brotli  # опционально: pip install brotli
+except ImportError:
+    brotli = None
+
+FRONTEND_DIR = Path(__file__).resolve().parent.parent.parent / "frontend"
+DIST_DIR = FRONTEND_DIR / "dist"
+URL_PREFIX = "/frontend/"
+
+SKIP = {"dist", "node_modules", "package-lock.json", "package.json"}
+REWRITE_EXT = {".js", ".css", ".html"}
+COMPRESS_EXT = {".js", ".css", ".html", ".json", ".svg", ".ico", ".txt", ".map"}
+MIN_COMPRESS_SIZE = 256
+
+_ABS_URL = re.compile(r"""(["'`(])/frontend/(?!dist/)""")
+
+
+def iter_sources():
+    for path in sorted(FRONTEND_DIR.rglob("*")):
+        rel = path.relative_to(FRONTEND_DIR)
+        if path.is_file() and rel.parts[0] not in SKIP:
+            yield path, rel
+
+
+def content_version() -> str:
+    h = hashlib.sha256()
+    for path, rel in iter_sources():
+        h.update(rel.as_posix().encode("utf-8") + b"\0")
+        h.update(path.read_bytes())
+    return h.hexdigest()[:12]
+
+
+def precompress(path: Path, data: bytes) -> dict:
+    out = {}
+    if path.suffix not in COMPRESS_EXT or len(data) < MIN_COMPRESS_SIZE:
+        return out
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) < len(data):
+        path.with_name(path.name + ".gz").write_bytes(gz)
+        out["gz"] = len(gz)
+    if brotli is not None:
+        br = brotli.compress(data, quality=11)
+        if len(br) < len(data):
+            path.with_name(path.name + ".br").write_bytes(br)
+            out["br"] = len(br)
+    return out
+
+
+def inject_base(html: str, base: str) -> str:
+    # <base> меняет смысл ссылок вида href="#..." — таких в index.html быть не должно
+    if re.search(r"""href=["']#""", html):
+        raise SystemExit("index.html содержит href=\"#...\" — <base href> сломает якоря")
+    tag = f'<base href="{base}">'
+    if re.search(r"<base\s", html, re.I):
+        return re.sub(r"<base\s[^>]*>", tag, html, count=1, flags=re.I)
+    return re.sub(r"(<head[^>]*>)", r"\1\n  " + tag, html, count=1, flags=re.I)
+
+
+def build(keep: int = 3) -> dict:
+    version = content_version()
+    target = DIST_DIR / version
+    base = f"{URL_PREFIX}dist/{version}/"
+    files = {}
+
+    if target.exists():
+        shutil.rmtree(target)
+    for path, rel in iter_sources():
+        dst = target / rel
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        data = path.read_bytes()
+        if path.suffix in REWRITE_EXT:
+            data = _ABS_URL.sub(lambda m: m.group(1) + base, data.decode("utf-8")).encode("utf-8")
+        dst.write_bytes(data)
+        files[rel.as_posix()] = {"size": len(data), **precompress(dst, data)}
+
+    index = inject_base((target / "index.html").read_text(encoding="utf-8"), base).encode("utf-8")
+    (DIST_DIR / "index.html").write_bytes(index)
+    precompress(DIST_DIR / "index.html", index)
+
+    manifest = {"version": version, "base": base, "brotli": brotli is not None, "files": files}
+    (DIST_DIR / "manifest.json").write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    # старые версии держим: у открытых вкладок ещё может быть прежний index.html
+    versions = sorted((p for p in DIST_DIR.iterdir() if p.is_dir()), key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in versions[keep:]:
+        shutil.rmtree(old, ignore_errors=True)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сборка версионированной статики фронта")
+    parser.add_argument("--keep", type=int, default=3, help="сколько версий хранить в dist/")
+    args = parser.parse_args()
+    m = build(args.keep)
+    raw = sum(f["size"] for f in m["files"].values())
+    gz = sum(f.get("gz", f["size"]) for f in m["files"].values())
+    print(f"version {m['version']}: {len(m['files'])} files, {raw} bytes, gzip {gz} bytes"
+          + ("" if m["brotli"] else " (brotli не установлен — только gzip)"))
@@ -95,48 +95,20 @@ function renderDriverFile(file, requestId, driver) {
 
 
 
-// === 1. Загрузка файла на сервер через WebSocket, возвращает {name, url} или {name}
+// === 1. Загрузка файла на сервер через WebSocket (бинарные чанки), возвращает {name, url} или {name}
 async function uploadDriverFileWS(file, requestId) {
-  // ... (чтение base64)
-  const base64 = await new Promise((resolve, reject) => {
-    const reader = new FileReader();
-    reader.onload = e => resolve(e.target.result.split(',')[1]);
-    reader.onerror = reject;
-    reader.readAsDataURL(file);
-  });
-
-  // Отправляем файл по WS (action: 'upload_file')
-  const resp = await WebSocketService.sendAndWait({
-    action: 'upload_file',
-    request_id: requestId,
-    file_type: 'driver_file',
-    filename: file.name,
-    content_base64: base64
-  });
-  // Смотри что возвращает сервер:
-  console.log('Ответ сервера на upload_file:', resp);
-
-  if (resp.status !== 'ok') {
-    console.error('Ошибка загрузки файла:', resp);
-    throw new Error(resp.error || JSON.stringify(resp));
+  try {
+    return await WebSocketService.uploadFile(file, requestId);
+  } catch (e) {
+    console.error('Ошибка загрузки файла:', e);
+    throw e;
   }
-  return resp.file || {name: file.name};
 }
 
 // === В самом начале или после импортов ===
 export async function downloadDriverFile(task_id, filename) {
   try {
-    const resp = await WebSocketService.sendAndWait({
-      action: "download_file",
-      task_id: task_id,
-      filename: filename
-    });
-    if (!resp.filedata) { alert("Файл не найден или ошибка на сервере!"); return; }
-    // base64 → Blob → download
-    const bstr = atob(resp.filedata);
-    const u8arr = new Uint8Array(bstr.length);
-    for (let i = 0; i < bstr.length; ++i) u8arr[i] = bstr.charCodeAt(i);
-    const blob = new Blob([u8arr]);
+    const blob = await WebSocketService.downloadFile(task_id, filename);
     const url = URL.createObjectURL(blob);
     const a = document.createElement('a');
     a.href = url;
@@ -145,7 +117,10 @@ export async function downloadDriverFile(task_id, filename) {
     a.click();
     a.remove();
     URL.revokeObjectURL(url);
-  } catch (e) { alert("Ошибка скачивания файла: " + e.message); }
+  } catch (e) {
+    if (/not found/i.test(e.message)) alert("Файл не найден или ошибка на сервере!");
+    else alert("Ошибка скачивания файла: " + e.message);
+  }
 }
 
 
@@ -259,6 +234,10 @@ export function handleDriverMenuAction(requestId) {
       return;
     }
 
+    // Не занята ли машина в другой заявке на эту дату — до любых изменений заявки
+    const draft = { ...request, drivers: [...(request.drivers || []), { carNumber, date: selectedDate }] };
+    if (!(await WebSocketService.confirmVehicleConflicts(draft, request.id))) return;
+
     // --- ДОБАВЛЯЕМ ВОДИТЕЛЯ ---
     // 1. Добавляем в request.drivers (создаём если нет)
     if (!Array.isArray(request.drivers)) request.drivers = [];
@@ -580,6 +559,13 @@ export function openEditDriverModal(requestId, driverIdx) {
       return;
     }
 
+    // Не занята ли машина в другой заявке на эту дату — до любых изменений заявки
+    const draft = {
+      ...request,
+      drivers: (request.drivers || []).map(d => d === driver ? { ...d, carNumber, date: selectedDate } : d)
+    };
+    if (!(await WebSocketService.confirmVehicleConflicts(draft, request.id))) return;
+
     // --- Сохраняем старую дату до изменения ---
     const oldDate = driver.date;
 
@@ -284,10 +284,14 @@ export function openEditRequestModal(existing) {
       }
     }
 
+    // Новые даты погрузки могут пересечься с занятостью машин этой заявки в других заявках
+    if (!(await WebSocketService.confirmVehicleConflicts({ ...existing, ...data }, existing.id))) return;
+
     // Одноразовая подписка на server push именно по этой заявке
     let gotServerUpdate = false;
     const offOnce = addOnceWsCallback('request_updated', (msg) => {
       try {
+        if (msg?.status === 'conflict') return; // конфликт разбираем ниже, модалку не закрываем
         const updated = msg?.data || msg; // на всякий случай
         const updatedId = Number(updated?.id ?? updated?.request_id);
         if (updatedId === Number(existing.id)) {
@@ -299,13 +303,21 @@ export function openEditRequestModal(existing) {
     });
 
     try {
-      await WebSocketService.sendAndWait({
+      const res = await WebSocketService.sendAndWait({
         action: "edit_request",
         id: existing.id,
         editor: localStorage.getItem('jm_session_username') || 'user',
+        // оптимистичная блокировка: сервер откажет, если заявку успели изменить
+        expected_revision: existing.revision ?? null,
         data
       });
 
+      if (res?.status === 'conflict' && Number(res?.id) === Number(existing.id)) {
+        if (res.data) Object.assign(existing, res.data);
+        alert('Заявку уже изменил другой пользователь. Данные обновлены — проверьте и сохраните ещё раз.');
+        return;
+      }
+
       // Если серверский push ещё не пришёл — эмулируем через общий эмиттер
       if (!gotServerUpdate) {
         WebSocketService.emit('request_updated', {
@@ -858,6 +858,9 @@ function renderRequestSections(req) {
       <div class="request-section-cell">
         <b>💬 Комментарии:</b>
         <div class="comments-scroll" id="comments-${req.id}">
+          ${Number(req.comments_total || 0) > (req.comments || []).length
+            ? `<button type="button" class="btn btn-link btn-sm p-0 mb-1" onclick="loadEarlierComments('${req.id}')">Показать ранние (${Number(req.comments_total) - req.comments.length})</button>`
+            : ''}
           ${Array.isArray(req.comments) && req.comments.length > 0
             ? req.comments.filter(c => c && typeof c === 'object').map(c => `<div><b>${c.user || '-'}</b>: ${c.text || ''}</div>`).join('')
             : '<i>Нет комментариев</i>'}
@@ -982,6 +985,28 @@ window.addComment = async function(event, id) {
 };
 
 
+// --- Подгрузка ранних комментариев (с заявкой приходят только последние) ---
+window.loadEarlierComments = async function(id) {
+  const req = announcements.find(r => String(r.id) === String(id));
+  if (!req) return;
+  const oldest = (req.comments || []).find(c => c && c.comment_id);
+  try {
+    const page = await WebSocketService.sendAndWait({
+      action: 'get_comments',
+      task_id: id,
+      before_id: oldest ? oldest.comment_id : null,
+      limit: 50
+    });
+    const older = Array.isArray(page?.comments) ? page.comments : [];
+    req.comments = [...older, ...(req.comments || [])];
+    if (page?.total !== undefined) req.comments_total = page.total;
+    renderRequestList();
+  } catch (err) {
+    showToast('Ошибка загрузки комментариев: ' + err.message, 'danger');
+  }
+};
+
+
 // --- Уведомления Toast ---
 function showToast(message, type = 'info') {
   const toast = document.createElement('div');
@@ -1012,8 +1037,22 @@ if (window.requestNotificationPermission) window.requestNotificationPermission()
 // --- LIVE PUSH (WebSocket) ---
 setupNotifPriming();  // звук станет доступен на первом клике/тапе/клавише где угодно
 
+// Сервер прислал в ACK машины, уже занятые в других заявках на те же даты
+function warnVehicleConflicts(msg) {
+  const conflicts = msg?.conflicts || [];
+  if (!conflicts.length) return;
+  const lines = conflicts.slice(0, 5).map(c =>
+    `${c.vehicle_number} — #${c.request_id} (${c.date_from}${c.date_to && c.date_to !== c.date_from ? ' … ' + c.date_to : ''})`);
+  if (conflicts.length > 5) lines.push(`+${conflicts.length - 5}`);
+  const esc = (t) => String(t).replace(/[&<>"]/g, ch => ({ '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;' }[ch]));
+  showToast('⚠️ მანქანა უკვე დაკავებულია: ' + esc(lines.join('; ')), 'warning');
+}
+WebSocketService.on('edit_request', warnVehicleConflicts);
+WebSocketService.on('update_request', warnVehicleConflicts);
+
 WebSocketService.on('new_request', (msg) => {
   const data = msg.data || {};
+  warnVehicleConflicts(msg);
   const me = localStorage.getItem('jm_session_username') || 'user';
   const author = data.last_editor || data.editor || msg.editor || msg.user || '';
 
@@ -1056,6 +1095,30 @@ WebSocketService.on('request_updated', (msg) => {
   renderRequestList();
 });
 
+// Догоняющая синхронизация после реконнекта: изменённые заявки + id удалённых
+WebSocketService.on('sync_since', (msg) => {
+  if (msg?.full) {
+    // журнал изменений не покрывает разрыв — сервер прислал полную выгрузку
+    initAnnouncements(Array.isArray(msg.data) ? msg.data : []);
+    return;
+  }
+  const deleted = new Set((msg?.deleted || []).map(String));
+  const changed = Array.isArray(msg?.changed) ? msg.changed : [];
+  if (!deleted.size && !changed.length) return;
+
+  for (let i = announcements.length - 1; i >= 0; i--) {
+    if (deleted.has(String(announcements[i].id))) announcements.splice(i, 1);
+  }
+  changed.forEach(req => {
+    if (!Array.isArray(req.comments)) req.comments = [];
+    const idx = announcements.findIndex(r => String(r.id) === String(req.id));
+    if (idx >= 0) announcements[idx] = req; else announcements.push(req);
+    evaluateAutoStatus(req);
+  });
+  setPriorityIds(announcements.filter(r => isPriorityStatus(r.status)).map(r => r.id));
+  renderRequestList();
+});
+
 let newRequestsCount = 0;
 
 function updateAnnouncementsBadge() {
@@ -1097,13 +1160,19 @@ WebSocketService.on('add_comment', (msg) => {
 
   // не дублируем один и тот же комментарий
   const exists = req.comments.find(c =>
-    c && typeof c === 'object' &&
-    c.text === msg.comment?.text &&
-    c.user === msg.comment?.user &&
-    c.timestamp === msg.comment?.timestamp
+    c && typeof c === 'object' && (
+      (c.comment_id && c.comment_id === msg.comment?.comment_id) || (
+        c.text === msg.comment?.text &&
+        c.user === msg.comment?.user &&
+        c.timestamp === msg.comment?.timestamp
+      )
+    )
   );
   if (!exists) {
     req.comments.push(msg.comment);
+    req.comments_total = Math.max(Number(req.comments_total || 0) + 1, req.comments.length);
+  } else if (msg.comment?.comment_id && !exists.comment_id) {
+    exists.comment_id = msg.comment.comment_id;
   }
 
   // ЗВУК + СИСТЕМНОЕ УВЕДОМЛЕНИЕ ТОЛЬКО ЕСЛИ коммент не от меня
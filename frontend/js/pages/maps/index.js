@@ -4,6 +4,14 @@ let _lastMode = 'overview'; // 'overview' | 'focus'
 let _geocodeCache = new Map(); // key: cityName -> {lat, lon}
 let _pending = 0;
 let _drawToken = 0; // ← токен для отмены «устаревших» отрисовок
+let _serverOverview = false; // обзор нарисован из /map/data — перерисовываем при сдвиге/зуме
+
+// Серверные координаты заявок (GeoJSON /map/data на HTTP-сервисе :9101)
+const MAP_DATA_URL = (() => {
+  const host = localStorage.getItem('geo_host') || location.hostname;
+  const port = localStorage.getItem('geo_port') || '9101';
+  return (location.port === port) ? '/map/data' : `${location.protocol}//${host}:${port}/map/data`;
+})();
 
 // ——— Снимаем возможный «скелет»/блюр-оверлей
 function clearLoadingOverlay() {
@@ -79,9 +87,10 @@ export async function openRouteOnMapForRequest(reqOrId) {
   }
   if (!req) { _toast('Заявка не найдена'); return; }
 
-  // 2) Аккуратно достаём точки через ваш хелпер
-  const fromPt = await extractPoint(req, 'from');   // {lat, lon, label} или null
-  const toPt   = await extractPoint(req, 'to');     // {lat, lon, label} или null
+  // 2) Координаты с сервера (посчитаны при сохранении), иначе — через ваш хелпер
+  const srv = await _serverPoints(req.id ?? req.request_id);
+  const fromPt = srv.from || await extractPoint(req, 'from');   // {lat, lon, label} или null
+  const toPt   = srv.to   || await extractPoint(req, 'to');     // {lat, lon, label} или null
   if (!fromPt || !toPt) { _toast('Не удалось определить координаты для маршрута.'); return; }
 
   // Если за это время стартовала другая отрисовка — прекращаем текущую
@@ -161,7 +170,13 @@ export async function showOverviewOnMap() {
   if (token !== _drawToken) return;
 
   _clearMap();
+  _serverOverview = false;
+
+  // 1) Готовый GeoJSON с сервера — без геокодинга в браузере
+  if (await _drawServerOverview(token, true)) return;
+  if (token !== _drawToken) return;
 
+  // 2) Фолбэк: сервис карты недоступен или координаты ещё не посчитаны
   const list = await _getActiveAndPriorityRequests();
   if (!list?.length) { _toast('Активных/приоритетных заявок не найдено'); return; }
 
@@ -211,6 +226,93 @@ export async function showOverviewOnMap() {
   _resizeMapSoon();
 }
 
+// === Обзор из /map/data ===
+async function _fetchMapData(params) {
+  try {
+    // no-cache: браузер шлёт If-None-Match и получает 304, если ничего не менялось
+    const r = await fetch(`${MAP_DATA_URL}?${new URLSearchParams(params)}`, { cache: 'no-cache' });
+    if (!r.ok) return null;
+    const fc = await r.json();
+    return Array.isArray(fc?.features) ? fc : null;
+  } catch {
+    return null;
+  }
+}
+
+async function _serverPoints(id) {
+  const out = { from: null, to: null };
+  if (id == null) return out;
+  const fc = await _fetchMapData({ id, status: 'all' });
+  for (const f of fc?.features || []) {
+    const p = f.properties || {};
+    const [lon, lat] = f.geometry?.coordinates || [];
+    if ((p.kind === 'from' || p.kind === 'to') && Number.isFinite(lat) && Number.isFinite(lon)) {
+      out[p.kind] = { lat, lon, label: p.label || '' };
+    }
+  }
+  return out;
+}
+
+// Рисует обзор по данным сервера; false — данных нет (рисуйте по-старому)
+async function _drawServerOverview(token, fit) {
+  const params = { status: 'active,priority', zoom: _map.getZoom() };
+  if (!fit) {
+    const b = _map.getBounds();
+    params.bbox = [b.getWest(), b.getSouth(), b.getEast(), b.getNorth()].map(v => v.toFixed(4)).join(',');
+  }
+  const fc = await _fetchMapData(params);
+  if (token !== _drawToken) return true;   // пока ждали — началась другая отрисовка
+  if (!fc || (fit && !fc.features.length)) return false;
+
+  _clearMap();
+  _serverOverview = true;
+  const group = L.featureGroup().addTo(_markersLayer);
+
+  for (const f of fc.features) {
+    const p = f.properties || {};
+    const [lon, lat] = f.geometry.coordinates;
+
+    if (p.cluster) {
+      const m = L.circleMarker([lat, lon], { radius: Math.min(8 + Math.sqrt(p.count) * 3, 28), weight: 2 })
+        .bindTooltip(`${p.count} (↑${p.from_count} ↓${p.to_count})`, { direction: 'top', permanent: false })
+        .addTo(group);
+      m.setStyle({ color: '#6e40c9', fillColor: '#6e40c9', fillOpacity: 0.6 });
+      m.on('click', () => _map.setView([lat, lon], Math.min(_map.getZoom() + 2, 18)));
+      continue;
+    }
+
+    const isFrom = p.kind === 'from';
+    const color = isFrom ? '#1a7f37' : '#1f6feb';
+    const m = L.circleMarker([lat, lon], { radius: 6, weight: 1, opacity: 0.9 })
+      .bindTooltip(p.label || (isFrom ? 'Откуда' : 'Куда'), { direction: 'top', offset: [0, -8] })
+      .addTo(group);
+    m.setStyle({ color, fillColor: color, fillOpacity: 0.7 });
+
+    // Тонкая линия между точками — один раз, от «откуда»
+    if (isFrom && Array.isArray(p.other)) {
+      L.polyline([[lat, lon], [p.other[1], p.other[0]]], { weight: 1, opacity: 0.4 }).addTo(_routeLayer);
+    }
+
+    m.on('click', () => {
+      if (window.filterAnnouncementsByCity) {
+        window.filterAnnouncementsByCity(p.label || '');
+        if (typeof window.showSection === 'function') window.showSection('announcements');
+      }
+    });
+  }
+
+  if (fit) _fitAll();
+  _resizeMapSoon();
+  return true;
+}
+
+// Сдвиг/зум в режиме обзора — перезапрос с bbox и кластерами под новый zoom
+function _onMapMoved() {
+  if (_lastMode !== 'overview' || !_serverOverview) return;
+  clearTimeout(_onMapMoved._t);
+  _onMapMoved._t = setTimeout(() => { _drawServerOverview(++_drawToken, false); }, 250);
+}
+
 // === Вспомогательные ===
 function _ensureContainer() {
   const host = document.getElementById('page-maps');
@@ -268,6 +370,8 @@ function _ensureMap() {
   _routeLayer = L.layerGroup().addTo(_map);
   _markersLayer = L.layerGroup().addTo(_map);
 
+  _map.on('moveend', _onMapMoved);
+
   // Автоматический ресайз
   window.addEventListener('resize', _resizeMapSoon);
   setTimeout(_resizeMapSoon, 50);
@@ -2,7 +2,8 @@
 import { WebSocketService } from '../../services/api.js';
 
 // Состояние
-let statuses = []; // [{id, request_id, vehicle_number, load_date, status_text, unloaded, unload_date}]
+let statuses = []; // [{id, request_id, vehicle_number, load_date, status_text, unloaded, unload_date, version}]
+let statusesVersion = 0; // версия последнего применённого снапшота/дельты
 let bound = false;
 
 // Публичный вход
@@ -14,24 +15,70 @@ export function showStatusesSection() {
   // Подписываемся на live-обновления от сервера (единожды)
   if (!window.__statuses_on) {
     window.__statuses_on = true;
-    WebSocketService.on('statuses_sync', (msg) => {
-      const rows = Array.isArray(msg?.data) ? msg.data : [];
-      statuses = rows;
-      fillTable(statuses);
+    WebSocketService.on('statuses_sync', applySnapshot);
+    WebSocketService.on('statuses_delta', applyDelta);
+    // после реконнекта догоняем только пропущенные изменения
+    WebSocketService.on('ws_open', () => {
+      if (statusesVersion > 0) requestSince();
+    });
+    // сервер выбросил часть событий (медленное соединение) — тоже догоняем
+    WebSocketService.on('resync', (msg) => {
+      if (statusesVersion > 0 && (msg?.topics || []).includes('statuses')) requestSince();
     });
   }
+  // рассылка статусов приходит только подписанным клиентам
+  WebSocketService.subscribe('statuses');
 
   // Первоначальный снапшот
   WebSocketService.sendAndWait({ action: 'statuses_sync' }, { want: 'statuses_sync', timeoutMs: 5000 })
-    .then((msg) => {
-      statuses = Array.isArray(msg?.data) ? msg.data : [];
-      fillTable(statuses);
-    })
+    .then(applySnapshot)
     .catch(() => {
       // Молча, оставим пустую таблицу
     });
 }
 
+function applySnapshot(msg) {
+  if (msg?.status === 'error') return;
+  statuses = Array.isArray(msg?.data) ? msg.data : [];
+  statusesVersion = Number(msg?.version || 0);
+  fillTable(statuses);
+}
+
+function requestSince() {
+  try {
+    WebSocketService.send({ action: 'statuses_since', version: statusesVersion });
+  } catch {}
+}
+
+// Точечные изменения: upsert/delete по id строки, версия растёт монотонно
+function applyDelta(msg) {
+  const from = Number(msg?.from_version || 0);
+  if (from > statusesVersion) {
+    // пропустили часть изменений — просим догнать с нашей версии
+    requestSince();
+    return;
+  }
+  const byId = new Map(statuses.map(r => [r.id, r]));
+  for (const d of (msg?.deletes || [])) byId.delete(d.id);
+  for (const row of (msg?.upserts || [])) {
+    const cur = byId.get(row.id);
+    if (!cur || Number(cur.version || 0) <= Number(row.version || 0)) byId.set(row.id, row);
+  }
+  statusesVersion = Math.max(statusesVersion, Number(msg?.version || 0));
+  statuses = sortStatuses([...byId.values()]);
+  fillTable(statuses);
+}
+
+// Тот же порядок, что и на сервере: unloaded ASC, last_updated DESC, request_id, vehicle_number
+function sortStatuses(rows) {
+  return rows.sort((a, b) =>
+    (Number(!!a.unloaded) - Number(!!b.unloaded)) ||
+    String(b.last_updated || '').localeCompare(String(a.last_updated || '')) ||
+    (Number(a.request_id) - Number(b.request_id)) ||
+    String(a.vehicle_number || '').localeCompare(String(b.vehicle_number || ''))
+  );
+}
+
 function renderToolbar() {
   const el = document.getElementById('statuses-filters');
   if (!el) return;
@@ -108,7 +155,7 @@ function bindOnce() {
       unload_date: next ? dateVal : null
     });
 
-    // оптимистично подсветим, сервер всё равно пришлёт statuses_sync
+    // оптимистично подсветим, сервер всё равно пришлёт statuses_delta
     btn.classList.toggle('btn-success', next);
     btn.classList.toggle('btn-outline-secondary', !next);
     btn.textContent = next ? '✅' : '—';
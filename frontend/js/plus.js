@@ -195,7 +195,7 @@ export function plusAnnouncements() {
   // --- Сохранение/отмена ---
   modal.querySelector('#plus-cancel-btn').onclick = closePlusModal;
 
-  modal.querySelector('#plus-form').onsubmit = function(e) {
+  modal.querySelector('#plus-form').onsubmit = async function(e) {
     e.preventDefault();
 
     // --- Проверка обязательных полей ---
@@ -271,6 +271,9 @@ export function plusAnnouncements() {
       }
     }
 
+    // машины, если они уже указаны, не должны быть заняты в других заявках на эти даты
+    if (!(await WebSocketService.confirmVehicleConflicts(data))) return;
+
     // --- здесь отправь data на сервер через WebSocket или куда надо ---
     WebSocketService.sendAndWait({
       action: "add_request",
@@ -1,6 +1,7 @@
 // frontend/js/services/api.js
 
 import { installPriorityRinger, handleWsForPriority } from './notifications.js';
+import { decodeMsgpack } from './msgpack.js';
 // Инициируем глобальный «звонок» (идемпотентно — повторные вызовы безопасны)
 installPriorityRinger();
 
@@ -32,6 +33,38 @@ const WS_HOST_RTR   = localStorage.getItem('ws_host_rtr')   || location.hostname
 const WS_PORT_RTR   = Number(localStorage.getItem('ws_port_rtr') ||
                       (location.protocol === 'https:' ? 443 : 8766));
 const WS_FORCE      = (localStorage.getItem('ws_force') || '').toLowerCase(); // '', 'local', 'rtr'
+// Компактные бинарные кадры от сервера (по желанию): localStorage.setItem('ws_encoding', 'msgpack')
+// Сервер без msgpack выберет jm.json — всё продолжит работать на JSON.
+const WS_PROTOCOLS  = (localStorage.getItem('ws_encoding') || '').toLowerCase() === 'msgpack'
+  ? ['jm.msgpack', 'jm.json'] : [];
+
+// Бинарный кадр файла: "JMF1" | transfer_id (16 байт) | offset (uint64 BE) | данные
+// (формат — backend/services/file_transfer.py)
+const FILE_MAGIC = [0x4A, 0x4D, 0x46, 0x31];
+const FILE_HEADER = 28;
+const FILE_RETRIES = 3;
+
+const hexToBytes = (hex) => Uint8Array.from(hex.match(/../g), b => parseInt(b, 16));
+const bytesToHex = (u8) => Array.from(u8, b => b.toString(16).padStart(2, '0')).join('');
+
+function packFileFrame(transferId, offset, payload) {
+  const frame = new Uint8Array(FILE_HEADER + payload.byteLength);
+  frame.set(FILE_MAGIC, 0);
+  frame.set(hexToBytes(transferId), 4);
+  new DataView(frame.buffer).setBigUint64(20, BigInt(offset));
+  frame.set(new Uint8Array(payload), FILE_HEADER);
+  return frame;
+}
+
+function unpackFileFrame(buf) {
+  const u8 = new Uint8Array(buf);
+  if (u8.length < FILE_HEADER || FILE_MAGIC.some((b, i) => u8[i] !== b)) return null;
+  return {
+    transfer_id: bytesToHex(u8.subarray(4, 20)),
+    offset: Number(new DataView(buf).getBigUint64(20)),
+    data: u8.subarray(FILE_HEADER)
+  };
+}
 
 // На каждой попытке подключения/реконнекта чередуем local↔RTR,
 // используя счётчик WebSocketService.reconnectAttempts.
@@ -72,6 +105,8 @@ export class WebSocketService {
   static callbacks = {};     // { action: Set<fn> }
   static waiters = {};       // { expectedAction: fn(resolve) }
   static pingTimer = null;
+  static revision = 0;       // ревизия заявок, до которой клиент синхронизирован (sync_all / sync_since)
+  static topics = new Set(['requests']);  // топики рассылки; страницы добавляют свои (subscribe)
 
   static responseActions = {
     add_request: 'new_request',
@@ -91,6 +126,22 @@ export class WebSocketService {
     return () => this.off(action, cb);
   }
 
+  // Подписка на топик рассылки сервера ('statuses', 'request:<id>'); переживает реконнект
+  static subscribe(topic) {
+    if (this.topics.has(topic)) return;
+    this.topics.add(topic);
+    if (this.ws && this.ws.readyState === WebSocket.OPEN) {
+      try { this.ws.send(JSON.stringify({ action: 'subscribe', topics: [topic] })); } catch {}
+    }
+  }
+
+  static unsubscribe(topic) {
+    if (!this.topics.delete(topic)) return;
+    if (this.ws && this.ws.readyState === WebSocket.OPEN) {
+      try { this.ws.send(JSON.stringify({ action: 'unsubscribe', topics: [topic] })); } catch {}
+    }
+  }
+
   static off(action, cb) {
     if (this.callbacks[action]) this.callbacks[action].delete(cb);
   }
@@ -108,19 +159,28 @@ export class WebSocketService {
 
     try {
       const url = WS_URL();
-      const ws = new WebSocket(url);
+      const ws = WS_PROTOCOLS.length ? new WebSocket(url, WS_PROTOCOLS) : new WebSocket(url);
+      ws.binaryType = 'arraybuffer';
       this.ws = ws;
 
       ws.onopen = () => {
         this.connected = true;
         this.reconnectAttempts = 0;
+        // локальное событие: страницы могут догнать пропущенное (statuses_since и т.п.)
+        this._emit('ws_open', { action: 'ws_open' });
+
+        // подписки на топики: сервер шлёт только то, что нужно открытым страницам
+        try { ws.send(JSON.stringify({ action: 'subscribe', topics: [...this.topics], replace: true })); } catch {}
 
         // возобновляем сессию, если есть
         const token = localStorage.getItem('jm_session_token');
         if (token) { try { ws.send(JSON.stringify({ action: 'resume_session', token })); } catch {} }
 
-        // первичная синхронизация
-        try { ws.send(JSON.stringify({ action: 'sync_all' })); } catch {}
+        // после реконнекта — только изменения с известной ревизии;
+        // холодный старт (revision = 0) делает syncAllPaged постранично
+        if (this.revision > 0) {
+          try { ws.send(JSON.stringify({ action: 'sync_since', revision: this.revision })); } catch {}
+        }
 
         // лёгкий ping, чтобы не засыпало соединение (не обязателен для сервера)
         clearInterval(this.pingTimer);
@@ -133,9 +193,25 @@ export class WebSocketService {
 
       ws.onmessage = (ev) => {
         let msg = null;
-        try { msg = JSON.parse(ev.data); } catch { return; }
+        if (ev.data instanceof ArrayBuffer) {
+          // бинарный кадр: файл (начинается с "JMF1") или сообщение в MessagePack
+          const chunk = unpackFileFrame(ev.data);
+          if (chunk) { this._emit('file_chunk', chunk); return; }
+          try { msg = decodeMsgpack(ev.data); } catch { return; }
+        } else {
+          try { msg = JSON.parse(ev.data); } catch { return; }
+        }
         const act = msg?.action || msg?.type || 'message';
-        // ...
+        // сервер выбросил часть событий (мы не успевали читать) — догоняем заявки по ревизии,
+        // остальные топики догоняют страницы (подписка на 'resync')
+        // (до конца холодного старта ревизии нет — тогда догонит сам syncAllPaged)
+        if (act === 'resync' && this.revision > 0) {
+          try { ws.send(JSON.stringify({ action: 'sync_since', revision: this.revision })); } catch {}
+        }
+        // запоминаем ревизию полной выгрузки/дельты (страницы sync_all учитывает syncAllPaged)
+        if ((act === 'sync_since' || (act === 'sync_all' && msg.next_cursor === undefined)) && msg.revision) {
+          this.revision = Number(msg.revision) || this.revision;
+        }
         // 1) waiter (sendAndWait) — поддержка массива ожидателей
         const bucket = this.waiters[act];
         if (Array.isArray(bucket) && bucket.length) {
@@ -194,6 +270,161 @@ export class WebSocketService {
     }
   }
 
+  // Холодный старт постранично: sync_all с курсором, затем sync_since с ревизии первой страницы,
+  // чтобы догнать правки, случившиеся во время выгрузки. Возвращает { data, revision }.
+  static async syncAllPaged(limit = 500) {
+    const all = [];
+    let cursor = 0;
+    let firstRevision = null;
+    for (;;) {
+      // ждём именно ответ на эту страницу: непостраничные sync_all (без cursor/next_cursor) пропускаем
+      const requested = cursor;
+      const reply = this.waitFor('sync_all', m => m && 'next_cursor' in m && m.cursor === requested);
+      this.send({ action: 'sync_all', limit, cursor });
+      const page = await reply;
+      const rows = Array.isArray(page?.data) ? page.data : [];
+      all.push(...rows);
+      if (firstRevision === null) firstRevision = Number(page?.revision || 0);
+      if (!page.next_cursor) break;
+      cursor = page.next_cursor;
+    }
+    this.revision = firstRevision || 0;
+    if (this.revision > 0) {
+      try { this.send({ action: 'sync_since', revision: this.revision }); } catch {}
+    }
+    return { action: 'sync_all', data: all, revision: this.revision };
+  }
+
+  // Поиск заявок на сервере: { filters: {status, date_from, date_to, from, to, last_editor, vehicle},
+  // sort: 'id'|'loading_date'|'revision', order: 'asc'|'desc', limit, cursor } -> { data, next_cursor }
+  static _queryId = 0;
+  static queryRequests({ filters = {}, sort = 'id', order = 'desc', limit = 100, cursor = null } = {}) {
+    const queryId = ++this._queryId;
+    const reply = this.waitFor('query_requests', m => m.query_id === queryId);
+    this.send({ action: 'query_requests', query_id: queryId, filters, sort, order, limit, cursor });
+    return reply.then(msg => {
+      if (msg.status !== 'success') throw new Error('query_requests failed');
+      return { data: msg.data || [], next_cursor: msg.next_cursor || null };
+    });
+  }
+
+  // История машины: заявки с этим номером ТС, новые первыми -> { vehicle_number, data, next_cursor }
+  static _historyId = 0;
+  static vehicleHistory(vehicleNumber, { limit = 50, beforeId = null } = {}) {
+    const historyId = ++this._historyId;
+    const reply = this.waitFor('vehicle_history', m => m.history_id === historyId);
+    this.send({ action: 'vehicle_history', history_id: historyId, vehicle_number: vehicleNumber, limit, before_id: beforeId });
+    return reply.then(msg => {
+      if (msg.status !== 'success') throw new Error('vehicle_history failed');
+      return { vehicle_number: msg.vehicle_number, data: msg.data || [], next_cursor: msg.next_cursor || null };
+    });
+  }
+
+  // Машины черновика заявки, уже занятые в других незакрытых заявках на те же даты
+  static _checkId = 0;
+  static checkVehicleConflicts(draft, requestId = null) {
+    const checkId = ++this._checkId;
+    const reply = this.waitFor('check_vehicle_conflicts', m => m.check_id === checkId);
+    this.send({ action: 'check_vehicle_conflicts', check_id: checkId, id: requestId, data: draft });
+    return reply.then(msg => {
+      if (msg.status !== 'success') throw new Error('check_vehicle_conflicts failed');
+      return msg.conflicts || [];
+    });
+  }
+
+  // Перед сохранением формы: если машины черновика уже заняты в других заявках на те же даты —
+  // спросить диспетчера. true — сохраняем (конфликтов нет, подтвердили или проверка не удалась)
+  static async confirmVehicleConflicts(draft, requestId = null) {
+    if (!Array.isArray(draft?.drivers) || !draft.drivers.length) return true;
+    let conflicts = [];
+    try { conflicts = await this.checkVehicleConflicts(draft, requestId); } catch { return true; }
+    if (!conflicts.length) return true;
+    const lines = conflicts.slice(0, 10).map(c =>
+      `${c.vehicle_number} — #${c.request_id} (${c.date_from}${c.date_to && c.date_to !== c.date_from ? ' … ' + c.date_to : ''})`);
+    if (conflicts.length > 10) lines.push(`+${conflicts.length - 10}`);
+    return window.confirm('Машина уже занята в других заявках на эти даты:\n' + lines.join('\n') + '\n\nВсё равно сохранить?');
+  }
+
+  // Ждать сообщение action, удовлетворяющее условию (без отправки запроса)
+  static waitFor(action, match, timeoutMs = 15000) {
+    return new Promise((resolve, reject) => {
+      let off = null;
+      const to = setTimeout(() => { off?.(); reject(new Error('Сервер не ответил')); }, timeoutMs);
+      off = this.on(action, (msg) => {
+        if (!match(msg)) return;
+        clearTimeout(to);
+        off();
+        resolve(msg);
+      });
+    });
+  }
+
+  // Загрузка файла бинарными чанками с докачкой после обрыва. Возвращает { name, url }.
+  static async uploadFile(file, requestId, onProgress) {
+    let transferId = null;
+    for (let attempt = 0; ; attempt++) {
+      try {
+        const begin = await this.sendAndWait({
+          action: 'upload_begin', request_id: requestId, filename: file.name,
+          size: file.size, transfer_id: transferId
+        }, 'upload_begin');
+        if (begin.status !== 'ok') throw new Error(begin.error || 'upload_begin failed');
+        transferId = begin.transfer_id;
+        let offset = Number(begin.offset || 0);
+        const chunkSize = Number(begin.chunk_size || 256 * 1024);
+
+        while (offset < file.size) {
+          const payload = await file.slice(offset, offset + chunkSize).arrayBuffer();
+          const ack = this.waitFor('upload_ack', m => m.transfer_id === transferId, 30000);
+          this._ensureOpen().send(packFileFrame(transferId, offset, payload));
+          const resp = await ack;
+          if (resp.status === 'error') throw new Error(resp.error || 'upload failed');
+          offset = Number(resp.offset);  // ok — следующий чанк, resync — с позиции сервера
+          onProgress?.(offset, file.size);
+        }
+
+        const done = await this.sendAndWait({ action: 'upload_commit', transfer_id: transferId }, 'upload_commit');
+        if (done.status !== 'ok') throw new Error(done.error || 'upload_commit failed');
+        return done.file || { name: file.name };
+      } catch (e) {
+        if (attempt >= FILE_RETRIES) throw e;
+        await new Promise(r => setTimeout(r, 1000 * (attempt + 1)));
+      }
+    }
+  }
+
+  // Скачивание файла бинарными чанками с докачкой после обрыва. Возвращает Blob.
+  static async downloadFile(taskId, filename, onProgress) {
+    const parts = [];
+    let received = 0;
+    for (let attempt = 0; ; attempt++) {
+      let off = null;
+      try {
+        const begin = await this.sendAndWait(
+          { action: 'download_begin', task_id: taskId, filename, offset: received }, 'download_begin');
+        if (begin.status !== 'ok') throw new Error(begin.error || 'File not found');
+        const { transfer_id: transferId, size } = begin;
+
+        const finished = this.waitFor('download_end', m => m.transfer_id === transferId, 120000);
+        off = this.on('file_chunk', (chunk) => {
+          if (chunk.transfer_id !== transferId || chunk.offset !== received) return;
+          parts.push(chunk.data.slice());
+          received += chunk.data.byteLength;
+          onProgress?.(received, size);
+        });
+        const end = await finished;
+        if (end.status === 'error') throw new Error(end.error || 'download failed');
+        if (received < size) throw new Error('download interrupted');
+        return new Blob(parts);
+      } catch (e) {
+        if (attempt >= FILE_RETRIES || /not found/i.test(e.message)) throw e;
+        await new Promise(r => setTimeout(r, 1000 * (attempt + 1)));
+      } finally {
+        off?.();
+      }
+    }
+  }
+
   // Отправка с ожиданием конкретного ответа (action)
   static sendAndWait(data, expectedAction) {
     const ws = this._ensureOpen();
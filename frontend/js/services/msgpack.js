@@ -0,0 +1,69 @@
+// frontend/js/services/msgpack.js
+// Декодер MessagePack для бинарных кадров сервера (подпротокол jm.msgpack).
+// Только чтение: клиент по-прежнему отправляет JSON-текст.
+
+const utf8 = new TextDecoder('utf-8');
+
+export function decodeMsgpack(buf) {
+  const u8 = buf instanceof Uint8Array ? buf : new Uint8Array(buf);
+  const view = new DataView(u8.buffer, u8.byteOffset, u8.byteLength);
+  let pos = 0;
+
+  const str = (len) => { const s = utf8.decode(u8.subarray(pos, pos + len)); pos += len; return s; };
+  const bin = (len) => { const b = u8.slice(pos, pos + len); pos += len; return b; };
+  const arr = (len) => { const a = new Array(len); for (let i = 0; i < len; i++) a[i] = read(); return a; };
+  const map = (len) => {
+    const o = {};
+    for (let i = 0; i < len; i++) { const k = read(); o[k] = read(); }
+    return o;
+  };
+  const u64 = () => { const v = view.getBigUint64(pos); pos += 8; return Number(v); };
+  const i64 = () => { const v = view.getBigInt64(pos); pos += 8; return Number(v); };
+  const ext = (len) => { const type = view.getInt8(pos); pos += 1; return { type, data: bin(len) }; };
+
+  function read() {
+    const b = u8[pos++];
+    if (b <= 0x7f) return b;
+    if (b <= 0x8f) return map(b & 0x0f);
+    if (b <= 0x9f) return arr(b & 0x0f);
+    if (b <= 0xbf) return str(b & 0x1f);
+    if (b >= 0xe0) return b - 0x100;
+    let v;
+    switch (b) {
+      case 0xc0: return null;
+      case 0xc2: return false;
+      case 0xc3: return true;
+      case 0xc4: v = u8[pos]; pos += 1; return bin(v);
+      case 0xc5: v = view.getUint16(pos); pos += 2; return bin(v);
+      case 0xc6: v = view.getUint32(pos); pos += 4; return bin(v);
+      case 0xc7: v = u8[pos]; pos += 1; return ext(v);
+      case 0xc8: v = view.getUint16(pos); pos += 2; return ext(v);
+      case 0xc9: v = view.getUint32(pos); pos += 4; return ext(v);
+      case 0xca: v = view.getFloat32(pos); pos += 4; return v;
+      case 0xcb: v = view.getFloat64(pos); pos += 8; return v;
+      case 0xcc: v = u8[pos]; pos += 1; return v;
+      case 0xcd: v = view.getUint16(pos); pos += 2; return v;
+      case 0xce: v = view.getUint32(pos); pos += 4; return v;
+      case 0xcf: return u64();
+      case 0xd0: v = view.getInt8(pos); pos += 1; return v;
+      case 0xd1: v = view.getInt16(pos); pos += 2; return v;
+      case 0xd2: v = view.getInt32(pos); pos += 4; return v;
+      case 0xd3: return i64();
+      case 0xd4: return ext(1);
+      case 0xd5: return ext(2);
+      case 0xd6: return ext(4);
+      case 0xd7: return ext(8);
+      case 0xd8: return ext(16);
+      case 0xd9: v = u8[pos]; pos += 1; return str(v);
+      case 0xda: v = view.getUint16(pos); pos += 2; return str(v);
+      case 0xdb: v = view.getUint32(pos); pos += 4; return str(v);
+      case 0xdc: v = view.getUint16(pos); pos += 2; return arr(v);
+      case 0xdd: v = view.getUint32(pos); pos += 4; return arr(v);
+      case 0xde: v = view.getUint16(pos); pos += 2; return map(v);
+      case 0xdf: v = view.getUint32(pos); pos += 4; return map(v);
+      default: throw new Error(`msgpack: unknown byte 0x${b.toString(16)}`);
+    }
+  }
+
+  return read();
+}